@@ -0,0 +1,158 @@
+"""
+作者索引：作者名 -> 小传在作者文件中的字节位置 + 全部作品的记录编号
+
+小传来自 全唐诗/authors.tang.json、全唐诗/authors.song.json 和 宋词/author.song.json，
+作品来自各分片集合的偏移索引（需先运行 python shard_index.py）。
+查询时只 seek 读出一条小传，不再整体解析 3.5 MB 的作者文件。
+作者名按繁简归一后的简体建索引（全唐诗作者名为繁体，宋词为简体），查询时同样先归一，
+王维、王維查到的是同一位作者，两种写法下的作品合在一起。
+
+索引文件布局（小端，data/index/authors.idx）：
+    头部      magic, 版本, 小传来源数, 作者数, 作品编号总数
+    来源表    路径长度(u16) + 相对路径
+    作者表    名称长度(u16) + 名称 + 来源(u8, 255 表示无小传) + 偏移(u32) + 长度(u32)
+              + 作品数(u32) + 作品起点(u32)
+    作品表    u32 文档编号（见 corpus.pack_doc_id）
+
+使用方法：
+    python author_index.py
+"""
+import json
+import mmap
+import os
+import struct
+
+from corpus import COLLECTION_NAMES, CORPUS_DIR, index_path, pack_doc_id, unpack_doc_id
+from normalize import get_converter
+from shard_index import open_shard_index, scan_shard
+
+MAGIC = b"PSAUT\x00\x00\x02"
+VERSION = 2
+HEADER = struct.Struct("<8sIIII")
+AUTHOR = struct.Struct("<BIIII")
+NO_BIO = 255
+AUTHORS_PATH = index_path("authors.idx")
+
+# 小传来源：(相对路径, 小传字段)，同名作者取先出现的一条
+BIO_SOURCES = [
+    ("全唐诗/authors.tang.json", "desc"),
+    ("全唐诗/authors.song.json", "desc"),
+    ("宋词/author.song.json", "description"),
+]
+
+
+# ===== 构建 =====
+def build_author_index(output=AUTHORS_PATH):
+    """合并小传位置和各集合的作者倒排（作者名归一成简体），返回作者数"""
+    convert = get_converter().convert
+    bios = {}
+    for source, (rel, _) in enumerate(BIO_SOURCES):
+        for offset, length, author in scan_shard(os.path.join(CORPUS_DIR, rel)):
+            name = convert(author.get("name") or "")
+            if name and name not in bios:
+                bios[name] = (source, offset, length)
+
+    poems = {}
+    for collection in COLLECTION_NAMES:
+        index = open_shard_index(collection)
+        if index is None:
+            continue
+        for name in index.authors:
+            if name:
+                poems.setdefault(convert(name), []).extend(
+                    pack_doc_id(collection, gid) for gid in index.author_records(name))
+    # 几种写法归到同一作者时，作品按文档编号重新排好
+    for posts in poems.values():
+        posts.sort()
+
+    names = sorted(set(bios) | set(poems))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    total = sum(len(p) for p in poems.values())
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(BIO_SOURCES), len(names), total))
+        for rel, _ in BIO_SOURCES:
+            raw = rel.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw)
+        start = 0
+        for name in names:
+            source, offset, length = bios.get(name, (NO_BIO, 0, 0))
+            count = len(poems.get(name, ()))
+            raw = name.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw)
+            f.write(AUTHOR.pack(source, offset, length, count, start))
+            start += count
+        for name in names:
+            posts = poems.get(name, ())
+            f.write(struct.pack(f"<{len(posts)}I", *posts))
+    os.replace(tmp, output)
+    return len(names)
+
+
+# ===== 读取 =====
+class AuthorIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_sources, n_authors, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"作者索引格式不匹配: {path}")
+        pos = HEADER.size
+        self.sources = []
+        for _ in range(n_sources):
+            (path_len,) = struct.unpack_from("<H", self.mm, pos)
+            self.sources.append(os.path.join(CORPUS_DIR, self.mm[pos + 2:pos + 2 + path_len].decode("utf-8")))
+            pos += 2 + path_len
+        # 作者名 -> (来源, 偏移, 长度, 作品数, 作品起点)
+        self.authors = {}
+        for _ in range(n_authors):
+            (name_len,) = struct.unpack_from("<H", self.mm, pos)
+            name = self.mm[pos + 2:pos + 2 + name_len].decode("utf-8")
+            pos += 2 + name_len
+            self.authors[name] = AUTHOR.unpack_from(self.mm, pos)
+            pos += AUTHOR.size
+        self._posts_pos = pos
+
+    def entry(self, name):
+        """作者名（繁简均可）-> (来源, 偏移, 长度, 作品数, 作品起点)，没有时返回 None"""
+        return self.authors.get(get_converter().convert(name))
+
+    def __contains__(self, name):
+        return self.entry(name) is not None
+
+    def bio(self, name):
+        """读取作者小传，没有小传时返回空字符串"""
+        source, offset, length, _, _ = self.entry(name)
+        if source == NO_BIO:
+            return ""
+        with open(self.sources[source], "rb") as f:
+            f.seek(offset)
+            author = json.loads(f.read(length))
+        return author.get(BIO_SOURCES[source][1]) or ""
+
+    def poem_count(self, name):
+        return self.entry(name)[3]
+
+    def poems(self, name, offset=0, limit=20):
+        """分页返回作品 [(集合名, 全局编号)]"""
+        _, _, _, count, start = self.entry(name)
+        offset = max(offset, 0)
+        limit = min(limit, count - offset)
+        if limit <= 0:
+            # 页码超出范围：起点已在作品表之外，不能再去读
+            return []
+        posts = struct.unpack_from(f"<{limit}I", self.mm, self._posts_pos + (start + offset) * 4)
+        return [unpack_doc_id(p) for p in posts]
+
+
+def open_author_index(path=AUTHORS_PATH):
+    try:
+        return AuthorIndex(path)
+    except (OSError, ValueError) as e:
+        print("作者索引加载失败:", e)
+        return None
+
+
+if __name__ == "__main__":
+    count = build_author_index()
+    print(f"✅ 已生成 {AUTHORS_PATH}：{count} 位作者")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成《中华新韵》十四韵 JSON 文件（基于 3500 常用字），收录多音字的全部读音
+
+原来的生成脚本（生成中华新韵文件.ipynb）只取 lazy_pinyin 的第一个读音，
+行、长 这类多音字只会落在一个韵部里。这里对每个读音分别归部：
+    - 读音来自 pypinyin 的 heteronym 模式，首个读音以外的读音须在 pypinyin 词组库中出现过
+    - duoyinzi.txt 中列出的字以该表为准（去掉生僻读音、补上缺的读音）
+    - 韵部下新增 duyin 字段：字 -> 把它归入该韵部的读音（带声调，多个以空格分隔）
+另外补上了原脚本漏掉的韵母 iou（七尤，如 流、秋）、uen（九文，如 论、春）和 ueng（十一庚，如 翁），
+原来这些字没有进任何韵部。
+
+使用方法：
+    1. 安装依赖: pip install pypinyin
+    2. 运行: python build_xinyun.py
+    3. 生成 zhonghua_xinyun.json
+"""
+import json
+import os
+
+from pypinyin import Style, pinyin
+from pypinyin.contrib.tone_convert import to_finals, to_normal
+from pypinyin.phrases_dict import phrases_dict
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+CHARS_PATH = os.path.join(BASE, "常用汉字表.txt")
+SUPPLEMENT_PATH = os.path.join(BASE, "duoyinzi.txt")
+OUTPUT_PATH = os.path.join(BASE, "zhonghua_xinyun.json")
+
+# === 中华新韵 14 韵部定义（韵母 → 韵部）===
+yunmu_to_yunbu = {
+    # 一麻 a, ia, ua
+    'a': '一麻', 'ia': '一麻', 'ua': '一麻',
+    # 二波 o, e, uo
+    'o': '二波', 'e': '二波', 'uo': '二波',
+    # 三皆 ie, üe
+    'ie': '三皆', 'üe': '三皆',
+    # 四开 ai, uai
+    'ai': '四开', 'uai': '四开',
+    # 五微 ei, uei
+    'ei': '五微', 'uei': '五微',
+    # 六豪 ao, iao
+    'ao': '六豪', 'iao': '六豪',
+    # 七尤 ou, iou
+    'ou': '七尤', 'iou': '七尤',
+    # 八寒 an, ian, uan, üan
+    'an': '八寒', 'ian': '八寒', 'uan': '八寒', 'üan': '八寒',
+    # 九文 en, in, uen, ün
+    'en': '九文', 'in': '九文', 'uen': '九文', 'ün': '九文',
+    # 十唐 ang, iang, uang
+    'ang': '十唐', 'iang': '十唐', 'uang': '十唐',
+    # 十一庚 eng, ing, ong, iong, ueng
+    'eng': '十一庚', 'ing': '十一庚', 'ong': '十一庚', 'iong': '十一庚', 'ueng': '十一庚',
+    # 十二齐 i, er, ü
+    'i': '十二齐', 'er': '十二齐', 'ü': '十二齐',
+    # 十四姑 u
+    'u': '十四姑'
+}
+
+# 特殊拼音（舌尖音）归“十三支”
+zhichi_shiri_zici = {'zhi', 'chi', 'shi', 'ri', 'zi', 'ci', 'si'}
+
+yunbu_list = [
+    "一麻", "二波", "三皆", "四开", "五微", "六豪", "七尤",
+    "八寒", "九文", "十唐", "十一庚", "十二齐", "十三支", "十四姑"
+]
+
+
+def load_common_chars(path=CHARS_PATH, limit=3500):
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    return ''.join(ch for ch in content if '一' <= ch <= '鿿')[:limit]
+
+
+def load_supplement(path=SUPPLEMENT_PATH):
+    """读取多音字补充表：字 -> 读音列表"""
+    table = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            ch, _, readings = line.partition("\t")
+            if ch and readings.split():
+                table[ch] = readings.split()
+    return table
+
+
+def phrase_readings():
+    """pypinyin 词组库中实际用到的读音：字 -> 读音集合"""
+    used = {}
+    for phrase, readings in phrases_dict.items():
+        if len(phrase) != len(readings):
+            continue
+        for ch, reading in zip(phrase, readings):
+            used.setdefault(ch, set()).update(reading)
+    return used
+
+
+def readings_of(ch, supplement, used):
+    """
+    一个字的全部读音：补充表优先；否则取 pypinyin 的多音读音，
+    第一个读音总是保留，其余读音要在词组库里出现过（去掉 年 nìng、休 xù 这类生僻读音）
+    """
+    if ch in supplement:
+        return supplement[ch]
+    readings = pinyin(ch, style=Style.TONE, heteronym=True)[0]
+    return readings[:1] + [r for r in readings[1:] if r in used.get(ch, ())]
+
+
+def yunbu_of(reading):
+    """一个带声调读音 -> (韵部, 韵母)；无法归部时返回 (None, None)"""
+    if to_normal(reading) in zhichi_shiri_zici:
+        return "十三支", None
+    yunmu = to_finals(reading).replace('v', 'ü')
+    return yunmu_to_yunbu.get(yunmu), yunmu
+
+
+def build_xinyun(chars, supplement):
+    used = phrase_readings()
+    yun_dict = {name: {"yunmu": [], "zi": [], "duyin": {}} for name in yunbu_list}
+    missing = []
+    for ch in dict.fromkeys(chars + ''.join(supplement)):
+        placed = False
+        for reading in readings_of(ch, supplement, used):
+            yunbu, yunmu = yunbu_of(reading)
+            if yunbu is None:
+                continue
+            placed = True
+            group = yun_dict[yunbu]
+            if ch not in group["duyin"]:
+                group["zi"].append(ch)
+                group["duyin"][ch] = []
+            if reading not in group["duyin"][ch]:
+                group["duyin"][ch].append(reading)
+            if yunmu and yunmu not in group["yunmu"]:
+                group["yunmu"].append(yunmu)
+        if not placed:
+            missing.append(ch)
+
+    # === 排序 ===
+    for group in yun_dict.values():
+        group["zi"].sort()
+        group["yunmu"].sort()
+        # 同一韵部内的多个读音用空格分隔，保持文件紧凑
+        group["duyin"] = {ch: " ".join(group["duyin"][ch]) for ch in group["zi"]}
+    return yun_dict, missing
+
+
+if __name__ == "__main__":
+    common_chars = load_common_chars()
+    supplement = load_supplement()
+    print(f"✅ 已加载 {len(common_chars)} 个汉字，多音字补充 {len(supplement)} 条")
+    yun_dict, missing = build_xinyun(common_chars, supplement)
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        json.dump(yun_dict, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 已生成文件 {OUTPUT_PATH}")
+    multi = {ch for group in yun_dict.values() for ch in group["zi"]
+             if sum(ch in g["duyin"] for g in yun_dict.values()) > 1}
+    print(f"📊 跨韵部的多音字 {len(multi)} 个，无法归部 {len(missing)} 个: {''.join(missing)}")
+    for yunbu, data in yun_dict.items():
+        print(f"   {yunbu}: {len(data['zi'])} 个字")
@@ -0,0 +1,382 @@
+"""
+词牌格律校验：static/cipai.json 中每个词牌的 tone_pattern 在加载时编译一次，提交时逐字比对
+
+tone_pattern 每句一个字符串，每字一个符号（、 , 和空格只是句中停顿，编译时去掉）：
+    ○ 平    ● 仄    ◎ 可平可仄（本平）    ◉ 可平可仄（本仄）    △ 平声韵脚    ▲ 仄声韵脚
+（填词页面的说明里写作 ⊚ / ⊙，一并接受。）
+编译后每个词牌是几组按字排列的约束数组：每字须平 / 须仄 / 不限，以及韵脚所在的位置，
+校验一首词只是一遍查表，不再每次解析符号串。
+
+押韵：连续的同类韵脚（一串 △ 或一串 ▲）算一段，每段的韵脚字须有共同的韵部。
+tone_pattern 只标了韵脚的平仄，没有标哪几处同韵，所以平仄转换处按换韵处理：
+《相见欢》前平后仄、《菩萨蛮》两仄两平交替换韵，都不会被误判为不押韵。
+字的平仄取自紧凑声调表（见 pingze.tone_of），查不到的字和平仄两收的字只标记为不定，不算错。
+韵书默认用词林正韵（yun_index.CI_BOOK）：词的用韵宽于近体诗，上去通押、邻韵相押都很常见。
+
+使用方法：
+    python cipai.py 十六字令 "山，快马加鞭未下鞍。惊回首，离天三尺三。"
+    python cipai.py 浣溪沙 -f ci.txt --book pingshui --json
+    python cipai.py bench                 # 用各词牌的例词测每首的校验耗时
+    python cipai.py identify "..."        # 识别一首未标词牌的词
+
+识别词牌（CipaiIndex）：按各句字数建一棵前缀树，另按总字数分桶。一首词先沿前缀树逐句走
+（相邻几句字数之和恰好是某个子节点时也可合并着走，容许用户在句中多点了逗号），
+走不通时再取总字数相同的词牌按各自的句式重新切分；候选按匹配层级、平仄错字比例、押韵段排序。
+查找只与这首词的句数有关，与收录多少词牌无关。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from corpus import BASE, load_json
+from pingze import ANY, NAMES, check_rhyme, tone_of
+from tone_table import PING, ZE, get_tone_table
+from yun_index import CI_BOOK, PUNCTUATION, get_book
+
+CIPAI_PATH = os.path.join(BASE, "static", "cipai.json")
+
+# 符号 -> (要求, 本声)；要求为 ANY 时本声只作提示
+MARKS = {
+    "○": (PING, PING), "●": (ZE, ZE),
+    "◎": (ANY, PING), "⊚": (ANY, PING),
+    "◉": (ANY, ZE), "⊙": (ANY, ZE),
+    "△": (PING, PING), "▲": (ZE, ZE),
+}
+RHYME_MARKS = {"△": PING, "▲": ZE}
+PAUSES = set("、,， ")
+RHYME_NAMES = {PING: "平韵", ZE: "仄韵"}
+
+# 词的分句比 corpus.split_sentences 多按冒号断开；顿号、引号等不断句，直接去掉
+_CI_SPLIT = re.compile(r"[，。！？；：,.!?;:]")
+
+
+def split_ci(paragraphs):
+    """词的各段文字 -> 句子列表"""
+    lines = []
+    for para in paragraphs:
+        for s in _CI_SPLIT.split(para):
+            s = "".join(ch for ch in s if ch not in PUNCTUATION and not ch.isspace())
+            if s:
+                lines.append(s)
+    return lines
+
+
+class CipaiPattern:
+    """
+    一个词牌编译后的格律：
+        widths   每句字数
+        codes    每句每字的要求（ANY / PING / ZE），与 pingze 的模板编号一致
+        prefer   每句每字的本声（◎ / ◉ 的推荐平仄）
+        rhymes   押韵段 [(韵类, ((句下标, 字下标), ...))]，韵类为 PING（△）或 ZE（▲）
+        patterns 去掉停顿后的符号串，用于展示
+        flat     codes 首尾相接，识别词牌时与整首词逐字比对
+    """
+    __slots__ = ("name", "widths", "codes", "prefer", "rhymes", "patterns", "flat")
+
+    def __init__(self, name, patterns):
+        self.name = name
+        self.patterns = tuple(patterns)
+        self.widths = tuple(len(p) for p in self.patterns)
+        self.codes = tuple(tuple(MARKS[m][0] for m in p) for p in self.patterns)
+        self.prefer = tuple(tuple(MARKS[m][1] for m in p) for p in self.patterns)
+        self.flat = tuple(code for codes in self.codes for code in codes)
+        # 韵脚多在句末，也有用逗号合成一句的两个分句（如《清平乐》下阕），韵脚在句中；
+        # 按出现顺序把相邻的同类韵脚归为一段
+        runs = []
+        for i, p in enumerate(self.patterns):
+            for j, mark in enumerate(p):
+                kind = RHYME_MARKS.get(mark)
+                if kind is None:
+                    continue
+                if runs and runs[-1][0] == kind:
+                    runs[-1][1].append((i, j))
+                else:
+                    runs.append((kind, [(i, j)]))
+        self.rhymes = tuple((kind, tuple(slots)) for kind, slots in runs)
+
+
+def compile_cipai(name, data):
+    """一个词牌的 JSON -> CipaiPattern；符号不认识或字数与 sections 不符时抛出 ValueError"""
+    sections = data.get("sections") or []
+    raw = data.get("tone_pattern") or []
+    if len(raw) != len(sections):
+        raise ValueError(f"《{name}》tone_pattern 有 {len(raw)} 句，sections 有 {len(sections)} 句")
+    patterns = []
+    for i, (text, section) in enumerate(zip(raw, sections)):
+        pattern = "".join(m for m in text if m not in PAUSES)
+        unknown = set(pattern) - MARKS.keys()
+        if unknown:
+            raise ValueError(f"《{name}》第{i + 1}句有不认识的符号 {''.join(sorted(unknown))}")
+        if len(pattern) != section.get("chars"):
+            raise ValueError(f"《{name}》第{i + 1}句格律 {len(pattern)} 字，sections 为 {section.get('chars')} 字")
+        patterns.append(pattern)
+    return CipaiPattern(name, patterns)
+
+
+def compile_all(cipai_data):
+    """词牌名 -> CipaiPattern；有问题的词牌打印原因后跳过（填词页面照常可用，只是不做格律校验）"""
+    compiled = {}
+    for name, data in cipai_data.items():
+        try:
+            compiled[name] = compile_cipai(name, data)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"词牌格律编译失败: {e}")
+    return compiled
+
+
+# ===== 校验 =====
+def validate(pattern, lines, book=None):
+    """
+    按编译好的词牌格律校验一首词，lines 为每句的文字（句数须与词牌一致，否则抛出 ValueError）
+    book 为韵书名（默认词林正韵）
+    返回 dict：整体结论、逐句逐字的平仄比对、每个押韵段的押韵情况
+    """
+    lines = [line.strip() for line in lines]
+    if len(lines) != len(pattern.widths):
+        raise ValueError(f"《{pattern.name}》需 {len(pattern.widths)} 句，实际 {len(lines)} 句")
+    rhyme_book = get_book(book or CI_BOOK)
+    if rhyme_book is None:
+        raise ValueError(f"未知韵书 '{book}'")
+    tones = get_tone_table()
+
+    report_lines = []
+    errors = unknown = 0
+    for text, symbols, codes, prefer in zip(lines, pattern.patterns, pattern.codes, pattern.prefer):
+        entry = {"text": text, "pattern": symbols, "rhyme": any(m in RHYME_MARKS for m in symbols)}
+        if len(text) != len(codes):
+            entry.update(ok=False, error=f"需{len(codes)}字", chars=[])
+            errors += len(codes)
+            report_lines.append(entry)
+            continue
+        chars = []
+        line_errors = 0
+        for ch, expected, hint in zip(text, codes, prefer):
+            tone = tone_of(ch, tones)
+            ok = expected == ANY or tone == ANY or tone == expected
+            if tone == ANY:
+                unknown += 1
+            elif not ok:
+                line_errors += 1
+            chars.append({"char": ch, "tone": NAMES.get(tone), "expected": NAMES.get(expected, "中"),
+                          "prefer": NAMES[hint], "ok": ok})
+        errors += line_errors
+        entry.update(ok=not line_errors, chars=chars)
+        report_lines.append(entry)
+
+    rhymes = []
+    for kind, slots in pattern.rhymes:
+        # 字数不对的句子取不到韵脚，不参与判断
+        slots = [(i, j) for i, j in slots if len(lines[i]) == pattern.widths[i]]
+        rhyme_chars = [lines[i][j] for i, j in slots]
+        yuns = check_rhyme(rhyme_chars, rhyme_book)
+        rhymes.append({"kind": RHYME_NAMES[kind], "lines": sorted({i for i, _ in slots}), "chars": rhyme_chars,
+                       "yun": yuns, "ok": yuns is None or bool(yuns)})
+    return {
+        "cipai": pattern.name,
+        "book": rhyme_book.name,
+        "ok": not errors and all(r["ok"] for r in rhymes),
+        "errors": errors,
+        "unknown": unknown,
+        "lines": report_lines,
+        "rhymes": rhymes,
+    }
+
+
+def format_report(report):
+    """命令行输出：每句下面标出格律，错字用 ^ 标记"""
+    out = [f"《{report['cipai']}》：{'合律' if report['ok'] else '不合律'}"
+           f"（错 {report['errors']} 字，平仄不定 {report['unknown']} 字）"]
+    for line in report["lines"]:
+        out.append(f"  {line['text']}")
+        out.append(f"  {line['pattern']}")
+        if line.get("error"):
+            out.append(f"  {line['error']}")
+        elif not line["ok"]:
+            out.append("  " + "".join("＾" if not c["ok"] else "　" for c in line["chars"]))
+    for rhyme in report["rhymes"]:
+        yun = "、".join(rhyme["yun"]) if rhyme["yun"] else ("未收录" if rhyme["yun"] is None else "不同韵")
+        out.append(f"  {rhyme['kind']} {''.join(rhyme['chars'])}：{yun}（{report['book']}）")
+    return "\n".join(out)
+
+
+# ===== 识别词牌 =====
+# 匹配层级：句式完全一致 / 合并相邻句后一致 / 只有总字数一致
+MATCH_LEVELS = ("exact", "merged", "total")
+_END = None
+
+
+class CipaiIndex:
+    """词牌识别索引：各句字数的前缀树（叶子上挂词牌列表）+ 总字数 -> 词牌列表"""
+
+    def __init__(self, patterns):
+        self.root = {}
+        self.by_total = {}
+        for pattern in patterns.values():
+            node = self.root
+            for width in pattern.widths:
+                node = node.setdefault(width, {})
+            node.setdefault(_END, []).append(pattern)
+            self.by_total.setdefault(len(pattern.flat), []).append(pattern)
+
+    def _walk(self, widths):
+        """沿前缀树匹配各句字数，返回 {词牌名: (词牌, 合并次数)}；合并次数取最少的一种走法"""
+        found = {}
+        # (节点, 已用句数, 合并次数)
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, pos, merges = stack.pop()
+            if pos == len(widths):
+                for pattern in node.get(_END, ()):
+                    if pattern.name not in found or merges < found[pattern.name][1]:
+                        found[pattern.name] = (pattern, merges)
+                continue
+            total = 0
+            for end in range(pos, len(widths)):
+                total += widths[end]
+                child = node.get(total)
+                if child is not None:
+                    stack.append((child, end + 1, merges + end - pos))
+        return found
+
+    def candidates(self, lines):
+        """[(词牌, 匹配层级)]：先前缀树，再补上总字数相同的其余词牌"""
+        widths = [len(line) for line in lines]
+        walked = self._walk(widths)
+        result = [(pattern, 0 if merges == 0 else 1) for pattern, merges in walked.values()]
+        result.extend((pattern, 2) for pattern in self.by_total.get(sum(widths), ())
+                      if pattern.name not in walked)
+        return result
+
+
+def _split(text, widths):
+    lines, pos = [], 0
+    for width in widths:
+        lines.append(text[pos:pos + width])
+        pos += width
+    return lines
+
+
+def fit_level(pattern, widths):
+    """
+    一首词各句字数与词牌句式的匹配层级（MATCH_LEVELS 的下标），总字数都不同时为 None
+    相邻句只能整句合并，字数都为正，所以按顺序累加即可判断，不必回溯
+    """
+    if tuple(widths) == pattern.widths:
+        return 0
+    if sum(widths) != len(pattern.flat):
+        return None
+    targets = iter(pattern.widths)
+    total, target = 0, next(targets)
+    for width in widths:
+        total += width
+        if total == target:
+            total, target = 0, next(targets, None)
+        elif total > target:
+            return 2
+    return 1
+
+
+def conformance(pattern, text, actual, level, rhyme_book):
+    """
+    整首词（去掉标点后首尾相接的 text，actual 为逐字平仄）按词牌切分后的符合程度：
+    (平仄错字数, 不同韵的押韵段数, 综合得分 0–1)；错字和不押韵越多得分越低，
+    只有总字数相符（句读与词牌不合）时再打七五折；合并相邻句只是断句不同，不扣分
+    """
+    errors = sum(1 for tone, expected in zip(actual, pattern.flat) if expected and tone and tone != expected)
+    split = _split(text, pattern.widths)
+    rhymed = [check_rhyme([split[i][j] for i, j in slots], rhyme_book) for _, slots in pattern.rhymes]
+    misses = sum(1 for yuns in rhymed if yuns is not None and not yuns)
+    score = (1 - errors / max(len(text), 1)) * (1 - misses / max(len(rhymed), 1) / 2) * (0.75 if level == 2 else 1)
+    return errors, misses, score
+
+
+def identify(index, lines, top=5, book=None):
+    """
+    一首未标词牌的词（诗句列表）-> 按可能性排序的候选词牌，最多 top 个
+    每个候选：词牌名、匹配层级、平仄错字数、按该词牌切分后各押韵段是否同韵、综合得分（0–1）
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    text = "".join(lines)
+    rhyme_book = get_book(book or CI_BOOK)
+    if rhyme_book is None:
+        raise ValueError(f"未知韵书 '{book}'")
+    tones = get_tone_table()
+    actual = [tone_of(ch, tones) for ch in text]
+    ranked = []
+    for pattern, level in index.candidates(lines):
+        errors, misses, score = conformance(pattern, text, actual, level, rhyme_book)
+        ranked.append(((level, errors, misses), {
+            "cipai": pattern.name,
+            "match": MATCH_LEVELS[level],
+            "errors": errors,
+            "rhyme_misses": misses,
+            "score": round(score, 4),
+            "lines": _split(text, pattern.widths),
+        }))
+    ranked.sort(key=lambda item: item[0])
+    return [candidate for _, candidate in ranked[:top]]
+
+
+# ===== 基准测试 =====
+def bench(rounds=200):
+    """用各词牌的例词（按 sections 切分后字数对得上的）测校验耗时"""
+    cipai_data = load_json(CIPAI_PATH)
+    started = time.perf_counter()
+    patterns = compile_all(cipai_data)
+    compile_ms = (time.perf_counter() - started) * 1000
+    samples = []
+    for name, pattern in patterns.items():
+        lines = split_ci([cipai_data[name].get("example", {}).get("text", "")])
+        if tuple(len(line) for line in lines[:len(pattern.widths)]) == pattern.widths:
+            samples.append((pattern, lines[:len(pattern.widths)]))
+    n_chars = sum(sum(p.widths) for p, _ in samples)
+    validate(*samples[0])
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for pattern, lines in samples:
+            validate(pattern, lines)
+    elapsed = time.perf_counter() - started
+    passed = sum(validate(p, lines)["ok"] for p, lines in samples)
+    print(f"📊 编译 {len(patterns)} 个词牌 {compile_ms:.2f} ms；{len(samples)} 首例词（平均 {n_chars / len(samples):.0f} 字），"
+          f"每首校验 {elapsed / rounds / len(samples) * 1e6:.0f} µs，合律 {passed} 首")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench"]:
+        bench()
+        sys.exit(0)
+    if sys.argv[1:2] == ["identify"]:
+        text = sys.argv[2] if len(sys.argv) > 2 else sys.stdin.read()
+        index = CipaiIndex(compile_all(load_json(CIPAI_PATH)))
+        for candidate in identify(index, split_ci(text.splitlines())):
+            print(f"  《{candidate['cipai']}》 {candidate['match']:<6} 错 {candidate['errors']} 字，"
+                  f"押韵段不合 {candidate['rhyme_misses']}，得分 {candidate['score']}")
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="词牌平仄、押韵校验")
+    parser.add_argument("cipai", help="词牌名")
+    parser.add_argument("text", nargs="?", help="词文，句间用标点或换行分隔；省略时读 -f 文件或标准输入")
+    parser.add_argument("-f", "--file", help="从文件读取词文")
+    parser.add_argument("--book", default=CI_BOOK, help="韵书，默认 %(default)s")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args()
+    patterns = compile_all(load_json(CIPAI_PATH))
+    if args.cipai not in patterns:
+        print(f"❌ 未知词牌 '{args.cipai}'")
+        sys.exit(2)
+    if args.text:
+        text = args.text
+    elif args.file:
+        with open(args.file, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sys.stdin.read()
+    try:
+        report = validate(patterns[args.cipai], split_ci(text.splitlines()), args.book)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+    sys.exit(0 if report["ok"] else 1)
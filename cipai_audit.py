@@ -0,0 +1,279 @@
+"""
+词牌格律审计：宋词全部分片中的每首词按 rhythmic 找到 static/cipai.json 中的词牌，逐字比对打分
+
+每首词先按标点分句（cipai.split_ci），再与所标词牌的句式比对（cipai.fit_level）：
+    exact   各句字数与词牌一致          merged  合并相邻句后一致（句中多断了逗号）
+    total   只有总字数一致，按词牌句式重新切分后再比对
+    length  字数对不上，不打分          untagged  rhythmic 不在 cipai.json 中（可能是别名或写法不一）
+    empty   没有正文
+rhythmic 中“A・B”两个名字都会试，“蝶恋花”这样的本名对应 cipai.json 里的全部变体（其一、其二），取最吻合的。
+untagged 的词另用识别索引（cipai.CipaiIndex）找句式完全一致的词牌，把最吻合的记为建议词牌。
+得分见 cipai.conformance：按平仄错字比例和不押韵的押韵段折算到 0–1，total 再打七五折。
+“严格合律”只看平仄：exact / merged 且没有平仄错字。押韵检查是近似的——词林正韵由平水韵韵目
+合并而来（见 yun_index.CILIN_PARTS），半部韵目不细分；押韵段按 tone_pattern 的平仄转换切分，
+不一定与实际换韵处一致；方音、借韵也会被判为不押韵。所以押韵只计入得分，另单独统计押韵全合的首数。
+
+结果按分片缓存在 data/index/cipai_audit/ 下，文件名由「分片内容哈希 + 审计指纹」决定，
+审计指纹包括评分代码版本（SCORING_VERSION）、cipai.json、声调表各来源、所用韵书（RHYME_BOOK）
+及其源文件的哈希。每个分片审计完立即写入，
+中断后重跑只补没写完的分片；分片或词牌数据不变时重跑只需逐个分片算哈希。
+缓存文件布局（小端）：
+    头部    magic, 记录数
+    记录    每首一条：词牌编号 u16（cipai.json 中的顺序，65535 为无）、状态 u8、
+            不押韵的段数 u8、平仄错字数 u16、得分 u16（万分制）
+汇总写到 data/index/cipai_audit/summary.json。
+
+使用方法：
+    python cipai_audit.py                       # 审计（已缓存的分片跳过）并打印汇总
+    python cipai_audit.py -j 4                  # 指定进程数
+    python cipai_audit.py --export audit.jsonl  # 另外导出逐首结果
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+from collections import Counter
+
+from cipai import CIPAI_PATH, CipaiIndex, compile_all, conformance, fit_level, split_ci
+from corpus import SHARD_COLLECTIONS, collection_files, file_digest, index_path, load_json, parallel_map
+from pingze import tone_of
+from shard_index import scan_shard
+from tone_table import get_tone_table, sources_fingerprint
+from yun_index import BOOKS, CI_BOOK, get_book
+
+COLLECTION = "ci"
+AUDIT_DIR = index_path("cipai_audit")
+SUMMARY_PATH = os.path.join(AUDIT_DIR, "summary.json")
+
+MAGIC = b"PCIAU\x00\x00\x01"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<HBBHH")
+NO_CIPAI = 0xFFFF
+SCALE = 10000
+
+# 评分逻辑（cipai.fit_level / conformance、pingze.check_rhyme、韵书的合并表等）改动后加一，旧结果随之失效
+SCORING_VERSION = 2
+# 押韵检查所用的韵书，与填词页面的默认韵书一致
+RHYME_BOOK = CI_BOOK
+
+STATUSES = ("exact", "merged", "total", "length", "untagged", "empty")
+EXACT, MERGED, TOTAL, LENGTH, UNTAGGED, EMPTY = range(len(STATUSES))
+# 有得分的状态（按所标词牌比对上的）
+SCORED = (EXACT, MERGED, TOTAL)
+
+_VARIANT = re.compile(r"其[一二三四五六七八九十]+$")
+
+
+# ===== 单首 =====
+class Auditor:
+    """一个进程内常驻的审计状态：编译好的词牌、按名查找表、识别索引、声调表、韵书"""
+
+    def __init__(self):
+        data = load_json(CIPAI_PATH)
+        patterns = compile_all(data)
+        self.ids = {name: i for i, name in enumerate(data)}
+        self.index = CipaiIndex(patterns)
+        # 本名 -> 全部变体；变体的全名也能直接查到
+        self.by_name = {}
+        for name, pattern in patterns.items():
+            self.by_name.setdefault(name, []).append(pattern)
+            base = _VARIANT.sub("", name)
+            if base != name:
+                self.by_name.setdefault(base, []).append(pattern)
+        self.tones = get_tone_table()
+        self.book = get_book(RHYME_BOOK)
+
+    def lookup(self, rhythmic):
+        found = []
+        for name in (rhythmic or "").split("・"):
+            for pattern in self.by_name.get(name.strip(), ()):
+                if pattern not in found:
+                    found.append(pattern)
+        return found
+
+    def _best(self, fitted, text):
+        """[(词牌, 层级)] 中最吻合的一个：(词牌, 层级, 错字数, 不押韵段数, 得分)"""
+        actual = [tone_of(ch, self.tones) for ch in text]
+        scored = [(pattern, level) + conformance(pattern, text, actual, level, self.book) for pattern, level in fitted]
+        return min(scored, key=lambda item: (item[1], item[2], item[3]))
+
+    def audit(self, poem):
+        """一首词 -> (词牌编号, 状态, 不押韵段数, 错字数, 得分)，与 RECORD 的字段一致"""
+        lines = split_ci(poem.get("paragraphs") or [])
+        if not lines:
+            return NO_CIPAI, EMPTY, 0, 0, 0
+        text = "".join(lines)
+        widths = [len(line) for line in lines]
+        tagged = self.lookup(poem.get("rhythmic"))
+        if tagged:
+            fitted = [(p, level) for p in tagged for level in (fit_level(p, widths),) if level is not None]
+            if not fitted:
+                return self.ids[tagged[0].name], LENGTH, 0, 0, 0
+            status = None
+        else:
+            fitted = [(p, level) for p, level in self.index.candidates(lines) if level == EXACT]
+            if not fitted:
+                return NO_CIPAI, UNTAGGED, 0, 0, 0
+            status = UNTAGGED
+        pattern, level, errors, misses, score = self._best(fitted, text)
+        return (self.ids[pattern.name], level if status is None else status, min(misses, 255),
+                min(errors, 0xFFFF), round(score * SCALE))
+
+
+_auditor = None
+_fingerprint = None
+
+
+def get_auditor():
+    global _auditor
+    if _auditor is None:
+        _auditor = Auditor()
+    return _auditor
+
+
+def audit_fingerprint():
+    """审计结果依赖的代码和数据：评分代码版本、cipai.json、声调表各来源、所用韵书"""
+    global _fingerprint
+    if _fingerprint is None:
+        h = hashlib.sha1(MAGIC)
+        h.update(struct.pack("<I", SCORING_VERSION))
+        h.update(file_digest(CIPAI_PATH))
+        h.update(sources_fingerprint())
+        h.update(RHYME_BOOK.encode("utf-8"))
+        h.update(file_digest(BOOKS[RHYME_BOOK][1]))
+        _fingerprint = h.digest()
+    return _fingerprint
+
+
+# ===== 分片缓存 =====
+def cache_path(source_digest):
+    key = hashlib.sha1(source_digest + audit_fingerprint()).hexdigest()
+    return os.path.join(AUDIT_DIR, f"{key}.audit")
+
+
+def audit_shard(path):
+    """审计一个分片并写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新审计)"""
+    output = cache_path(file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    auditor = get_auditor()
+    rows = [auditor.audit(poem) for _, _, poem in scan_shard(path)]
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows)))
+        f.write(b"".join(RECORD.pack(*row) for row in rows))
+    os.replace(tmp, output)
+    return output, True
+
+
+def read_audit(path):
+    """读一个分片的审计结果：[(词牌编号, 状态, 不押韵段数, 错字数, 得分)]"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or len(data) != HEADER.size + count * RECORD.size:
+        raise ValueError(f"审计结果格式不匹配: {path}")
+    return list(RECORD.iter_unpack(data[HEADER.size:]))
+
+
+def audit_all(workers=1):
+    """审计全部宋词分片，删除不再被引用的旧结果，返回 ([各分片结果路径], 新审计的分片数)"""
+    patterns, _ = SHARD_COLLECTIONS[COLLECTION]
+    files = collection_files(patterns)
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    results = list(parallel_map(audit_shard, files, workers))
+    keep = {os.path.basename(output) for output, _ in results}
+    for name in os.listdir(AUDIT_DIR):
+        if name.endswith(".audit") and name not in keep:
+            os.remove(os.path.join(AUDIT_DIR, name))
+    return [output for output, _ in results], sum(audited for _, audited in results)
+
+
+# ===== 汇总 =====
+def summarize(outputs):
+    """按状态、按词牌、按得分区间汇总，写入 summary.json 并返回"""
+    names = list(load_json(CIPAI_PATH))
+    statuses = Counter()
+    bands = Counter()
+    per_cipai = {}
+    suggested = Counter()
+    for output in outputs:
+        for cid, status, misses, errors, score in read_audit(output):
+            statuses[STATUSES[status]] += 1
+            if status == UNTAGGED and cid != NO_CIPAI:
+                suggested[names[cid]] += 1
+            if status not in SCORED and status != LENGTH:
+                continue
+            entry = per_cipai.setdefault(names[cid], {"total": 0, "scored": 0, "strict": 0, "rhymed": 0,
+                                                    "score": 0.0})
+            entry["total"] += 1
+            if status == LENGTH:
+                continue
+            entry["scored"] += 1
+            entry["score"] += score / SCALE
+            # 押韵检查是近似的，严格合律只看平仄；押韵全合另计
+            entry["strict"] += status in (EXACT, MERGED) and errors == 0
+            entry["rhymed"] += misses == 0
+            bands["0.95+" if score >= 0.95 * SCALE else "0.9–0.95" if score >= 0.9 * SCALE
+                  else "0.8–0.9" if score >= 0.8 * SCALE else "<0.8"] += 1
+    for entry in per_cipai.values():
+        entry["score"] = round(entry["score"] / entry["scored"], 4) if entry["scored"] else None
+    summary = {
+        "records": sum(statuses.values()),
+        "rhyme_book": RHYME_BOOK,
+        "statuses": {status: statuses.get(status, 0) for status in STATUSES},
+        "score_bands": {band: bands.get(band, 0) for band in ("0.95+", "0.9–0.95", "0.8–0.9", "<0.8")},
+        "cipai": dict(sorted(per_cipai.items(), key=lambda item: -item[1]["total"])),
+        "suggested": dict(suggested.most_common()),
+    }
+    tmp = f"{SUMMARY_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, SUMMARY_PATH)
+    return summary
+
+
+def export(outputs, path):
+    """逐首导出为 JSON Lines：全局编号、rhythmic、比对的词牌、状态、错字数、不押韵段数、得分"""
+    names = list(load_json(CIPAI_PATH))
+    patterns, _ = SHARD_COLLECTIONS[COLLECTION]
+    gid = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for shard, output in zip(collection_files(patterns), outputs):
+            for (_, _, poem), (cid, status, misses, errors, score) in zip(scan_shard(shard), read_audit(output)):
+                f.write(json.dumps({
+                    "id": gid,
+                    "rhythmic": poem.get("rhythmic", ""),
+                    "cipai": names[cid] if cid != NO_CIPAI else None,
+                    "status": STATUSES[status],
+                    "errors": errors,
+                    "rhyme_misses": misses,
+                    "score": score / SCALE if status in SCORED or status == UNTAGGED and cid != NO_CIPAI else None,
+                }, ensure_ascii=False) + "\n")
+                gid += 1
+    return gid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="宋词词牌格律审计")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="进程数，默认全部 CPU")
+    parser.add_argument("--export", help="逐首结果导出为 JSON Lines")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    outputs, audited = audit_all(max(args.workers, 1))
+    summary = summarize(outputs)
+    print(f"✅ {len(outputs)} 个分片（新审计 {audited} 个），{summary['records']} 首，"
+          f"{time.perf_counter() - started:.1f}s")
+    print("   状态：" + "  ".join(f"{status} {n}" for status, n in summary["statuses"].items()))
+    print("   得分：" + "  ".join(f"{band} {n}" for band, n in summary["score_bands"].items()))
+    print(f"   严格合律只看平仄；押韵按 {BOOKS[RHYME_BOOK][0]} 近似检查，只计入得分和“押韵全合”")
+    for name, entry in list(summary["cipai"].items())[:10]:
+        print(f"   《{name}》{entry['total']} 首，打分 {entry['scored']}，严格合律 {entry['strict']}，"
+              f"押韵全合 {entry['rhymed']}，平均 {entry['score']}")
+    if args.export:
+        count = export(outputs, args.export)
+        print(f"✅ 已导出 {count} 首到 {args.export}")
@@ -0,0 +1,129 @@
+"""
+语料公共定义：目录位置、集合划分与 JSON 读取
+各个构建脚本（快照、索引等）都从这里取路径，避免各自拼接
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BASE, "data", "chinese-poetry-master")
+# 构建产物统一放在 data/index/ 下（不入库，可随时重新生成）
+INDEX_DIR = os.path.join(BASE, "data", "index")
+
+# 小型精选集合：名称 -> (相对 CORPUS_DIR 的文件模式列表, 标题字段)
+# 词的标题取 rhythmic（词牌名），与 /poem/song 的返回保持一致
+SELECTED_COLLECTIONS = {
+    "tang300": (["全唐诗/唐诗三百首.json"], "title"),
+    "shuimo": (["水墨唐诗/shuimotangshi.json"], "title"),
+    "song300": (["宋词/宋词三百首.json"], "rhythmic"),
+    "huajianji": (["五代诗词/huajianji/huajianji-*-juan.json"], "title"),
+    "nantang": (["五代诗词/nantang/poetrys.json"], "rhythmic"),
+}
+
+# 全量分片集合（约 175 MB），不整体载入内存，通过记录偏移索引按需解码
+SHARD_COLLECTIONS = {
+    "tang": (["全唐诗/poet.tang.*.json"], "title"),
+    "song": (["全唐诗/poet.song.*.json"], "title"),
+    "ci": (["宋词/ci.song.*.json"], "rhythmic"),
+}
+COLLECTION_NAMES = list(SHARD_COLLECTIONS)
+
+# 全部诗词分片（全唐诗、宋词、五代诗词、御定全唐詩），用于摄取基准测试
+INGEST_PATTERNS = [
+    "全唐诗/poet.*.json",
+    "宋词/ci.song.*.json",
+    "五代诗词/huajianji/huajianji-*-juan.json",
+    "五代诗词/nantang/poetrys.json",
+    "御定全唐詩/json/*.json",
+]
+
+# 跨集合的文档编号：高 2 位为集合编号（COLLECTION_NAMES 的顺序），低 30 位为集合内全局编号
+GID_BITS = 30
+GID_MASK = (1 << GID_BITS) - 1
+
+
+def pack_doc_id(collection, gid):
+    return (COLLECTION_NAMES.index(collection) << GID_BITS) | gid
+
+
+def unpack_doc_id(doc):
+    return COLLECTION_NAMES[doc >> GID_BITS], doc & GID_MASK
+
+
+# 近体诗体裁，名称与 /compose/tang/<form> 的路由一致；编号 0 表示其他体裁
+FORMS = ["", "wuyan-jueju", "wuyan-lvshi", "qiyan-jueju", "qiyan-lvshi"]
+_FORM_SHAPES = {(4, 5): 1, (8, 5): 2, (4, 7): 3, (8, 7): 4}
+# 体裁编号 -> 句数（绝句 4 句、律诗 8 句），按体裁抽样时句数条件可以直接判定
+FORM_LINES = {code: count for (count, _), code in _FORM_SHAPES.items()}
+
+_SENTENCE_SPLIT = re.compile(r"[，。！？；,.!?;]")
+
+
+def split_sentences(paragraphs):
+    """把 paragraphs 按标点切成句子（一句即一个诗行），去掉空白和空句"""
+    sentences = []
+    for para in paragraphs:
+        for s in _SENTENCE_SPLIT.split(para):
+            s = s.strip()
+            if s:
+                sentences.append(s)
+    return sentences
+
+
+def detect_form(sentences):
+    """按句数和每句字数判断体裁编号（见 FORMS）"""
+    if not sentences:
+        return 0
+    width = len(sentences[0])
+    if any(len(s) != width for s in sentences):
+        return 0
+    return _FORM_SHAPES.get((len(sentences), width), 0)
+
+
+def load_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def file_digest(path):
+    """文件内容的 SHA-1（20 字节），用于判断分片是否真的改动过"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def collection_files(patterns):
+    """按模式展开出实际文件列表（按文件名排序，保证构建结果稳定）"""
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(glob.glob(os.path.join(CORPUS_DIR, pattern))))
+    return files
+
+
+def parallel_map(func, items, workers=1):
+    """
+    按输入顺序产出 func(item)；workers > 1 时用进程池并行
+    同时在途的任务数有上限，主进程合并得慢时不会把所有分片的结果都堆在内存里
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def index_path(name):
+    return os.path.join(INDEX_DIR, name)
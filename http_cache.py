@@ -0,0 +1,158 @@
+"""
+HTTP 缓存：内容哈希 ETag、304 Not Modified，以及 JSON 接口响应的进程内 LRU
+
+    - 静态数据文件（char_tones.json、cipai.json 等）按内容哈希生成 ETag；
+      页面里用 asset_url() 引用带版本号的地址（?v=哈希），这类请求可以长期缓存，
+      文件一改哈希就变，地址随之变化；不带版本号的请求每次用 ETag 重新验证
+    - 查询接口的响应体编码成 bytes 后放进 LRU，键为请求路径 + 查询串；
+      命中时不再执行视图函数，数据热更新后整体清空
+    - 命中 / 未命中 / 淘汰 / 304 次数可以通过 stats() 查看
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+# 带版本号的静态文件：一年；其余静态文件和接口：每次重新验证
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+API_CACHE_SIZE = 4096
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+response_cache = LRUCache(API_CACHE_SIZE)
+_not_modified = 0
+_static_digests = {}
+
+
+def content_etag(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _cache_control(response, max_age):
+    if max_age >= IMMUTABLE_MAX_AGE:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    elif max_age > 0:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+
+
+def conditional(response, etag, max_age=0):
+    """给响应加上 ETag 和 Cache-Control；客户端带来的 If-None-Match 匹配时改成 304"""
+    global _not_modified
+    response.set_etag(etag)
+    _cache_control(response, max_age)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        _not_modified += 1
+    return response
+
+
+# ===== JSON 接口 =====
+def cached_json(max_age=0):
+    """
+    视图装饰器：GET 请求的 200 响应按 路径 + 查询串 缓存编码后的 bytes，并支持 ETag / 304
+    max_age 为客户端可直接复用的秒数，0 表示每次都用 ETag 重新验证
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            key = request.full_path
+            entry = response_cache.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = (body, response.mimetype, content_etag(body))
+                response_cache.put(key, entry)
+            body, mimetype, etag = entry
+            return conditional(Response(body, mimetype=mimetype), etag, max_age)
+        return wrapper
+    return decorator
+
+
+# ===== 静态文件 =====
+def static_digest(static_folder, filename):
+    """静态文件的内容哈希；按 (大小, mtime) 缓存，文件改动后重新计算"""
+    path = os.path.join(static_folder, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_size, st.st_mtime)
+    cached = _static_digests.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, "rb") as f:
+            cached = _static_digests[path] = (stamp, content_etag(f.read()))
+    return cached[1]
+
+
+def static_response(response, static_folder, filename):
+    """after_request 中处理静态文件：内容哈希 ETag；带上正确 ?v= 的请求可长期缓存"""
+    if response.status_code not in (200, 304):
+        return response
+    digest = static_digest(static_folder, filename)
+    if digest is None:
+        return response
+    max_age = IMMUTABLE_MAX_AGE if request.args.get("v") == digest else 0
+    return conditional(response, digest, max_age)
+
+
+def asset_url(static_folder, filename):
+    """带版本号的静态文件地址，供页面引用"""
+    digest = static_digest(static_folder, filename)
+    url = f"/static/{filename}"
+    return f"{url}?v={digest}" if digest else url
+
+
+def stats():
+    return {"api": response_cache.stats(), "not_modified": _not_modified, "static_files": len(_static_digests)}
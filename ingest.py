@@ -0,0 +1,92 @@
+"""
+语料摄取总入口：并行构建全部索引，以及摄取吞吐量基准测试
+
+解析 JSON 和切分文本都是 CPU 密集的，分片之间互不依赖，
+用进程池按分片并行，主进程按分片顺序合并各自的局部结果。
+
+使用方法：
+    python ingest.py build              # 用全部 CPU 构建快照、分片索引、简体缓存、作者索引、检索索引、韵脚字频、用韵标注、声调表、格律分析列、词牌格律审计
+    python ingest.py build -j 4         # 指定进程数
+    python ingest.py bench              # 在 1、2、4、N 个进程下测 shards/sec 和 MB/sec
+    python ingest.py bench -w 1 8 16    # 指定要测的进程数
+"""
+import argparse
+import os
+import time
+
+from author_index import build_author_index
+from cipai_audit import audit_all, summarize
+from corpus import INGEST_PATTERNS, SHARD_COLLECTIONS, collection_files, parallel_map
+from normalize import normalize_all
+from pingze_index import build_pingze_index
+from rhyme_freq import build_rhyme_freq
+from rhyme_scheme import build_rhyme_scheme
+from search_index import build_search_index, index_shard_terms
+from shard_index import build_shard_index, open_shard_index, scan_segment
+from snapshot import build_snapshot
+from tone_table import build_tone_table
+
+
+def build_all(workers):
+    started = time.perf_counter()
+    build_snapshot()
+    print(f"✅ 快照 {time.perf_counter() - started:.1f}s")
+    for name in SHARD_COLLECTIONS:
+        total, parsed = build_shard_index(name, previous=open_shard_index(name), workers=workers)
+        print(f"✅ 分片索引 {name}: {total} 首（重新解析 {parsed} 个分片）{time.perf_counter() - started:.1f}s")
+    total, converted = normalize_all(workers)
+    print(f"✅ 繁简归一: {total} 个分片（新转换 {converted} 个）{time.perf_counter() - started:.1f}s")
+    build_author_index()
+    print(f"✅ 作者索引 {time.perf_counter() - started:.1f}s")
+    n_docs, n_terms = build_search_index(workers=workers)
+    print(f"✅ 检索索引 {n_docs} 首 / {n_terms} 个检索词 {time.perf_counter() - started:.1f}s")
+    n_chars, n_rhymes = build_rhyme_freq(workers=workers)
+    print(f"✅ 韵脚字频 {n_chars} 个字 / {n_rhymes} 个韵脚 {time.perf_counter() - started:.1f}s")
+    for name in SHARD_COLLECTIONS:
+        build_rhyme_scheme(name, workers=workers)
+    print(f"✅ 用韵标注 {time.perf_counter() - started:.1f}s")
+    n_tones = build_tone_table()
+    print(f"✅ 声调表 {n_tones} 个字 {time.perf_counter() - started:.1f}s")
+    for name in SHARD_COLLECTIONS:
+        build_pingze_index(name, workers=workers)
+    print(f"✅ 格律分析列 {time.perf_counter() - started:.1f}s")
+    outputs, audited = audit_all(workers)
+    summary = summarize(outputs)
+    print(f"✅ 词牌格律审计 {summary['records']} 首（新审计 {audited} 个分片）{time.perf_counter() - started:.1f}s")
+
+
+def ingest_shard(path):
+    """基准测试的单位任务：一个分片的完整摄取（记录段 + 局部倒排），结果同样回传主进程"""
+    return scan_segment(path), index_shard_terms(path)
+
+
+def bench(worker_counts):
+    files = [p for pattern in INGEST_PATTERNS for p in collection_files([pattern])]
+    total_mb = sum(os.path.getsize(p) for p in files) / (1 << 20)
+    print(f"📊 {len(files)} 个分片，共 {total_mb:.1f} MB，CPU {os.cpu_count()} 核")
+    print(f"{'进程数':>6} {'耗时(s)':>9} {'shards/sec':>11} {'MB/sec':>8} {'加速比':>7}")
+    baseline = None
+    for workers in worker_counts:
+        started = time.perf_counter()
+        for _ in parallel_map(ingest_shard, files, workers):
+            pass
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        print(f"{workers:>6} {elapsed:>9.2f} {len(files) / elapsed:>11.1f} {total_mb / elapsed:>8.2f} "
+              f"{baseline / elapsed:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="语料摄取：并行构建索引 / 吞吐量基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="并行构建全部索引")
+    p_build.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="进程数，默认为 CPU 核数")
+    p_bench = sub.add_parser("bench", help="在不同进程数下测摄取吞吐量")
+    p_bench.add_argument("-w", "--workers", type=int, nargs="+", help="要测的进程数，默认 1 2 4 N")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_all(max(args.workers, 1))
+    else:
+        counts = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+        bench(counts)
@@ -0,0 +1,272 @@
+"""
+繁简归一：把繁体分片转换为简体，作为摄取流程中的一个阶段
+
+转换表（t2s.txt，OpenCC 文本词典格式）编译成一个自动机，一遍扫描完成转换：
+    - 单字条目合成一张 str.translate 表
+    - 多字条目（崑崙、鷫鸘、薄倖 等）建 Aho–Corasick 自动机，按最左最长匹配优先替换，
+      匹配之间的片段再走 translate 表
+原来 UpdateCi.correct() 对每首 × 每行 × 每个条目调用一次 str.replace，这里每行只扫一遍。
+
+转换结果按分片缓存在 data/index/simplified/ 下，文件名由「分片内容哈希 + 转换表哈希」决定，
+分片或转换表不变时直接复用。缓存文件布局（小端）：
+    头部    magic, 记录数
+    偏移表  u32 × (记录数 + 1)
+    数据区  每条记录一段 UTF-8 JSON
+
+使用方法：
+    python normalize.py                 # 转换全部分片集合（已缓存的跳过）
+    python normalize.py -j 4            # 指定进程数
+    python normalize.py 崑崙山後        # 转换一段文字
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections import deque
+
+from corpus import BASE, SHARD_COLLECTIONS, collection_files, file_digest, index_path, parallel_map
+
+T2S_PATH = os.path.join(BASE, "t2s.txt")
+NORMALIZED_DIR = index_path("simplified")
+MAGIC = b"PNORM\x00\x00\x01"
+HEADER = struct.Struct("<8sI")
+
+# 需要转换的字段；词的标题在 rhythmic 中
+TEXT_FIELDS = ("title", "rhythmic", "author")
+
+# 可选的文字版本：original 为分片原文（全唐诗为繁体，宋词为简体），simplified 为归一后的简体
+SCRIPTS = ("original", "simplified")
+
+
+def load_table(path=T2S_PATH):
+    """读取 OpenCC 格式的转换表，返回 {源词: 目标词}；多个候选时取第一个"""
+    table = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            key, _, values = line.partition("\t")
+            if key and values:
+                table[key] = values.split(" ")[0]
+    return table
+
+
+def unambiguous_chars(path=T2S_PATH):
+    """只有一个候选的单字条目：繁体字 -> 简体字；乾（干 / 乾）这类有歧义的不收"""
+    table = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            key, _, values = line.partition("\t")
+            if len(key) == 1 and values and " " not in values:
+                table[key] = values
+    return table
+
+
+# ===== 自动机 =====
+class Automaton:
+    """多字条目的 Aho–Corasick 自动机"""
+
+    def __init__(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        # 每个状态上结束的全部条目长度（含沿失败链继承的），从长到短
+        self.out = [()]
+        for key in keys:
+            node = 0
+            for ch in key:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] = (len(key),)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.out[child] = tuple(sorted(self.out[child] + self.out[self.fail[child]], reverse=True))
+
+    def matches(self, text):
+        """产生全部匹配 (起点, 长度)，按终点顺序"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length in out[node]:
+                yield i - length + 1, length
+
+    def leftmost_longest(self, text):
+        """不重叠的匹配：起点最靠左者优先，同一起点取最长"""
+        pos = 0
+        for start, length in sorted(self.matches(text), key=lambda m: (m[0], -m[1])):
+            if start >= pos:
+                yield start, length
+                pos = start + length
+
+
+class Converter:
+    def __init__(self, table):
+        self.chars = str.maketrans({k: v for k, v in table.items() if len(k) == 1})
+        self.phrases = {k: v for k, v in table.items() if len(k) > 1}
+        self.automaton = Automaton(self.phrases)
+        # 多字条目的首字；一行里一个都没有时只需 translate
+        self.heads = frozenset(k[0] for k in self.phrases)
+
+    def convert(self, text):
+        if self.heads.isdisjoint(text):
+            return text.translate(self.chars)
+        pieces = []
+        pos = 0
+        for start, length in self.automaton.leftmost_longest(text):
+            pieces.append(text[pos:start].translate(self.chars))
+            pieces.append(self.phrases[text[start:start + length]])
+            pos = start + length
+        pieces.append(text[pos:].translate(self.chars))
+        return "".join(pieces)
+
+    def convert_poem(self, poem):
+        """返回转换后的新 dict；其余字段（id 等）原样保留"""
+        poem = dict(poem)
+        for key in TEXT_FIELDS:
+            if isinstance(poem.get(key), str):
+                poem[key] = self.convert(poem[key])
+        if poem.get("paragraphs"):
+            poem["paragraphs"] = [self.convert(p) for p in poem["paragraphs"]]
+        return poem
+
+
+_converter = None
+_table_digest = None
+
+
+def get_converter():
+    """进程内只编译一次转换表"""
+    global _converter, _table_digest
+    if _converter is None:
+        _table_digest = file_digest(T2S_PATH)
+        _converter = Converter(load_table())
+    return _converter
+
+
+def table_digest():
+    get_converter()
+    return _table_digest
+
+
+# ===== 分片缓存 =====
+def cache_path(source_digest):
+    key = hashlib.sha1(source_digest + table_digest()).hexdigest()
+    return os.path.join(NORMALIZED_DIR, f"{key}.nrm")
+
+
+def normalize_shard(path):
+    """转换一个分片并写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新转换)"""
+    from shard_index import scan_shard
+
+    output = cache_path(file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    converter = get_converter()
+    blobs = [json.dumps(converter.convert_poem(poem), ensure_ascii=False).encode("utf-8")
+             for _, _, poem in scan_shard(path)]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+
+    os.makedirs(NORMALIZED_DIR, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(blobs)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(blobs))
+    os.replace(tmp, output)
+    return output, True
+
+
+def normalize_all(workers=1):
+    """转换全部分片集合，删除不再被引用的旧缓存，返回 (分片数, 新转换数)"""
+    files = [p for patterns, _ in SHARD_COLLECTIONS.values() for p in collection_files(patterns)]
+    os.makedirs(NORMALIZED_DIR, exist_ok=True)
+    results = list(parallel_map(normalize_shard, files, workers))
+    keep = {os.path.basename(output) for output, _ in results}
+    for name in os.listdir(NORMALIZED_DIR):
+        if name.endswith(".nrm") and name not in keep:
+            os.remove(os.path.join(NORMALIZED_DIR, name))
+    return len(results), sum(converted for _, converted in results)
+
+
+class NormalizedShard:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"缓存格式不匹配: {path}")
+        self._blob_pos = HEADER.size + (self.count + 1) * 4
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = struct.unpack_from("<II", self.mm, HEADER.size + i * 4)
+        return json.loads(self.mm[self._blob_pos + start:self._blob_pos + end])
+
+
+_shards = {}
+
+
+def simplified_record(index, gid):
+    """
+    分片索引中第 gid 条记录的简体版本
+    优先读缓存；该分片尚未转换（或转换表已更新）时现场转换这一条
+    """
+    shard, local = index.locate(gid)
+    path = cache_path(index.digests[shard])
+    reader = _shards.get(path)
+    if reader is None and os.path.exists(path):
+        try:
+            reader = _shards[path] = NormalizedShard(path)
+        except (OSError, ValueError) as e:
+            print("简体缓存加载失败:", e)
+    if reader is not None and local < len(reader):
+        return reader[local]
+    return get_converter().convert_poem(index.record(gid))
+
+
+def script_record(index, gid, script="original"):
+    """按 ?script= 取记录：original 为原文，simplified 为简体"""
+    if script == "simplified":
+        return simplified_record(index, gid)
+    return index.record(gid)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="繁简归一：转换分片并缓存，或转换一段文字")
+    parser.add_argument("text", nargs="*", help="要转换的文字；省略时转换全部分片")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数")
+    args = parser.parse_args()
+
+    if args.text:
+        print(get_converter().convert(" ".join(args.text)))
+    else:
+        total, converted = normalize_all(max(args.workers, 1))
+        print(f"✅ {total} 个分片，新转换 {converted} 个，缓存位于 {os.path.relpath(NORMALIZED_DIR, BASE)}")
@@ -0,0 +1,254 @@
+"""
+近体诗格律校验：五绝 / 五律 / 七绝 / 七律的平仄与押韵
+
+格律模板不再逐页手写，而是由四种基本句式按粘对规则推出，导入时编译一次：
+    五言  A 中仄平平仄   B 平平中仄平   a 中平中仄仄   b 中仄仄平平
+    七言  在五言句前加两字，第二字与五言句的第二字相反（平平 / 仄仄），第一字可平可仄
+    （“中”为可平可仄；b 句第三字、B 句第一字不放宽，避免三平尾和孤平）
+一首诗从 A 或 a 句起，按 A B a b 循环排列（对句相对、出句相粘）；首句入韵时首句换成同起的平收句
+（A -> b，a -> B）。平起 / 仄起按首句第二字区分，与作诗页面的 pingqi_buru 等格式名称一致。
+
+字的平仄取自紧凑声调表（见 tone_table.py，入声算仄），表里没有的繁体字再转成简体查一次；
+查不到的字和平仄两收的字只标记为不定，不算错。押韵按韵书（默认中华新韵）判断各韵脚字有没有共同的韵部。
+
+使用方法：
+    python pingze.py "床前明月光，疑是地上霜。举头望明月，低头思故乡。"
+    python pingze.py -f poem.txt --format zeqi_buru --book pingshui
+    echo "..." | python pingze.py --json
+"""
+import argparse
+import json
+import sys
+
+from corpus import FORMS, detect_form, split_sentences
+from normalize import get_converter
+from tone_table import PING, RU, UNKNOWN, ZE, get_tone_table
+from yun_index import DEFAULT_BOOK, get_book
+
+# 模板中的要求：0 可平可仄，1 平，2 仄（与声调表的编号一致）
+ANY = UNKNOWN
+MARKS = {"中": ANY, "平": PING, "仄": ZE}
+NAMES = {PING: "平", ZE: "仄"}
+
+FORMATS = ("pingqi_buru", "pingqi_ru", "zeqi_buru", "zeqi_ru")
+
+# ===== 模板 =====
+BASE_LINES = {"A": "中仄平平仄", "B": "平平中仄平", "a": "中平中仄仄", "b": "中仄仄平平"}
+CYCLE = "ABab"
+RHYMED_FIRST = {"A": "b", "a": "B"}
+# 体裁编号（见 corpus.FORMS）-> (句数, 每句字数)
+SHAPES = {1: (4, 5), 2: (8, 5), 3: (4, 7), 4: (8, 7)}
+
+
+def line_pattern(kind, width):
+    base = BASE_LINES[kind]
+    if width == 5:
+        return base
+    return "中" + ("平" if base[1] == "仄" else "仄") + base
+
+
+class Template:
+    """一种体裁、一种格式的模板：每句的平仄要求和押韵句"""
+    __slots__ = ("form", "format", "patterns", "codes", "rhymes")
+
+    def __init__(self, form, fmt, patterns, rhymes):
+        self.form = form
+        self.format = fmt
+        self.patterns = patterns
+        self.codes = tuple(tuple(MARKS[m] for m in p) for p in patterns)
+        self.rhymes = rhymes
+
+
+def compile_templates():
+    """(体裁, 格式) -> Template；每种体裁四个格式"""
+    templates = {}
+    for code, (count, width) in SHAPES.items():
+        for start in RHYMED_FIRST:
+            offset = CYCLE.index(start)
+            kinds = [CYCLE[(offset + i) % 4] for i in range(count)]
+            for rhymed in (False, True):
+                if rhymed:
+                    kinds[0] = RHYMED_FIRST[start]
+                patterns = tuple(line_pattern(k, width) for k in kinds)
+                fmt = ("pingqi" if patterns[0][1] == "平" else "zeqi") + ("_ru" if rhymed else "_buru")
+                rhymes = tuple(i for i in range(count) if i % 2 or rhymed and i == 0)
+                templates[FORMS[code], fmt] = Template(FORMS[code], fmt, patterns, rhymes)
+    return templates
+
+
+TEMPLATES = compile_templates()
+
+
+# ===== 声调 =====
+def tone_of(ch, table=None):
+    """字 -> 平仄编号（入声归仄），查不到时为 ANY"""
+    table = table or get_tone_table()
+    tone = table.code(ch)
+    if tone == UNKNOWN:
+        tone = table.code(ch.translate(get_converter().chars)[:1] or ch)
+    return ZE if tone == RU else tone
+
+
+# ===== 校验 =====
+def parse_lines(text):
+    """一段文本 -> 诗句列表（按换行和标点切分）"""
+    return split_sentences(text.splitlines())
+
+
+def _check_line(text, codes, tones):
+    """一句与模板逐字比对，返回 (错字数, 未知字数, 逐字结果)；字数不对时返回 None"""
+    if len(text) != len(codes):
+        return None
+    errors = unknown = 0
+    chars = []
+    for ch, expected in zip(text, codes):
+        tone = tone_of(ch, tones)
+        ok = expected == ANY or tone == ANY or tone == expected
+        if tone == ANY:
+            unknown += 1
+        elif not ok:
+            errors += 1
+        chars.append((ch, tone, expected, ok))
+    return errors, unknown, chars
+
+
+def _mismatches(line_tones, template):
+    """各句实际平仄与模板不合的字数；字数不对的句整句算错"""
+    errors = 0
+    for tones, codes in zip(line_tones, template.codes):
+        if len(tones) != len(codes):
+            errors += len(codes)
+            continue
+        for tone, expected in zip(tones, codes):
+            if expected and tone and tone != expected:
+                errors += 1
+    return errors
+
+
+def resolve_form(lines, form=None):
+    """体裁未指定时按句数和字数判断；句数不符或无法判断时抛出 ValueError"""
+    if form is None:
+        code = detect_form(lines)
+        if not code:
+            raise ValueError("无法判断体裁，需为四句或八句、每句五字或七字")
+        return FORMS[code]
+    if form not in FORMS[1:]:
+        raise ValueError(f"未知体裁 '{form}'，可选 {'/'.join(FORMS[1:])}")
+    count, _ = SHAPES[FORMS.index(form)]
+    if len(lines) != count:
+        raise ValueError(f"{form} 需 {count} 句，实际 {len(lines)} 句")
+    return form
+
+
+def best_template(lines, form, tones=None):
+    """格式未指定时，取错字最少的模板（同分时按 FORMATS 顺序），返回 (模板, 错字数)"""
+    tones = tones or get_tone_table()
+    line_tones = [[tone_of(ch, tones) for ch in line] for line in lines]
+    return min(((TEMPLATES[form, fmt], _mismatches(line_tones, TEMPLATES[form, fmt])) for fmt in FORMATS),
+               key=lambda item: item[1])
+
+
+def check_rhyme(chars, book):
+    """韵脚字是否同韵：返回共同韵部名列表（不在韵书中的字不参与判断）"""
+    common = None
+    for ch in chars:
+        ids = set(book.group_ids(ch.translate(get_converter().chars)))
+        if ids:
+            common = ids if common is None else common & ids
+    if common is None:
+        return None
+    return [book.names[g] for g in sorted(common)]
+
+
+def validate(lines, form=None, fmt=None, book=None):
+    """
+    校验一首近体诗，lines 为诗句列表
+    form 为体裁（wuyan-jueju 等，默认按句式判断），fmt 为格式（pingqi_buru 等，默认取最吻合的），
+    book 为韵书名（默认中华新韵）；参数不合法时抛出 ValueError
+    返回 dict：整体结论、逐句逐字的平仄比对、押韵情况
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    form = resolve_form(lines, form)
+    tones = get_tone_table()
+    if fmt is None:
+        template, _ = best_template(lines, form, tones)
+    elif fmt in FORMATS:
+        template = TEMPLATES[form, fmt]
+    else:
+        raise ValueError(f"未知格式 '{fmt}'，可选 {'/'.join(FORMATS)}")
+    rhyme_book = get_book(book or DEFAULT_BOOK)
+    if rhyme_book is None:
+        raise ValueError(f"未知韵书 '{book}'")
+
+    report_lines = []
+    errors = unknown = 0
+    for i, (text, pattern, codes) in enumerate(zip(lines, template.patterns, template.codes)):
+        entry = {"text": text, "pattern": pattern, "rhyme": i in template.rhymes}
+        checked = _check_line(text, codes, tones)
+        if checked is None:
+            entry.update(ok=False, error=f"需{len(codes)}字", chars=[])
+            errors += len(codes)
+        else:
+            line_errors, line_unknown, chars = checked
+            errors += line_errors
+            unknown += line_unknown
+            entry["ok"] = not line_errors
+            entry["chars"] = [{"char": ch, "tone": NAMES.get(tone), "expected": NAMES.get(expected, "中"), "ok": ok}
+                              for ch, tone, expected, ok in chars]
+        report_lines.append(entry)
+
+    rhyme_chars = [lines[i][-1] for i in template.rhymes]
+    yuns = check_rhyme(rhyme_chars, rhyme_book)
+    rhyme = {"book": rhyme_book.name, "chars": rhyme_chars, "yun": yuns, "ok": yuns is None or bool(yuns)}
+    return {
+        "form": form,
+        "format": template.format,
+        "ok": not errors and rhyme["ok"],
+        "errors": errors,
+        "unknown": unknown,
+        "lines": report_lines,
+        "rhyme": rhyme,
+    }
+
+
+def format_report(report):
+    """命令行输出：每句下面标出模板，错字用 ^ 标记"""
+    out = [f"{report['form']} {report['format']}：{'合律' if report['ok'] else '不合律'}"
+           f"（错 {report['errors']} 字，平仄不定 {report['unknown']} 字）"]
+    for line in report["lines"]:
+        mark = "○" if line["rhyme"] else " "
+        out.append(f"  {line['text']} {mark}")
+        out.append(f"  {line['pattern']}")
+        if line.get("error"):
+            out.append(f"  {line['error']}")
+        elif not line["ok"]:
+            out.append("  " + "".join("＾" if not c["ok"] else "　" for c in line["chars"]))
+    rhyme = report["rhyme"]
+    yun = "、".join(rhyme["yun"]) if rhyme["yun"] else ("未收录" if rhyme["yun"] is None else "不同韵")
+    out.append(f"  韵脚 {''.join(rhyme['chars'])}：{yun}（{rhyme['book']}）")
+    return "\n".join(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="近体诗平仄、押韵校验")
+    parser.add_argument("text", nargs="?", help="诗文，句间用标点或换行分隔；省略时读 -f 文件或标准输入")
+    parser.add_argument("-f", "--file", help="从文件读取诗文")
+    parser.add_argument("--form", choices=FORMS[1:], help="体裁，默认按句式判断")
+    parser.add_argument("--format", choices=FORMATS, help="格式，默认取最吻合的")
+    parser.add_argument("--book", default=DEFAULT_BOOK, help="韵书，默认 %(default)s")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args()
+    if args.text:
+        text = args.text
+    elif args.file:
+        with open(args.file, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sys.stdin.read()
+    try:
+        report = validate(parse_lines(text), args.form, args.format, args.book)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+    sys.exit(0 if report["ok"] else 1)
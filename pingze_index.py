@@ -0,0 +1,252 @@
+"""
+格律分析列：批量校验全量分片中每首诗的体裁、平仄格式和合律程度，存成与分片索引对齐的列
+
+体裁按句数和每句字数判断（与分片索引相同，见 corpus.detect_form），五绝 / 五律 / 七绝 / 七律
+按体裁成批交给 pingze_vec.py，与该体裁的四种格式（平起 / 仄起、首句入韵与否）一次比对，
+取最吻合的格式并记下不合平仄的字数，押韵用平水韵判断；其余作品记为古体（体裁 0），不做平仄分析。
+“严格合律”指错字为 0 且韵脚同韵，这些记录另存一份编号列表，按 strict=1 抽样时直接在里面取数。
+
+文件布局（小端，data/index/<集合>.pingze）：
+    头部      magic, 记录数, 严格合律记录数, 分片索引指纹（同 rhyme_scheme.py）
+    体裁      u8[记录数]（corpus.FORMS 的编号，0 为古体）
+    格式      u8[记录数]（pingze.FORMATS 的下标，255 为未分析）
+    错字数    u8[记录数]（超过 254 记为 254，255 为未分析）
+    押韵      u8[记录数]（1 同韵，0 不同韵，255 为未分析）
+    严格合律  u32[严格合律记录数]，升序的全局编号
+
+每首的体裁和近体诗的正文按「分片内容哈希」缓存在 data/index/pingze_lines/<集合>/ 下，
+声调表或韵书改动后只需用缓存重新打分，不再解析分片。缓存文件布局（小端）：
+    头部    magic, 记录数, 近体诗数
+    体裁    u8[记录数]
+    偏移表  u32 × (近体诗数 + 1)
+    数据区  近体诗各句依次拼接的 UTF-8（句数、字数由体裁决定，读出后按字数切回诗句）
+
+使用方法：
+    python pingze_index.py            # 为全部分片集合生成格律分析列
+    python pingze_index.py -j 4       # 指定进程数
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from collections import Counter
+
+from corpus import (FORM_LINES, FORMS, SHARD_COLLECTIONS, detect_form, file_digest, index_path, parallel_map,
+                    split_sentences)
+from pingze import FORMATS, TEMPLATES, check_rhyme
+from pingze_vec import match_batch
+from rhyme_scheme import shards_fingerprint
+from shard_index import open_shard_index, scan_shard
+from yun_index import get_book
+
+MAGIC = b"PPZIX\x00\x00\x01"
+HEADER = struct.Struct("<8sII20s")
+NONE = 255
+MAX_ERRORS = 254
+RHYME_BOOK = "pingshui"
+COLUMNS = ("form", "format", "errors", "rhyme")
+
+LINES_DIR = index_path("pingze_lines")
+LINES_MAGIC = b"PPZLN\x00\x00\x01"
+LINES_HEADER = struct.Struct("<8sII")
+
+
+# ===== 分片缓存 =====
+def lines_cache_path(name, source_digest):
+    key = hashlib.sha1(source_digest + LINES_MAGIC).hexdigest()
+    return os.path.join(LINES_DIR, name, f"{key}.pzl")
+
+
+def cache_shard_lines(item):
+    """item 为 (集合名, 分片路径)：判断体裁、保存近体诗正文并写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新提取)"""
+    name, path = item
+    output = lines_cache_path(name, file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    forms = bytearray()
+    blobs = []
+    for _, _, poem in scan_shard(path):
+        lines = split_sentences(poem.get("paragraphs") or [])
+        form = detect_form(lines)
+        forms.append(form)
+        if form:
+            blobs.append("".join(lines).encode("utf-8"))
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(LINES_HEADER.pack(LINES_MAGIC, len(forms), len(blobs)))
+        f.write(forms)
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(blobs))
+    os.replace(tmp, output)
+    return output, True
+
+
+def read_shard_lines(path):
+    """读一个分片的缓存：[(体裁, 诗句列表或 None)]，每首一项"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, count, n_regulated = LINES_HEADER.unpack_from(data, 0)
+    if magic != LINES_MAGIC:
+        raise ValueError(f"近体诗缓存格式不匹配: {path}")
+    pos = LINES_HEADER.size
+    forms = data[pos:pos + count]
+    pos += count
+    offsets = struct.unpack_from(f"<{n_regulated + 1}I", data, pos)
+    blob = data[pos + (n_regulated + 1) * 4:]
+    texts = iter(blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:]))
+    records = []
+    for form in forms:
+        if not form:
+            records.append((0, None))
+            continue
+        text = next(texts)
+        n = FORM_LINES[form]
+        width = len(text) // n
+        records.append((form, [text[k * width:(k + 1) * width] for k in range(n)]))
+    return records
+
+
+def collection_lines(name, paths, workers=1):
+    """集合全部记录的 (体裁, 诗句列表)（按全局编号），未缓存的分片并行提取；删除该集合不再被引用的旧缓存"""
+    results = list(parallel_map(cache_shard_lines, [(name, path) for path in paths], workers))
+    directory = os.path.join(LINES_DIR, name)
+    keep = {os.path.basename(output) for output, _ in results}
+    for entry in os.listdir(directory) if os.path.isdir(directory) else ():
+        if entry.endswith(".pzl") and entry not in keep:
+            os.remove(os.path.join(directory, entry))
+    return [record for output, _ in results for record in read_shard_lines(output)]
+
+
+# ===== 打分 =====
+def analyze(records):
+    """[(体裁, 诗句列表)] -> 每条记录的 (体裁, 格式, 错字数, 押韵)；同体裁的诗成批比对"""
+    rows = [(0, NONE, NONE, NONE)] * len(records)
+    # 体裁编号 -> [(记录下标, 诗句列表)]
+    pending = {}
+    for i, (form, lines) in enumerate(records):
+        if form:
+            pending.setdefault(form, []).append((i, lines))
+    book = get_book(RHYME_BOOK)
+    for form, items in pending.items():
+        matched = match_batch([lines for _, lines in items], FORMS[form])
+        for (i, lines), (fmt, errors) in zip(items, matched):
+            template = TEMPLATES[FORMS[form], FORMATS[fmt]]
+            yuns = check_rhyme([lines[k][-1] for k in template.rhymes], book)
+            rows[i] = (form, fmt, min(errors, MAX_ERRORS), int(yuns is None or bool(yuns)))
+    return rows
+
+
+def build_pingze_index(name, index=None, output=None, workers=1):
+    """
+    为一个集合生成格律分析列，返回 (记录数, 严格合律记录数)；分片索引不存在时返回 None
+    体裁和近体诗正文取自分片缓存，只有改动过的分片需要重新解析
+    """
+    index = index or open_shard_index(name)
+    if index is None:
+        return None
+    output = output or index_path(f"{name}.pingze")
+    rows = analyze(collection_lines(name, index.paths, workers))
+    if len(rows) != len(index):
+        raise ValueError(f"{name}: 分片与索引记录数不一致（{len(rows)} / {len(index)}）")
+    strict = [gid for gid, (form, _, errors, rhymed) in enumerate(rows) if form and errors == 0 and rhymed == 1]
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), len(strict), shards_fingerprint(index)))
+        for column in range(len(COLUMNS)):
+            f.write(bytes(row[column] for row in rows))
+        f.write(struct.pack(f"<{len(strict)}I", *strict))
+    os.replace(tmp, output)
+    return len(rows), len(strict)
+
+
+class PingzeIndex:
+    """一个集合的格律分析列；记录编号与分片索引一致，各列可直接按下标读取"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, n_strict, self.fingerprint = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"格律分析列格式不匹配: {path}")
+        view = memoryview(self.mm)
+        pos = HEADER.size
+        self.columns = {}
+        for column in COLUMNS:
+            self.columns[column] = view[pos:pos + self.count]
+            pos += self.count
+        # 严格合律（错字为 0 且押韵）的全局编号，升序
+        self.strict = view[pos:pos + n_strict * 4].cast("I")
+
+    def row(self, i):
+        """第 i 条记录：{form, format, errors, rhyme}，未分析的项为 None"""
+        form, fmt, errors, rhymed = (self.columns[c][i] for c in COLUMNS)
+        if not form:
+            return {"form": "guti", "format": None, "errors": None, "rhyme": None}
+        return {"form": FORMS[form], "format": FORMATS[fmt], "errors": errors, "rhyme": bool(rhymed)}
+
+    def is_strict(self, i):
+        return (self.columns["form"][i] and self.columns["errors"][i] == 0
+                and self.columns["rhyme"][i] == 1)
+
+    def stats(self):
+        """
+        按体裁汇总：首数、严格合律首数、各格式首数、错字数分布（0、1、2、3、4 及以上）
+        """
+        forms, fmts, errors, rhymes = (self.columns[c] for c in COLUMNS)
+        totals = Counter(forms)
+        summary = {"guti": {"total": totals.get(0, 0)}}
+        by_form = {code: {"strict": 0, "formats": Counter(), "errors": Counter()} for code in range(1, len(FORMS))}
+        for form, fmt, err, rhymed in zip(forms, fmts, errors, rhymes):
+            if not form:
+                continue
+            entry = by_form[form]
+            entry["formats"][FORMATS[fmt]] += 1
+            entry["errors"][min(err, 4)] += 1
+            if err == 0 and rhymed == 1:
+                entry["strict"] += 1
+        for code, entry in by_form.items():
+            summary[FORMS[code]] = {
+                "total": totals.get(code, 0),
+                "strict": entry["strict"],
+                "formats": {fmt: entry["formats"].get(fmt, 0) for fmt in FORMATS},
+                "errors": {("4+" if k == 4 else str(k)): entry["errors"].get(k, 0) for k in range(5)},
+            }
+        return summary
+
+
+def open_pingze_index(name, index):
+    """打开集合的格律分析列；未生成或与当前分片索引不一致时返回 None"""
+    if index is None:
+        return None
+    try:
+        pingze = PingzeIndex(index_path(f"{name}.pingze"))
+    except (OSError, ValueError) as e:
+        print(f"格律分析列 {name} 加载失败:", e)
+        return None
+    if pingze.count != len(index) or pingze.fingerprint != shards_fingerprint(index):
+        print(f"格律分析列 {name} 与分片索引不一致，需重新生成")
+        return None
+    return pingze
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为全量分片生成格律分析列")
+    parser.add_argument("collections", nargs="*", help="集合名，默认全部")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数")
+    args = parser.parse_args()
+    for name in args.collections or SHARD_COLLECTIONS:
+        built = build_pingze_index(name, workers=max(args.workers, 1))
+        if built is None:
+            print(f"❌ {name}: 分片索引尚未生成")
+            continue
+        total, strict = built
+        stats = open_pingze_index(name, open_shard_index(name)).stats()
+        regulated = " ".join(f"{form} {s['strict']}/{s['total']}" for form, s in stats.items() if form != "guti")
+        print(f"✅ {name}: {total} 首，严格合律 {strict} 首；{regulated}")
@@ -3,6 +3,10 @@ import random
 import json
 import os
 
+from corpus import SHARD_COLLECTIONS
+from shard_index import open_shard_index
+from snapshot import open_snapshot
+
 app = Flask(__name__)
 
 # ===== 数据加载 =====
@@ -15,13 +19,16 @@ tang_path = os.path.join(BASE, "data", "chinese-poetry-master", "全唐诗", "
 song_path = os.path.join(BASE, "data", "chinese-poetry-master", "宋词", "宋词三百首.json")
 yun_path = os.path.join(BASE, "zhonghua_xinyun.json")
 
+# 优先映射预编译快照（python snapshot.py 生成），快照缺失时回退到解析 JSON
+snap = open_snapshot()
+
 try:
-    tang_list = load_json(tang_path)
+    tang_list = snap.collection("tang300") if snap else load_json(tang_path)
 except:
     tang_list = [{"title": "示例诗", "author": "佚名", "paragraphs": ["山高月小", "水落石出"]}]
 
 try:
-    song_list = load_json(song_path)
+    song_list = snap.collection("song300") if snap else load_json(song_path)
 except:
     song_list = [{"title": "示例词", "author": "佚名", "paragraphs": ["春风又绿江南岸", "明月何时照我还"]}]
 
@@ -32,6 +39,11 @@ except Exception as e:
     print("韵部文件加载失败:", e)
     yunbu_data = {}
 
+# 全量分片的记录偏移索引（python shard_index.py 生成），/poem/<ptype> 按需解码单条记录
+shard_indexes = {name: open_shard_index(name) for name in SHARD_COLLECTIONS}
+# /poem/<ptype> 对应的分片集合：song 指宋词，宋诗用 songshi
+POEM_COLLECTIONS = {"tang": "tang", "song": "ci", "songshi": "song"}
+
 # ===== 悬浮搜索框组件 =====
 floating_search_html = '''
 <div id="floating-search" style="
@@ -2070,7 +2082,11 @@ def search_yun():
 
 @app.route("/poem/<ptype>")
 def poem(ptype):
-    if ptype == "tang":
+    scope = request.args.get("scope", "full")
+    index = shard_indexes.get(POEM_COLLECTIONS.get(ptype))
+    if scope != "selected" and index is not None and len(index):
+        poem = index.record(random.randrange(len(index)))
+    elif ptype == "tang":
         poem = random.choice(tang_list)
     elif ptype == "song":
         poem = random.choice(song_list)
@@ -2080,7 +2096,7 @@ def poem(ptype):
     paragraphs = poem.get("paragraphs", [])
     content = "\n".join(paragraphs)
     return jsonify({
-        "title": poem.get("title", ""),
+        "title": poem.get("rhythmic") or poem.get("title", ""),
         "author": poem.get("author", ""),
         "content": content
     })
@@ -0,0 +1,140 @@
+"""
+紧凑诗词记录：替代 json.load 得到的 list[dict]
+
+dict 布局下每首诗都有一个 dict、一个 paragraphs 列表、每行一个 str，
+作者名也是每首各自一份。这里改为按列存放，没有任何逐首的 Python 对象：
+    - 文本    全部标题和各行依次拼接的 UTF-16-LE（一个 bytearray，汉字每字 2 字节）
+    - 段结束  各段（标题、各行）在文本中的结束位置，u32 数组
+    - 首段    每首第一段在段结束数组中的下标，u32 数组（首数 + 1 项）
+    - 作者    每首的作者编号，u32 数组；作者名在 PoemStore 中去重
+取第 i 首时按首段、段结束两个数组切出各段再解码。
+
+PoemStore 支持 len() 和下标访问（返回与原来相同形状的 dict），可以直接替换 tang_list 等列表。
+服务时精选集合优先映射快照（snapshot.py），多个 worker 共享同一份页缓存；
+PoemStore 用在快照缺失时的回退路径上。
+
+使用方法：
+    python records.py                # 在全量分片上对比 dict 布局与紧凑布局的常驻内存（RSS）
+"""
+import array
+import gc
+import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus import SHARD_COLLECTIONS, collection_files, load_json
+from shard_index import iter_collection
+
+ENCODING = "utf-16-le"
+# UTF-16 每个码元 2 字节；基本区以外的字占两个码元，位置仍按码元计，切片不会落在字中间
+UNIT = 2
+
+
+class PoemStore:
+    """一组按列存放的紧凑记录 + 作者名表"""
+
+    def __init__(self):
+        self.authors = []
+        self._author_ids = {}
+        self._text = bytearray()
+        self._ends = array.array("I")
+        self._firsts = array.array("I", [0])
+        self._poem_authors = array.array("I")
+
+    def add(self, poem, title_key="title"):
+        author = poem.get("author") or ""
+        aid = self._author_ids.get(author)
+        if aid is None:
+            aid = self._author_ids[author] = len(self.authors)
+            self.authors.append(author)
+        parts = [poem.get(title_key) or poem.get("title") or ""] + list(poem.get("paragraphs") or [])
+        for part in parts:
+            self._text += part.encode(ENCODING)
+            self._ends.append(len(self._text) // UNIT)
+        self._firsts.append(len(self._ends))
+        self._poem_authors.append(aid)
+
+    def extend(self, poems, title_key="title"):
+        for poem in poems:
+            self.add(poem, title_key)
+        return self
+
+    def __len__(self):
+        return len(self._poem_authors)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        first, last = self._firsts[i], self._firsts[i + 1]
+        pos = self._ends[first - 1] if first else 0
+        parts = []
+        for end in self._ends[first:last]:
+            parts.append(self._text[pos * UNIT:end * UNIT].decode(ENCODING))
+            pos = end
+        return {
+            "title": parts[0],
+            "author": self.authors[self._poem_authors[i]],
+            "paragraphs": parts[1:],
+        }
+
+
+def load_store(paths, title_key="title"):
+    """逐个文件读入紧凑记录，同一时刻只有一个文件的 dict 形式在内存中"""
+    store = PoemStore()
+    for path in paths:
+        store.extend(load_json(path), title_key)
+    return store
+
+
+# ===== 内存对比 =====
+def _rss():
+    """当前常驻内存字节数：优先读 /proc/self/statm，没有时退回 getrusage 的峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _resident(name, layout):
+    """在当前进程构建一种布局，返回 (首数, 构建前后 RSS 之差)"""
+    patterns, title_key = SHARD_COLLECTIONS[name]
+    gc.collect()
+    before = _rss()
+    if layout == "dict":
+        data = [p for path in collection_files(patterns) for p in load_json(path)]
+    else:
+        data = PoemStore().extend(iter_collection(name), title_key)
+    gc.collect()
+    return len(data), _rss() - before
+
+
+def memory_report(names=None):
+    """
+    对每个集合分别测量两种布局常驻的字节数，返回 [(集合, 首数, dict 字节数, 紧凑字节数)]
+    每次测量都在新的子进程里做：释放的内存未必还给操作系统，同一进程里先后测量会互相干扰
+    """
+    rows = []
+    for name in names or SHARD_COLLECTIONS:
+        sizes = []
+        for layout in ("dict", "compact"):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                count, size = pool.submit(_resident, name, layout).result()
+            sizes.append(size)
+        dict_bytes, compact_bytes = sizes
+        rows.append((name, count, dict_bytes, compact_bytes))
+        print(f"{name:>6} {count:>8} {dict_bytes / (1 << 20):>10.1f} {compact_bytes / (1 << 20):>10.1f} "
+              f"{dict_bytes / compact_bytes:>6.2f}x")
+    return rows
+
+
+if __name__ == "__main__":
+    print(f"{'集合':>6} {'首数':>8} {'dict(MB)':>10} {'紧凑(MB)':>10} {'压缩比':>6}")
+    rows = memory_report(sys.argv[1:] or None)
+    total_dict = sum(r[2] for r in rows)
+    total_compact = sum(r[3] for r in rows)
+    print(f"{'合计':>6} {sum(r[1] for r in rows):>8} {total_dict / (1 << 20):>10.1f} "
+          f"{total_compact / (1 << 20):>10.1f} {total_dict / total_compact:>6.2f}x")
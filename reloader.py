@@ -0,0 +1,91 @@
+"""
+数据热更新：后台线程轮询语料分片、韵部文件和词牌文件，发现改动后只重建受影响的部分
+
+每组文件对应一个重建函数。重建函数在后台线程里构建出完整的新数据后再一次性替换引用，
+请求开始时取一次引用，看到的要么是旧的一代，要么是完整的新一代，不会读到一半的状态。
+"""
+import os
+import threading
+import time
+
+from corpus import file_digest
+
+
+class FileWatcher:
+    """
+    记录一组文件的 (大小, mtime, 内容哈希)
+    大小和 mtime 都没变时不读文件；变了再比对哈希，只是 touch 过的文件不算改动
+    """
+
+    def __init__(self, paths):
+        self.state = {path: self._snapshot(path) for path in paths}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _snapshot(self, path):
+        stat = self._stat(path)
+        return (stat, file_digest(path)) if stat else (None, None)
+
+    def poll(self, paths):
+        """返回自上次轮询以来新增、删除或内容改动的文件"""
+        changed = []
+        current = set(paths)
+        for path in current:
+            stat = self._stat(path)
+            old_stat, old_digest = self.state.get(path, (None, None))
+            if stat == old_stat:
+                continue
+            digest = file_digest(path) if stat else None
+            self.state[path] = (stat, digest)
+            if digest != old_digest:
+                changed.append(path)
+        for path in set(self.state) - current:
+            del self.state[path]
+            changed.append(path)
+        return changed
+
+
+class Reloader:
+    """
+    按固定间隔轮询各组文件，组内有改动时调用对应的重建函数
+    每组一个后台线程，全量语料重建较慢时不会耽误韵部、词牌这类小文件的更新
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.groups = []
+
+    def watch(self, name, paths, rebuild):
+        """
+        name     日志中显示的组名
+        paths    无参函数，返回当前应监视的文件列表（分片可能增删）
+        rebuild  重建函数，参数为改动过的文件列表
+        """
+        self.groups.append((name, paths, rebuild))
+
+    def start(self):
+        for name, paths, rebuild in self.groups:
+            threading.Thread(target=self._run, args=(name, paths, rebuild),
+                             name=f"reloader-{name}", daemon=True).start()
+
+    def _run(self, name, paths, rebuild):
+        # 首次计算哈希放在后台线程，不拖慢启动
+        watcher = FileWatcher(paths())
+        while True:
+            time.sleep(self.interval)
+            changed = watcher.poll(paths())
+            if not changed:
+                continue
+            started = time.perf_counter()
+            try:
+                rebuild(changed)
+            except Exception as e:
+                print(f"{name} 重建失败:", e)
+                continue
+            print(f"🔄 {name} 已更新（{len(changed)} 个文件，{time.perf_counter() - started:.2f}s）")
@@ -0,0 +1,115 @@
+"""
+韵脚字频：统计全量分片（全唐诗 / 宋诗 / 宋词）中每个字做韵脚的次数
+
+韵脚按句读判断：句号、问号、叹号、分号前的最后一个字。诗的 paragraphs 每段是一联，
+联末即偶句句末；词的押韵处也基本都落在这些标点上。繁体字先按转换表归一成简体再计数，
+与韵书中的韵字写法一致。
+
+结果写成一张小表（data/index/rhyme_freq.idx），韵书加载时读入，按字频给各韵部的韵字排序，
+排好的结果随韵书常驻，请求时不再有额外开销。文件布局（小端）：
+    头部    magic, 字数, 韵脚总数
+    字频表  每个字 (码位 u32, 次数 u32)，按码位升序
+各分片的字频按「分片内容哈希 + 转换表哈希」缓存在 data/index/rhyme_counts/ 下（布局同上），
+重建时只有改动过的分片需要重新统计，其余分片直接读缓存相加。
+
+使用方法：
+    python rhyme_freq.py              # 统计并生成字频表
+    python rhyme_freq.py -j 4         # 指定进程数
+"""
+import argparse
+import hashlib
+import os
+import re
+import struct
+from collections import Counter
+
+from corpus import SHARD_COLLECTIONS, collection_files, file_digest, index_path, parallel_map
+from normalize import get_converter, table_digest
+from shard_index import scan_shard
+
+MAGIC = b"PRFRQ\x00\x00\x01"
+HEADER = struct.Struct("<8sII")
+ROW = struct.Struct("<II")
+FREQ_PATH = index_path("rhyme_freq.idx")
+COUNTS_DIR = index_path("rhyme_counts")
+
+RHYME_END = re.compile(r"([㐀-鿿豈-﫿])[。？！；?!;]")
+
+
+def count_shard(path):
+    """一个分片中各韵脚字的次数（已转成简体）"""
+    chars = get_converter().chars
+    counts = Counter()
+    for _, _, poem in scan_shard(path):
+        for para in poem.get("paragraphs") or []:
+            counts.update(RHYME_END.findall(para))
+    simplified = Counter()
+    for ch, n in counts.items():
+        simplified[ch.translate(chars)] += n
+    return simplified
+
+
+def _write_counts(output, counts):
+    """字 -> 次数写成字频表；转换后个别字可能不止一个码位（如扩展区字），只保留单字"""
+    rows = sorted((ord(ch), n) for ch, n in counts.items() if len(ch) == 1)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), sum(n for _, n in rows)))
+        f.write(b"".join(ROW.pack(*row) for row in rows))
+    os.replace(tmp, output)
+    return len(rows), sum(n for _, n in rows)
+
+
+def counts_cache_path(source_digest):
+    key = hashlib.sha1(source_digest + table_digest() + MAGIC).hexdigest()
+    return os.path.join(COUNTS_DIR, f"{key}.cnt")
+
+
+def cache_shard_counts(path):
+    """统计一个分片并写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新统计)"""
+    output = counts_cache_path(file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    _write_counts(output, count_shard(path))
+    return output, True
+
+
+def build_rhyme_freq(output=FREQ_PATH, workers=1):
+    """各分片字频（已缓存的直接读取）相加后写出字频表，删除不再被引用的旧缓存，返回 (字数, 韵脚总数)"""
+    files = [p for patterns, _ in SHARD_COLLECTIONS.values() for p in collection_files(patterns)]
+    os.makedirs(COUNTS_DIR, exist_ok=True)
+    results = list(parallel_map(cache_shard_counts, files, workers))
+    keep = {os.path.basename(path) for path, _ in results}
+    for name in os.listdir(COUNTS_DIR):
+        if name.endswith(".cnt") and name not in keep:
+            os.remove(os.path.join(COUNTS_DIR, name))
+    total = Counter()
+    for path, _ in results:
+        total.update(load_rhyme_freq(path))
+    return _write_counts(output, total)
+
+
+def load_rhyme_freq(path=FREQ_PATH):
+    """读取字频表：字 -> 次数；文件不存在或格式不对时返回空 dict（韵字保持原顺序）"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, n, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"字频表格式不匹配: {path}")
+    except (OSError, ValueError, struct.error) as e:
+        print("韵脚字频加载失败，韵字按原顺序返回:", e)
+        return {}
+    return {chr(cp): count for cp, count in ROW.iter_unpack(data[HEADER.size:HEADER.size + n * ROW.size])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="统计全量分片中的韵脚字频")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数")
+    args = parser.parse_args()
+    n_chars, n_rhymes = build_rhyme_freq(workers=max(args.workers, 1))
+    freq = load_rhyme_freq()
+    top = sorted(freq.items(), key=lambda item: -item[1])[:20]
+    print(f"✅ 已生成 {FREQ_PATH}：{n_chars} 个字，{n_rhymes} 个韵脚")
+    print("   最常用的韵脚：" + " ".join(f"{ch}{n}" for ch, n in top))
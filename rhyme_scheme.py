@@ -0,0 +1,247 @@
+"""
+用韵标注：为全量分片中的每首诗词判断所用韵部，存成与分片索引对齐的紧凑列
+
+韵脚位置与 rhyme_freq.py 相同（句号、问号、叹号、分号前的字），繁体先归一成简体，
+再用各部韵书（yun_index.BOOKS）查出所属韵部并投票：多音字在几个韵部中平分一票。
+每首记录每部韵书存两个 u8：主韵部、次韵部（换韵的古体、词的上下片等），没有时为 255。
+另为每个韵部存一份记录编号倒排（主、次韵部都算），按韵部筛选时直接在倒排里取数。
+
+文件布局（小端，data/index/<集合>.yun）：
+    头部      magic, 记录数, 韵书数, 分片索引指纹（各分片哈希拼接后的 SHA-1）
+    每部韵书  名称长度(u16) + 名称 + 韵部数(u16)
+              主韵部 u8[记录数] + 次韵部 u8[记录数]
+              倒排起点 u32[韵部数 + 1] + 记录编号 u32[...]
+
+每首的韵脚字（已转成简体）按「分片内容哈希 + 转换表哈希」缓存在 data/index/rhyme_chars/<集合>/ 下，
+韵书改动后只需用缓存的韵脚字重新投票，不再解析分片。缓存文件布局（小端）：
+    头部    magic, 记录数
+    偏移表  u32 × (记录数 + 1)
+    数据区  各记录韵脚字依次拼接的 UTF-8
+
+使用方法：
+    python rhyme_scheme.py            # 为全部分片集合生成用韵标注
+    python rhyme_scheme.py -j 4       # 指定进程数
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+from collections import Counter
+
+from corpus import SHARD_COLLECTIONS, file_digest, index_path, parallel_map
+from normalize import get_converter, table_digest
+from rhyme_freq import RHYME_END
+from shard_index import open_shard_index, scan_shard
+from yun_index import BOOKS, get_book
+
+MAGIC = b"PRYUN\x00\x00\x01"
+HEADER = struct.Struct("<8sII20s")
+NONE = 255
+
+CHARS_DIR = index_path("rhyme_chars")
+CHARS_MAGIC = b"PRCHR\x00\x00\x01"
+CHARS_HEADER = struct.Struct("<8sI")
+
+# 次韵部至少要有这么多票，并且占全部韵脚的这一比例，才记为换韵
+SECONDARY_MIN_VOTES = 2
+SECONDARY_MIN_SHARE = 0.25
+
+
+def shards_fingerprint(index):
+    """标注与分片索引对应的凭据：各分片内容哈希依次拼接后的 SHA-1"""
+    return hashlib.sha1(b"".join(index.digests)).digest()
+
+
+def rhyme_chars(paragraphs):
+    """一首诗词的韵脚字（已转成简体），按出现顺序"""
+    chars = get_converter().chars
+    return [ch.translate(chars) for para in paragraphs for ch in RHYME_END.findall(para)]
+
+
+def classify(chars, group_ids):
+    """韵脚字 -> (主韵部, 次韵部)；group_ids 为 字 -> 韵部编号元组"""
+    votes = Counter()
+    for ch in chars:
+        ids = group_ids(ch)
+        for gid in ids:
+            votes[gid] += 1 / len(ids)
+    ranked = votes.most_common(2)
+    if not ranked:
+        return NONE, NONE
+    primary = ranked[0][0]
+    secondary = NONE
+    if len(ranked) > 1:
+        gid, n = ranked[1]
+        if n >= SECONDARY_MIN_VOTES and n >= SECONDARY_MIN_SHARE * len(chars):
+            secondary = gid
+    return primary, secondary
+
+
+# ===== 分片缓存 =====
+def chars_cache_path(name, source_digest):
+    key = hashlib.sha1(source_digest + table_digest() + CHARS_MAGIC).hexdigest()
+    return os.path.join(CHARS_DIR, name, f"{key}.rch")
+
+
+def cache_shard_chars(item):
+    """item 为 (集合名, 分片路径)：提取每首的韵脚字并写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新提取)"""
+    name, path = item
+    output = chars_cache_path(name, file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    blobs = ["".join(rhyme_chars(poem.get("paragraphs") or [])).encode("utf-8") for _, _, poem in scan_shard(path)]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(CHARS_HEADER.pack(CHARS_MAGIC, len(blobs)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(blobs))
+    os.replace(tmp, output)
+    return output, True
+
+
+def read_shard_chars(path):
+    """读一个分片的韵脚字缓存：[每首的韵脚字串]"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, count = CHARS_HEADER.unpack_from(data, 0)
+    if magic != CHARS_MAGIC:
+        raise ValueError(f"韵脚字缓存格式不匹配: {path}")
+    offsets = struct.unpack_from(f"<{count + 1}I", data, CHARS_HEADER.size)
+    blob = data[CHARS_HEADER.size + (count + 1) * 4:]
+    return [blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+
+def collection_chars(name, paths, workers=1):
+    """集合全部记录的韵脚字串（按全局编号），未缓存的分片并行提取；删除该集合不再被引用的旧缓存"""
+    results = list(parallel_map(cache_shard_chars, [(name, path) for path in paths], workers))
+    directory = os.path.join(CHARS_DIR, name)
+    keep = {os.path.basename(output) for output, _ in results}
+    for entry in os.listdir(directory) if os.path.isdir(directory) else ():
+        if entry.endswith(".rch") and entry not in keep:
+            os.remove(os.path.join(directory, entry))
+    return [chars for output, _ in results for chars in read_shard_chars(output)]
+
+
+def classify_all(records):
+    """各记录的韵脚字串 -> 每条记录在各部韵书下的 (主韵部, 次韵部)，按 BOOKS 的顺序"""
+    lookups = [get_book(name).group_ids for name in BOOKS]
+    return [[classify(chars, lookup) for lookup in lookups] for chars in records]
+
+
+def build_rhyme_scheme(name, index=None, output=None, workers=1):
+    """
+    为一个集合生成用韵标注，返回记录数；分片索引不存在时返回 None
+    韵脚字取自分片缓存，只有改动过的分片需要重新解析
+    """
+    index = index or open_shard_index(name)
+    if index is None:
+        return None
+    output = output or index_path(f"{name}.yun")
+    rows = classify_all(collection_chars(name, index.paths, workers))
+    if len(rows) != len(index):
+        raise ValueError(f"{name}: 分片与索引记录数不一致（{len(rows)} / {len(index)}）")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), len(BOOKS), shards_fingerprint(index)))
+        for b, book_name in enumerate(BOOKS):
+            n_groups = len(get_book(book_name).names)
+            raw = book_name.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw + struct.pack("<H", n_groups))
+            f.write(bytes(row[b][0] for row in rows))
+            f.write(bytes(row[b][1] for row in rows))
+            postings = [[] for _ in range(n_groups)]
+            for gid, row in enumerate(rows):
+                for group in row[b]:
+                    if group != NONE:
+                        postings[group].append(gid)
+            starts = [0]
+            for posting in postings:
+                starts.append(starts[-1] + len(posting))
+            f.write(struct.pack(f"<{len(starts)}I", *starts))
+            for posting in postings:
+                f.write(struct.pack(f"<{len(posting)}I", *posting))
+    os.replace(tmp, output)
+    return len(rows)
+
+
+class RhymeScheme:
+    """一个集合的用韵标注；记录编号与分片索引一致"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, n_books, self.fingerprint = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"用韵标注格式不匹配: {path}")
+        # 韵书名 -> (主韵部列位置, 次韵部列位置, 韵部数, 倒排起点表, 倒排位置)
+        self.books = {}
+        pos = HEADER.size
+        for _ in range(n_books):
+            (name_len,) = struct.unpack_from("<H", self.mm, pos)
+            name = self.mm[pos + 2:pos + 2 + name_len].decode("utf-8")
+            pos += 2 + name_len
+            (n_groups,) = struct.unpack_from("<H", self.mm, pos)
+            pos += 2
+            primary_pos = pos
+            pos += 2 * self.count
+            starts = struct.unpack_from(f"<{n_groups + 1}I", self.mm, pos)
+            pos += (n_groups + 1) * 4
+            self.books[name] = (primary_pos, primary_pos + self.count, n_groups, starts, pos)
+            pos += starts[-1] * 4
+        self._postings = memoryview(self.mm).cast("B")
+
+    def groups(self, book, i):
+        """第 i 条记录在该韵书下的韵部编号（主、次），没有判断出来时为空"""
+        primary_pos, secondary_pos, _, _, _ = self.books[book]
+        return tuple(g for g in (self.mm[primary_pos + i], self.mm[secondary_pos + i]) if g != NONE)
+
+    def postings(self, book, group):
+        """使用该韵部的全部记录编号（升序），可 len() 和下标访问"""
+        _, _, _, starts, pos = self.books[book]
+        start, end = starts[group], starts[group + 1]
+        return self._postings[pos + start * 4:pos + end * 4].cast("I")
+
+    def counts(self, book):
+        _, _, n_groups, starts, _ = self.books[book]
+        return [starts[g + 1] - starts[g] for g in range(n_groups)]
+
+
+def open_rhyme_scheme(name, index):
+    """打开集合的用韵标注；未生成、与当前分片索引或韵书列表不一致时返回 None"""
+    if index is None:
+        return None
+    try:
+        scheme = RhymeScheme(index_path(f"{name}.yun"))
+    except (OSError, ValueError) as e:
+        print(f"用韵标注 {name} 加载失败:", e)
+        return None
+    if scheme.count != len(index) or scheme.fingerprint != shards_fingerprint(index):
+        print(f"用韵标注 {name} 与分片索引不一致，需重新生成")
+        return None
+    if list(scheme.books) != list(BOOKS):
+        print(f"用韵标注 {name} 的韵书与 yun_index.BOOKS 不一致，需重新生成")
+        return None
+    return scheme
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为全量分片生成用韵标注")
+    parser.add_argument("collections", nargs="*", help="集合名，默认全部")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数")
+    args = parser.parse_args()
+    for name in args.collections or SHARD_COLLECTIONS:
+        count = build_rhyme_scheme(name, workers=max(args.workers, 1))
+        if count is None:
+            print(f"❌ {name}: 分片索引尚未生成")
+            continue
+        scheme = open_rhyme_scheme(name, open_shard_index(name))
+        book = get_book()
+        top = sorted(zip(book.names, scheme.counts(book.name)), key=lambda item: -item[1])[:5]
+        print(f"✅ {name}: {count} 首；" + " ".join(f"{yun}{n}" for yun, n in top))
@@ -0,0 +1,430 @@
+"""
+全文检索：基于汉字二元组（bigram）的倒排索引，覆盖全部分片的 paragraphs
+
+每个连续的汉字片段拆成单字和相邻二字组作为检索词，查询时把查询串同样拆分，
+取所有检索词倒排表的交集，按 BM25 排序。正文和查询串都先按繁简归一成简体再拆分，
+长安、長安查到的结果相同。倒排表为差值 + varint 压缩，
+词典和倒排都在 mmap 中按需读取，查询时不加载原始 JSON。
+
+索引文件布局（小端，data/index/search.idx）：
+    头部      magic, 版本, 检索词数, 集合数, 平均文档长度(f64)
+    文档长度  每个集合：文档数(u32) + u16[文档数]（汉字数）
+    词典键    u64[检索词数]，升序；键为 (首字码位 << 21) | 次字码位，单字的次字码位为 0
+    词典值    每个检索词 (倒排起点 u64, 倒排字节数 u32, 文档频率 u32)
+    倒排      每条 varint((文档编号差值 << 3) | min(词频, 7))，文档编号见 corpus.pack_doc_id
+
+各分片的局部倒排按「分片内容哈希 + 转换表哈希」缓存在 data/index/search_terms/ 下，重建时只有改动过的分片
+需要重新分词，其余分片直接读缓存拼接。缓存文件布局（小端）：
+    头部      magic, 文档数, 检索词数, 倒排字节数
+    文档长度  u16[文档数]
+    检索词    键 u64[检索词数]（升序），首条 u32[]（(分片内编号 << 3) | 词频），
+              末条分片内编号 u32[]，文档频率 u32[]，其余倒排字节数 u32[]
+    倒排      每个检索词除首条外的 varint((分片内编号差值 << 3) | 词频)
+首条单独存放：合并时只需按前一个分片的末条重新编码首条，其余字节原样拼接。装有 NumPy 时
+全部（检索词, 分片）对一次排序、批量编码首条并按块搬运其余字节；没有 NumPy 时逐对拼接，结果一致。
+
+使用方法：
+    python search_index.py
+"""
+import array
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+
+from corpus import (COLLECTION_NAMES, GID_BITS, GID_MASK, SHARD_COLLECTIONS, collection_files, file_digest,
+                    index_path, pack_doc_id, parallel_map)
+from normalize import get_converter, table_digest
+from shard_index import scan_shard
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 格式版本只在这里改，magic 末字节随之变化
+VERSION = 2
+MAGIC = b"PSSCH\x00\x00" + bytes([VERSION])
+HEADER = struct.Struct("<8sIIId")
+ENTRY = struct.Struct("<QII")
+SEARCH_PATH = index_path("search.idx")
+
+TERMS_DIR = index_path("search_terms")
+TERMS_MAGIC = b"PSTRM\x00\x00\x02"
+TERMS_HEADER = struct.Struct("<8sIII")
+
+# 词频只保留 3 位，BM25 在这个范围内已接近饱和
+_TF_BITS = 3
+_TF_MAX = (1 << _TF_BITS) - 1
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿\U00020000-\U0003134f]+")
+
+
+def term_key(term):
+    return (ord(term[0]) << 21) | (ord(term[1]) if len(term) > 1 else 0)
+
+
+def text_terms(text):
+    """文本 -> 检索词列表（单字 + 相邻二字组，可能重复）"""
+    terms = []
+    for run in _CJK.findall(text):
+        terms.extend(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def query_terms(query):
+    """查询串 -> 去重后的检索词（已转成简体）；多字片段只用二字组，单字片段用单字"""
+    terms = []
+    for run in _CJK.findall(get_converter().convert(query)):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return list(dict.fromkeys(terms))
+
+
+def _varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+# ===== 构建 =====
+def index_shard_terms(path):
+    """
+    为一个分片建局部倒排：检索词（简体）-> [(分片内编号, 词频)]，以及每首诗的汉字数
+    分片之间互不依赖，合并时只需按分片顺序给编号加上偏移
+    """
+    convert = get_converter().convert
+    postings = {}
+    lengths = []
+    for local, (_, _, poem) in enumerate(scan_shard(path)):
+        text = convert("\n".join(poem.get("paragraphs") or []))
+        terms = text_terms(text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((local, tf))
+        lengths.append(min(sum(len(run) for run in _CJK.findall(text)), 0xFFFF))
+    return postings, lengths
+
+
+def terms_cache_path(source_digest):
+    key = hashlib.sha1(source_digest + table_digest() + TERMS_MAGIC).hexdigest()
+    return os.path.join(TERMS_DIR, f"{key}.trm")
+
+
+def cache_shard_terms(path):
+    """分片局部倒排写入缓存；缓存已存在时跳过。返回 (缓存路径, 是否新建)"""
+    output = terms_cache_path(file_digest(path))
+    if os.path.exists(output):
+        return output, False
+    postings, lengths = index_shard_terms(path)
+    items = sorted((term_key(term), docs) for term, docs in postings.items())
+    firsts, lasts, dfs, sizes = (array.array("I") for _ in range(4))
+    blob = bytearray()
+    for _, docs in items:
+        local, tf = docs[0]
+        firsts.append((local << _TF_BITS) | min(tf, _TF_MAX))
+        start = len(blob)
+        prev = local
+        for local, tf in docs[1:]:
+            _varint(((local - prev) << _TF_BITS) | min(tf, _TF_MAX), blob)
+            prev = local
+        lasts.append(prev)
+        dfs.append(len(docs))
+        sizes.append(len(blob) - start)
+    os.makedirs(TERMS_DIR, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(TERMS_HEADER.pack(TERMS_MAGIC, len(lengths), len(items), len(blob)))
+        f.write(array.array("H", lengths).tobytes())
+        f.write(array.array("Q", (key for key, _ in items)).tobytes())
+        for column in (firsts, lasts, dfs, sizes):
+            f.write(column.tobytes())
+        f.write(blob)
+    os.replace(tmp, output)
+    return output, True
+
+
+def read_shard_terms(path):
+    """读一个分片的局部倒排缓存：(文档长度, 键, 首条, 末条, 文档频率, 其余倒排字节数, 倒排)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, n_docs, n_terms, blob_size = TERMS_HEADER.unpack_from(data, 0)
+    if magic != TERMS_MAGIC or len(data) != TERMS_HEADER.size + n_docs * 2 + n_terms * 24 + blob_size:
+        raise ValueError(f"局部倒排缓存格式不匹配: {path}")
+    pos = TERMS_HEADER.size
+    columns = []
+    for code, count in (("H", n_docs), ("Q", n_terms), ("I", n_terms), ("I", n_terms), ("I", n_terms), ("I", n_terms)):
+        column = array.array(code)
+        column.frombytes(data[pos:pos + count * column.itemsize])
+        columns.append(column)
+        pos += count * column.itemsize
+    return (*columns, data[pos:])
+
+
+def cache_all_terms(workers=1):
+    """
+    全部分片的局部倒排写入缓存（已缓存的跳过），删除不再被引用的旧缓存
+    返回 ({集合: [缓存路径]}, 新建的分片数)
+    """
+    files = {name: collection_files(patterns) for name, (patterns, _) in SHARD_COLLECTIONS.items()}
+    os.makedirs(TERMS_DIR, exist_ok=True)
+    results = list(parallel_map(cache_shard_terms, [p for name in COLLECTION_NAMES for p in files[name]], workers))
+    keep = {os.path.basename(output) for output, _ in results}
+    for name in os.listdir(TERMS_DIR):
+        if name.endswith(".trm") and name not in keep:
+            os.remove(os.path.join(TERMS_DIR, name))
+    outputs = iter(output for output, _ in results)
+    return {name: [next(outputs) for _ in files[name]] for name in COLLECTION_NAMES}, \
+        sum(built for _, built in results)
+
+
+def _merge_python(shards, keys_pos):
+    """
+    逐个（检索词, 分片）拼接：shards 为按文档编号排好的 [(起始编号, 键, 首条, 末条, 文档频率, 其余字节数, 倒排)]
+    返回 (词典键, 词典值, [倒排片段])，词典从文件偏移 keys_pos 开始
+    """
+    merged = {}
+    for base, keys, firsts, lasts, dfs, sizes, blob in shards:
+        pos = 0
+        for key, first, last, n, size in zip(keys, firsts, lasts, dfs, sizes):
+            slot = merged.get(key)
+            if slot is None:
+                buf = bytearray()
+                prev = 0
+                merged[key] = [buf, base + last, n]
+            else:
+                buf, prev, _ = slot
+                slot[1] = base + last
+                slot[2] += n
+            _varint(((base + (first >> _TF_BITS) - prev) << _TF_BITS) | (first & _TF_MAX), buf)
+            buf += blob[pos:pos + size]
+            pos += size
+    keys = sorted(merged)
+    blob_pos = keys_pos + len(keys) * (8 + ENTRY.size)
+    entries = bytearray()
+    for key in keys:
+        buf, _, n = merged[key]
+        entries += ENTRY.pack(blob_pos, len(buf), n)
+        blob_pos += len(buf)
+    return array.array("Q", keys), entries, [merged[key][0] for key in keys]
+
+
+# 一次搬运的（检索词, 分片）对数，控制按字节展开的下标数组的大小
+_MERGE_BLOCK = 1 << 20
+
+
+def _merge_numpy(shards, keys_pos):
+    """与 _merge_python 相同，按 (键, 分片顺序) 稳定排序后批量计算"""
+    keys = np.concatenate([np.frombuffer(shard[1], dtype=np.uint64) for shard in shards])
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+
+    def column(i, with_base=False):
+        values = np.concatenate([np.frombuffer(shard[i], dtype=np.uint32).astype(np.uint64)
+                                 + (shard[0] if with_base else 0) for shard in shards])
+        return values[order]
+
+    firsts = np.concatenate([np.frombuffer(shard[2], dtype=np.uint32) for shard in shards])[order]
+    first_doc = column(2) >> _TF_BITS
+    first_doc += np.repeat(np.array([shard[0] for shard in shards], dtype=np.uint64),
+                           [len(shard[1]) for shard in shards])[order]
+    last_doc = column(3, with_base=True)
+    dfs = column(4)
+    sizes = column(5)
+    # 其余倒排在全部分片倒排拼接后的起点
+    blobs = np.frombuffer(b"".join(shard[6] for shard in shards), dtype=np.uint8)
+    blob_starts = np.concatenate([np.frombuffer(shard[5], dtype=np.uint32).astype(np.int64) for shard in shards])
+    blob_starts = (np.cumsum(blob_starts) - blob_starts)[order]
+    del order
+
+    new_term = np.ones(len(keys), dtype=bool)
+    new_term[1:] = keys[1:] != keys[:-1]
+    prev = np.zeros(len(keys), dtype=np.uint64)
+    prev[1:] = last_doc[:-1]
+    prev[new_term] = 0
+    values = ((first_doc - prev) << np.uint64(_TF_BITS)) | (firsts & _TF_MAX).astype(np.uint64)
+    del prev, first_doc, last_doc, firsts
+    widths = np.ones(len(keys), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        widths += (values >> np.uint64(shift)) != 0
+    pieces = widths + sizes.astype(np.int64)
+    out_starts = np.cumsum(pieces) - pieces
+    out = np.empty(int(pieces.sum()), dtype=np.uint8)
+
+    # 首条 varint：第 j 个字节写到 起点 + j
+    for j in range(int(widths.max())):
+        mask = widths > j
+        byte = (values[mask] >> np.uint64(7 * j)) & np.uint64(0x7F)
+        byte |= np.where(widths[mask] > j + 1, np.uint64(0x80), np.uint64(0))
+        out[out_starts[mask] + j] = byte.astype(np.uint8)
+    # 其余字节按块展开成逐字节下标后整体搬运
+    body_starts = out_starts + widths
+    sizes = sizes.astype(np.int64)
+    for lo in range(0, len(keys), _MERGE_BLOCK):
+        block = slice(lo, lo + _MERGE_BLOCK)
+        counts = sizes[block]
+        total = int(counts.sum())
+        if not total:
+            continue
+        steps = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        out[np.repeat(body_starts[block], counts) + steps] = blobs[np.repeat(blob_starts[block], counts) + steps]
+
+    term_starts = np.flatnonzero(new_term)
+    entries = np.empty(len(term_starts), dtype=[("pos", "<u8"), ("size", "<u4"), ("df", "<u4")])
+    entries["pos"] = out_starts[term_starts] + keys_pos + len(term_starts) * (8 + ENTRY.size)
+    entries["size"] = np.add.reduceat(pieces, term_starts)
+    entries["df"] = np.add.reduceat(dfs, term_starts)
+    return keys[term_starts], entries, [out]
+
+
+def build_search_index(output=SEARCH_PATH, workers=1, use_numpy=True):
+    """
+    各分片的局部倒排按 workers 个进程并行计算（已缓存的直接读取），主进程按分片顺序拼接后写出索引
+    返回 (文档数, 检索词数)
+    """
+    shard_outputs, _ = cache_all_terms(workers)
+    shards = []
+    doc_lengths = {}
+    for name in COLLECTION_NAMES:
+        lengths = doc_lengths[name] = array.array("H")
+        for path in shard_outputs[name]:
+            shard_lengths, *columns = read_shard_terms(path)
+            shards.append((pack_doc_id(name, len(lengths)), *columns))
+            lengths.extend(shard_lengths)
+
+    n_docs = sum(len(lengths) for lengths in doc_lengths.values())
+    avg_len = sum(sum(lengths) for lengths in doc_lengths.values()) / max(n_docs, 1)
+    keys_pos = HEADER.size + sum(4 + len(lengths) * 2 for lengths in doc_lengths.values())
+    merge = _merge_numpy if np is not None and use_numpy and shards else _merge_python
+    keys, entries, pieces = merge(shards, keys_pos)
+    n_terms = len(keys)
+    del shards
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n_terms, len(COLLECTION_NAMES), avg_len))
+        for name in COLLECTION_NAMES:
+            lengths = doc_lengths[name]
+            f.write(struct.pack("<I", len(lengths)))
+            f.write(lengths.tobytes())
+        f.write(memoryview(keys).cast("B"))
+        f.write(memoryview(entries).cast("B"))
+        f.writelines(pieces)
+    os.replace(tmp, output)
+    return n_docs, n_terms
+
+
+# ===== 读取 =====
+class SearchIndex:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_terms, n_collections, avg_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"检索索引格式不匹配: {path}")
+        self.avg_len = avg_len or 1.0
+        pos = HEADER.size
+        # 文档长度常驻内存（每首 2 字节），排序时频繁访问
+        self.doc_lengths = []
+        for _ in range(n_collections):
+            (count,) = struct.unpack_from("<I", self.mm, pos)
+            lengths = array.array("H")
+            lengths.frombytes(self.mm[pos + 4:pos + 4 + count * 2])
+            self.doc_lengths.append(lengths)
+            pos += 4 + count * 2
+        self.n_docs = sum(len(lengths) for lengths in self.doc_lengths)
+        self.n_terms = n_terms
+        self._keys_pos = pos
+        self._entries_pos = pos + n_terms * 8
+
+    def _entry(self, term):
+        """二分查找检索词，返回 (倒排起点, 字节数, 文档频率)，不存在时返回 None"""
+        key = term_key(term)
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (k,) = struct.unpack_from("<Q", self.mm, self._keys_pos + mid * 8)
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and struct.unpack_from("<Q", self.mm, self._keys_pos + lo * 8)[0] == key:
+            return ENTRY.unpack_from(self.mm, self._entries_pos + lo * ENTRY.size)
+        return None
+
+    def _postings(self, entry):
+        """解码倒排：文档编号 -> 词频"""
+        pos, size, _ = entry
+        buf = self.mm[pos:pos + size]
+        result = {}
+        doc = value = shift = 0
+        for b in buf:
+            value |= (b & 0x7F) << shift
+            if b & 0x80:
+                shift += 7
+                continue
+            doc += value >> _TF_BITS
+            result[doc] = value & _TF_MAX
+            value = shift = 0
+        return result
+
+    def doc_length(self, doc):
+        return self.doc_lengths[doc >> GID_BITS][doc & GID_MASK]
+
+    def search(self, query, offset=0, limit=20):
+        """
+        检索并排序，返回 (命中总数, [(文档编号, 得分)])
+        所有检索词都出现的文档才算命中
+        """
+        terms = query_terms(query)
+        if not terms:
+            return 0, []
+        entries = []
+        for term in terms:
+            entry = self._entry(term)
+            if entry is None:
+                return 0, []
+            entries.append(entry)
+        # 从最短的倒排开始求交集，候选集合只会越来越小
+        entries.sort(key=lambda e: e[2])
+        scores = None
+        for entry in entries:
+            idf = math.log(1 + (self.n_docs - entry[2] + 0.5) / (entry[2] + 0.5))
+            postings = self._postings(entry)
+            docs = postings if scores is None else (doc for doc in scores if doc in postings)
+            new_scores = {}
+            for doc in docs:
+                tf = postings[doc]
+                norm = K1 * (1 - B + B * self.doc_length(doc) / self.avg_len)
+                new_scores[doc] = (scores[doc] if scores else 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+            scores = new_scores
+            if not scores:
+                return 0, []
+        top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+        return len(scores), top[offset:]
+
+
+def open_search_index(path=SEARCH_PATH):
+    try:
+        return SearchIndex(path)
+    except (OSError, ValueError) as e:
+        print("检索索引加载失败:", e)
+        return None
+
+
+if __name__ == "__main__":
+    n_docs, n_terms = build_search_index()
+    print(f"✅ 已生成 {SEARCH_PATH}：{n_docs} 首，{n_terms} 个检索词，{os.path.getsize(SEARCH_PATH)} 字节")
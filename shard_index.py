@@ -0,0 +1,434 @@
+"""
+分片记录偏移索引：记录全唐诗 / 宋诗 / 宋词每个分片中每首诗的字节偏移和长度
+
+运行时只映射索引文件，取一首诗时 seek 到对应位置读出这一条记录再 json.loads，
+不需要把 300 多个分片整体载入内存。读之前先核对分片的大小和 mtime 与建索引时一致
+（只有 mtime 变了时再核对内容哈希），分片已改动、索引还没重建好时抛出 StaleShard，
+不会按旧偏移读出半条 JSON 或别的诗。
+
+索引里同时带有按作者、体裁、句数的倒排表，随机抽样可以按条件直接定位候选集合，
+不需要扫描语料，每次抽样都是常数时间。作者名按繁简归一后匹配，王维、王維查到的是同一批记录。
+
+索引文件布局（小端，每个集合一个 data/index/<集合>.idx）：
+    头部      magic, 版本, 分片数, 记录总数, 作者数, 最大句数
+    分片表    路径长度(u16) + 相对路径 + 记录数(u32) + 文件大小(u64) + mtime(f64) + SHA-1(20 字节)
+    记录表    每条记录 (字节偏移 u32, 字节长度 u32, 作者编号 u32, 句数 u16, 体裁 u8)
+    作者表    名称长度(u16) + 名称 + 首数(u32) + 在作者倒排中的起点(u32)
+    作者倒排  u32 全局编号，按作者分组
+    体裁倒排  每种体裁：首数(u32) + u32 全局编号
+    句数排序  lines_start[0..最大句数+1]（u32）+ 按句数升序的 u32 全局编号
+
+使用方法：
+    python shard_index.py            # 为全部集合生成索引
+    python shard_index.py tang ci    # 只生成指定集合
+    （并行构建全部索引见 python ingest.py build）
+"""
+import array
+import bisect
+import json
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import threading
+from collections import OrderedDict
+
+from corpus import (CORPUS_DIR, FORM_LINES, FORMS, SHARD_COLLECTIONS, collection_files, detect_form, file_digest,
+                    index_path, parallel_map, split_sentences)
+from normalize import get_converter
+
+MAGIC = b"PSIDX\x00\x00\x03"
+VERSION = 3
+HEADER = struct.Struct("<8sIIIII")
+SHARD = struct.Struct("<IQd20s")
+RECORD = struct.Struct("<IIIHBx")
+AUTHOR = struct.Struct("<II")
+U32 = struct.Struct("<I")
+
+# 组合条件抽样时先随机试探的次数，超过后在最小候选集合内精确筛选
+SAMPLE_ATTEMPTS = 64
+# 精确筛选的结果（含“没有符合条件的记录”）按条件缓存的组数，之后同样的条件直接在结果里取数
+MATCH_CACHE_SIZE = 256
+
+_SKIP = re.compile(r"[\s,]*")
+
+
+class StaleShard(LookupError):
+    """分片在磁盘上已改动，索引中的偏移不再对应（热更新重建完成前的短暂窗口）"""
+
+
+# ===== 构建 =====
+def scan_shard(path):
+    """逐条解析一个分片，产出 (字节偏移, 字节长度, 记录)"""
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8")
+    decoder = json.JSONDecoder()
+    pos = _SKIP.match(text, text.index("[") + 1).end()
+    # 字符下标与字节偏移同步推进，只对两条记录之间的片段做一次编码
+    char_pos = byte_pos = 0
+    while pos < len(text) and text[pos] != "]":
+        byte_pos += len(text[char_pos:pos].encode("utf-8"))
+        obj, end = decoder.raw_decode(text, pos)
+        length = len(text[pos:end].encode("utf-8"))
+        yield byte_pos, length, obj
+        byte_pos += length
+        char_pos = end
+        pos = _SKIP.match(text, end).end()
+
+
+def iter_collection(name):
+    """按全局编号顺序逐条产出集合中的记录，每次只持有一个分片的文本"""
+    patterns, _ = SHARD_COLLECTIONS[name]
+    for path in collection_files(patterns):
+        for _, _, poem in scan_shard(path):
+            yield poem
+
+
+def _pack_u32(values):
+    return struct.pack(f"<{len(values)}I", *values)
+
+
+def scan_segment(path):
+    """解析一个分片，返回它在索引中的一段：[(偏移, 长度, 作者, 句数, 体裁)]"""
+    rows = []
+    for offset, length, poem in scan_shard(path):
+        sentences = split_sentences(poem.get("paragraphs") or [])
+        rows.append((offset, length, poem.get("author") or "",
+                     min(len(sentences), 0xFFFF), detect_form(sentences)))
+    return rows
+
+
+def build_shard_index(name, output=None, previous=None, workers=1):
+    """
+    为一个集合生成偏移索引，返回 (记录总数, 重新解析的分片数)
+
+    previous 为旧索引时，内容哈希未变的分片直接沿用旧索引中的那一段，不再解析 JSON；
+    需要解析的分片按 workers 个进程并行处理
+    """
+    patterns, _ = SHARD_COLLECTIONS[name]
+    output = output or index_path(f"{name}.idx")
+    segments = []
+    stale = []
+    for path in collection_files(patterns):
+        rel = os.path.relpath(path, CORPUS_DIR)
+        st = os.stat(path)
+        digest = file_digest(path)
+        rows = previous.segment_for(rel, digest) if previous is not None else None
+        if rows is None:
+            stale.append((len(segments), path))
+        segments.append([rel, st.st_size, st.st_mtime, digest, rows])
+    for (i, _), rows in zip(stale, parallel_map(scan_segment, [path for _, path in stale], workers)):
+        segments[i][4] = rows
+    return write_shard_index(output, segments), len(stale)
+
+
+def write_shard_index(output, segments):
+    """把各分片的段合并成一个索引文件，返回记录总数"""
+    records = []
+    author_ids = {}
+    author_posts = []
+    form_posts = [[] for _ in FORMS]
+    line_counts = []
+    for _, _, _, _, rows in segments:
+        for offset, length, author, lines, form in rows:
+            gid = len(records)
+            aid = author_ids.get(author)
+            if aid is None:
+                aid = author_ids[author] = len(author_posts)
+                author_posts.append([])
+            author_posts[aid].append(gid)
+            form_posts[form].append(gid)
+            line_counts.append(lines)
+            records.append(RECORD.pack(offset, length, aid, lines, form))
+
+    max_lines = max(line_counts, default=0)
+    by_lines = sorted(range(len(line_counts)), key=line_counts.__getitem__)
+    # lines_start[n] 为句数 >= n 的记录在 by_lines 中的起点
+    counts_by_lines = [0] * (max_lines + 1)
+    for lines in line_counts:
+        counts_by_lines[lines] += 1
+    lines_start = [0] * (max_lines + 2)
+    for n in range(max_lines + 1):
+        lines_start[n + 1] = lines_start[n] + counts_by_lines[n]
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    # 临时文件名带进程号，多个 worker 同时重建时互不覆盖
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(segments), len(records), len(author_posts), max_lines))
+        for rel, size, mtime, digest, rows in segments:
+            raw = rel.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw)
+            f.write(SHARD.pack(len(rows), size, mtime, digest))
+        f.write(b"".join(records))
+        start = 0
+        for author, aid in author_ids.items():
+            raw = author.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw)
+            f.write(AUTHOR.pack(len(author_posts[aid]), start))
+            start += len(author_posts[aid])
+        for posts in author_posts:
+            f.write(_pack_u32(posts))
+        for posts in form_posts:
+            f.write(U32.pack(len(posts)) + _pack_u32(posts))
+        f.write(_pack_u32(lines_start))
+        f.write(_pack_u32(by_lines))
+    # 改名是原子的：正在映射旧文件的进程继续读旧内容，新打开的读到完整的新索引
+    os.replace(tmp, output)
+    return len(records)
+
+
+# ===== 读取 =====
+class ShardIndex:
+    """一个集合的偏移索引；len() 为记录总数，record(i) 只解码第 i 条记录"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_shards, n_records, n_authors, max_lines = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"索引格式不匹配: {path}")
+        self._view = memoryview(self.mm)
+        self.paths = []
+        self.counts = []
+        self.digests = []
+        # 建索引时各分片的 (大小, mtime)；mtime 变了但内容哈希没变的，核对后换成新的 mtime
+        self.stamps = []
+        # 相对路径 -> 分片下标
+        self.shard_ids = {}
+        # starts[k] 为第 k 个分片第一条记录的全局编号（前缀计数表）
+        self.starts = []
+        pos = HEADER.size
+        total = 0
+        for _ in range(n_shards):
+            (path_len,) = struct.unpack_from("<H", self.mm, pos)
+            rel = self.mm[pos + 2:pos + 2 + path_len].decode("utf-8")
+            pos += 2 + path_len
+            count, size, mtime, digest = SHARD.unpack_from(self.mm, pos)
+            pos += SHARD.size
+            self.shard_ids[rel] = len(self.paths)
+            self.paths.append(os.path.join(CORPUS_DIR, rel))
+            self.counts.append(count)
+            self.digests.append(digest)
+            self.stamps.append((size, mtime))
+            self.starts.append(total)
+            total += count
+        self._total = n_records
+        self._records_pos = pos
+        pos += n_records * RECORD.size
+
+        # 作者名 -> (作者编号, 倒排起点, 首数)
+        self.authors = {}
+        self.author_names = []
+        for aid in range(n_authors):
+            (name_len,) = struct.unpack_from("<H", self.mm, pos)
+            name = self.mm[pos + 2:pos + 2 + name_len].decode("utf-8")
+            pos += 2 + name_len
+            count, start = AUTHOR.unpack_from(self.mm, pos)
+            pos += AUTHOR.size
+            self.authors[name] = (aid, start, count)
+            self.author_names.append(name)
+        # 归一成简体的作者名 -> 本集合中的各种写法，第一次按作者查询时生成
+        self._aliases = None
+        self._author_posts_pos = pos
+        pos += sum(count for _, _, count in self.authors.values()) * 4
+
+        # 体裁编号 -> (倒排起点位置, 首数)
+        self._forms = []
+        for _ in FORMS:
+            (count,) = U32.unpack_from(self.mm, pos)
+            self._forms.append((pos + 4, count))
+            pos += 4 + count * 4
+
+        self._lines_start = struct.unpack_from(f"<{max_lines + 2}I", self.mm, pos)
+        self._by_lines_pos = pos + (max_lines + 2) * 4
+        # 条件 -> 精确筛选出的全局编号（空数组表示没有符合条件的记录），LRU；索引换代时随旧对象一起丢弃
+        self._matched = OrderedDict()
+        self._matched_lock = threading.Lock()
+
+    def __len__(self):
+        return self._total
+
+    def locate(self, i):
+        """全局编号 -> (分片下标, 分片内编号)"""
+        shard = bisect.bisect_right(self.starts, i) - 1
+        return shard, i - self.starts[shard]
+
+    def meta(self, i):
+        """第 i 条记录的 (作者编号, 句数, 体裁编号)，不读取分片"""
+        _, _, aid, lines, form = RECORD.unpack_from(self.mm, self._records_pos + i * RECORD.size)
+        return aid, lines, form
+
+    def author_aliases(self, name):
+        """作者名（繁简均可）-> 本集合中归一后同名的全部写法，没有时为空元组"""
+        convert = get_converter().convert
+        aliases = self._aliases
+        if aliases is None:
+            aliases = {}
+            for original in self.author_names:
+                aliases.setdefault(convert(original), []).append(original)
+            self._aliases = aliases
+        return tuple(aliases.get(convert(name), ()))
+
+    def author_records(self, name):
+        """该作者全部记录的全局编号（按分片顺序）"""
+        if name not in self.authors:
+            return ()
+        _, start, count = self.authors[name]
+        pos = self._author_posts_pos + start * 4
+        return struct.unpack_from(f"<{count}I", self.mm, pos)
+
+    def segment_for(self, rel, digest):
+        """内容哈希一致时，从索引中还原该分片的段（格式同 scan_segment），否则返回 None"""
+        shard = self.shard_ids.get(rel)
+        if shard is None or self.digests[shard] != digest:
+            return None
+        rows = []
+        start = self.starts[shard]
+        for i in range(start, start + self.counts[shard]):
+            offset, length, aid, lines, form = RECORD.unpack_from(self.mm, self._records_pos + i * RECORD.size)
+            rows.append((offset, length, self.author_names[aid], lines, form))
+        return rows
+
+    def record(self, i):
+        if not 0 <= i < self._total:
+            raise IndexError(i)
+        shard, _ = self.locate(i)
+        offset, length, _, _, _ = RECORD.unpack_from(self.mm, self._records_pos + i * RECORD.size)
+        with open(self.paths[shard], "rb") as f:
+            stamp = self._check_stamp(shard, f)
+            f.seek(offset)
+            data = f.read(length)
+            # 读的过程中被原地改写时 mtime 会变
+            if self._stamp(f) != stamp:
+                raise StaleShard(self.paths[shard])
+        return json.loads(data)
+
+    @staticmethod
+    def _stamp(f):
+        st = os.fstat(f.fileno())
+        return st.st_size, st.st_mtime
+
+    def _check_stamp(self, shard, f):
+        """打开的分片与建索引时是否同一份内容；不是时抛出 StaleShard，是时返回它的 (大小, mtime)"""
+        stamp = self._stamp(f)
+        if stamp == self.stamps[shard]:
+            return stamp
+        # 只是 mtime 变了（touch、原样复制）时内容可能没变，核对一次哈希，之后按新的 mtime 比较
+        if stamp[0] != self.stamps[shard][0] or file_digest(self.paths[shard]) != self.digests[shard]:
+            raise StaleShard(self.paths[shard])
+        self.stamps[shard] = stamp
+        return stamp
+
+    # ===== 抽样 =====
+    def _span(self, pos, count):
+        return self._view[pos:pos + count * 4].cast("I")
+
+    def _candidates(self, author=None, form=None, min_lines=None):
+        """
+        把每个条件换成一段候选编号（u32 序列）
+        返回 (候选序列列表, 逐条检查函数)；条件不可满足时返回 None
+        """
+        pools = []
+        checks = []
+        if author is not None:
+            names = self.author_aliases(author)
+            if not names:
+                return None
+            if len(names) == 1:
+                aid, start, count = self.authors[names[0]]
+                pools.append(self._span(self._author_posts_pos + start * 4, count))
+                checks.append(lambda m: m[0] == aid)
+            else:
+                # 同一作者在集合里有几种写法：合并各自的倒排
+                aids = {self.authors[name][0] for name in names}
+                pools.append(array.array("I", sorted(gid for name in names for gid in self.author_records(name))))
+                checks.append(lambda m: m[0] in aids)
+        if form is not None:
+            if form not in FORMS:
+                return None
+            code = FORMS.index(form)
+            pools.append(self._span(*self._forms[code]))
+            checks.append(lambda m: m[2] == code)
+            # 体裁已经定死了句数：句数要求更多时不可满足，否则句数条件必然成立，不必再查
+            if min_lines is not None and code in FORM_LINES:
+                if min_lines > FORM_LINES[code]:
+                    return None
+                min_lines = None
+        if min_lines is not None:
+            n = max(min_lines, 0)
+            if n >= len(self._lines_start) - 1:
+                return None
+            begin = self._lines_start[n]
+            pools.append(self._span(self._by_lines_pos + begin * 4, self._total - begin))
+            checks.append(lambda m: m[1] >= n)
+        return pools, checks
+
+    def sample(self, author=None, form=None, min_lines=None, rng=random, within=(), key=None):
+        """
+        按条件均匀抽取一条记录的全局编号，没有符合条件的记录时返回 None
+
+        无条件时在全局编号上均匀取数，再用前缀计数表定位分片，
+        各分片大小不同也保持均匀；有条件时在最小的候选段内取数，
+        其余条件用记录表逐条核对。
+        within 为索引之外的额外条件 [(全局编号序列或 None, 逐条检查函数), ...]，
+        如按韵部筛选时的韵部倒排；序列为 None 时只逐条检查。
+        key 为 within 的可哈希描述（如请求中的 yun / strict 参数）：随机试探落空后精确筛选的结果
+        按 (author, form, min_lines, key) 缓存，同样的条件再来时直接取数，不再扫描；
+        有 within 而没给 key 时不缓存。
+        """
+        if not self._total:
+            return None
+        found = self._candidates(author, form, min_lines)
+        if found is None:
+            return None
+        pools, checks = found
+        tests = [lambda gid: all(check(self.meta(gid)) for check in checks)] if checks else []
+        for seq, test in within:
+            if seq is not None:
+                pools.append(seq)
+            tests.append(test)
+        if not tests:
+            return rng.randrange(self._total)
+        pool = min(pools, key=len) if pools else range(self._total)
+        if not len(pool):
+            return None
+        # 只有一个条件且有候选序列时，取到的数必然满足条件
+        exact = len(checks) + len(within) == 1 and pools
+        cache_key = (author, form, min_lines, key) if key is not None or not within else None
+        if cache_key is not None:
+            with self._matched_lock:
+                matched = self._matched.get(cache_key)
+                if matched is not None:
+                    self._matched.move_to_end(cache_key)
+            if matched is not None:
+                return matched[rng.randrange(len(matched))] if len(matched) else None
+        for _ in range(1 if exact else SAMPLE_ATTEMPTS):
+            gid = pool[rng.randrange(len(pool))]
+            if all(test(gid) for test in tests):
+                return gid
+        # 组合条件命中率很低时，在最小候选段内精确筛选一次，结果缓存起来
+        matched = array.array("I", (gid for gid in pool if all(test(gid) for test in tests)))
+        if cache_key is not None:
+            with self._matched_lock:
+                self._matched[cache_key] = matched
+                if len(self._matched) > MATCH_CACHE_SIZE:
+                    self._matched.popitem(last=False)
+        return matched[rng.randrange(len(matched))] if len(matched) else None
+
+
+def open_shard_index(name):
+    """打开集合索引；索引未生成时返回 None"""
+    try:
+        return ShardIndex(index_path(f"{name}.idx"))
+    except (OSError, ValueError) as e:
+        print(f"分片索引 {name} 加载失败:", e)
+        return None
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or SHARD_COLLECTIONS:
+        total, parsed = build_shard_index(name, previous=open_shard_index(name))
+        print(f"✅ {name}: {total} 首（重新解析 {parsed} 个分片）")
@@ -0,0 +1,163 @@
+"""
+语料快照：把精选集合编译成一个紧凑的二进制文件，运行时用 mmap 映射
+
+文件布局（小端）：
+    头部      magic, 版本, 字符串数, 集合数, 各区段起始位置
+    集合目录  名称长度(u16) + 名称 + 记录数(u32) + 记录表位置(u64)
+    记录表    每条记录 3 个 u32：标题、作者、正文在字符串表中的编号
+    字符串表  u32 偏移数组（n+1 个）+ UTF-8 字符串数据区
+
+正文是 paragraphs 用换行拼接后的一个字符串，作者等重复字符串只存一份。
+多个 worker 映射同一个文件时共享操作系统的页缓存，不再各自持有一份解析后的 list。
+
+使用方法：
+    python snapshot.py            # 生成 data/index/corpus.snap
+"""
+import mmap
+import os
+import struct
+
+from corpus import SELECTED_COLLECTIONS, collection_files, index_path, load_json
+
+MAGIC = b"PSNAP\x00\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQQQ")
+RECORD = struct.Struct("<III")
+SNAPSHOT_PATH = index_path("corpus.snap")
+
+
+# ===== 构建 =====
+def build_snapshot(output=SNAPSHOT_PATH, collections=None):
+    """读取集合中的 JSON，写出快照文件，返回各集合的记录数"""
+    collections = collections or SELECTED_COLLECTIONS
+    strings = []
+    string_ids = {}
+
+    def intern(s):
+        sid = string_ids.get(s)
+        if sid is None:
+            sid = string_ids[s] = len(strings)
+            strings.append(s)
+        return sid
+
+    tables = []
+    for name, (patterns, title_key) in collections.items():
+        rows = []
+        for path in collection_files(patterns):
+            for poem in load_json(path):
+                rows.append((
+                    intern(poem.get(title_key) or poem.get("title") or ""),
+                    intern(poem.get("author") or ""),
+                    intern("\n".join(poem.get("paragraphs") or [])),
+                ))
+        tables.append((name, rows))
+
+    # 目录区长度可以提前算出，之后各区段顺序排列
+    directory_size = sum(2 + len(name.encode("utf-8")) + 4 + 8 for name, _ in tables)
+    pos = HEADER.size + directory_size
+    table_positions = []
+    for _, rows in tables:
+        table_positions.append(pos)
+        pos += len(rows) * RECORD.size
+
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets_pos = pos
+    blob_pos = offsets_pos + (len(encoded) + 1) * 4
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(encoded), len(tables),
+                            HEADER.size, offsets_pos, blob_pos))
+        for (name, rows), table_pos in zip(tables, table_positions):
+            raw = name.encode("utf-8")
+            f.write(struct.pack("<H", len(raw)) + raw)
+            f.write(struct.pack("<IQ", len(rows), table_pos))
+        for _, rows in tables:
+            f.write(b"".join(RECORD.pack(*row) for row in rows))
+        offset = 0
+        offsets = [0]
+        for data in encoded:
+            offset += len(data)
+            offsets.append(offset)
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(encoded))
+    # 先写临时文件再改名，正在映射旧文件的进程不受影响
+    os.replace(tmp, output)
+    return {name: len(rows) for name, rows in tables}
+
+
+# ===== 读取 =====
+class SnapshotCollection:
+    """快照中的一个集合，支持 len() 和下标访问，可直接交给 random.choice"""
+
+    def __init__(self, snapshot, count, table_pos):
+        self._snapshot = snapshot
+        self._count = count
+        self._table_pos = table_pos
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        title, author, body = RECORD.unpack_from(self._snapshot.mm, self._table_pos + i * RECORD.size)
+        string = self._snapshot.string
+        text = string(body)
+        return {
+            "title": string(title),
+            "author": string(author),
+            "paragraphs": text.split("\n") if text else [],
+        }
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_strings, n_collections, dir_pos, offsets_pos, blob_pos = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"快照格式不匹配: {path}")
+        self._offsets_pos = offsets_pos
+        self._blob_pos = blob_pos
+        # 文件被截断时各区段会越过文件末尾：打开时就报错，不要等到取记录时才出错
+        (blob_len,) = struct.unpack_from("<I", self.mm, offsets_pos + n_strings * 4)
+        if blob_pos + blob_len != len(self.mm):
+            raise ValueError(f"快照长度不对（可能被截断）: {path}")
+        self.collections = {}
+        pos = dir_pos
+        for _ in range(n_collections):
+            (name_len,) = struct.unpack_from("<H", self.mm, pos)
+            name = self.mm[pos + 2:pos + 2 + name_len].decode("utf-8")
+            pos += 2 + name_len
+            count, table_pos = struct.unpack_from("<IQ", self.mm, pos)
+            pos += 12
+            if table_pos + count * RECORD.size > offsets_pos:
+                raise ValueError(f"快照集合 {name} 的记录表越界: {path}")
+            self.collections[name] = SnapshotCollection(self, count, table_pos)
+
+    def string(self, sid):
+        start, end = struct.unpack_from("<II", self.mm, self._offsets_pos + sid * 4)
+        return self.mm[self._blob_pos + start:self._blob_pos + end].decode("utf-8")
+
+    def collection(self, name):
+        return self.collections[name]
+
+
+def open_snapshot(path=SNAPSHOT_PATH):
+    """打开快照；文件不存在、格式不对或被截断时返回 None，由调用方回退到 JSON"""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        print("快照加载失败，回退到 JSON:", e)
+        return None
+
+
+if __name__ == "__main__":
+    counts = build_snapshot()
+    print(f"✅ 已生成 {SNAPSHOT_PATH}（{os.path.getsize(SNAPSHOT_PATH)} 字节）")
+    for name, count in counts.items():
+        print(f"   {name}: {count} 首")
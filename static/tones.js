@@ -0,0 +1,35 @@
+// 紧凑声调表（见 tone_table.py）：U+3400–U+9FFF 每字 2 位，0 未知，1 平，2 仄，3 入声
+// 页面只下载约 7 KB 的二进制表，查字按位运算，不再解析整份 char_tones.json
+const ToneTable = (() => {
+    const CJK_START = 0x3400;
+    const CJK_SPAN = 0xA000 - 0x3400;
+    let packed = null;
+
+    function load(url) {
+        return fetch(url)
+            .then(r => {
+                if (!r.ok) throw new Error('无法加载声调表');
+                return r.arrayBuffer();
+            })
+            .then(buf => {
+                packed = new Uint8Array(buf);
+            });
+    }
+
+    function code(char) {
+        if (!packed || !char) return 0;
+        const cp = char.codePointAt(0) - CJK_START;
+        if (cp < 0 || cp >= CJK_SPAN) return 0;
+        return (packed[cp >> 2] >> ((cp & 3) * 2)) & 3;
+    }
+
+    // 'ping' / 'ze'（入声算仄）/ null（未知字）
+    function toneClass(char) {
+        const c = code(char);
+        if (c === 1) return 'ping';
+        if (c === 2 || c === 3) return 'ze';
+        return null;
+    }
+
+    return {load, code, toneClass, loaded: () => packed !== null};
+})();
@@ -0,0 +1,22 @@
+import pytest
+
+from author_index import open_author_index
+
+
+@pytest.fixture(scope="module")
+def authors():
+    index = open_author_index()
+    if index is None:
+        pytest.skip("作者索引尚未生成（python author_index.py）")
+    return index
+
+
+def test_page_past_end_is_empty(authors):
+    count = authors.poem_count("李白")
+    assert authors.poems("李白", count, 20) == []
+    assert authors.poems("李白", 100000 * 20, 20) == []
+
+
+def test_last_page_is_partial(authors):
+    count = authors.poem_count("李白")
+    assert len(authors.poems("李白", count - 1, 20)) == 1
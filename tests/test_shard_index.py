@@ -0,0 +1,25 @@
+import pytest
+
+from shard_index import StaleShard, open_shard_index
+
+
+@pytest.fixture()
+def index():
+    index = open_shard_index("tang")
+    if index is None:
+        pytest.skip("分片索引尚未生成（python shard_index.py）")
+    return index
+
+
+def test_changed_shard_is_not_read(index):
+    size, mtime = index.stamps[0]
+    index.stamps[0] = (size + 1, mtime)
+    with pytest.raises(StaleShard):
+        index.record(0)
+
+
+def test_touched_shard_is_verified_by_digest(index):
+    size, _ = index.stamps[0]
+    index.stamps[0] = (size, 0.0)
+    assert index.record(0)["paragraphs"]
+    assert index.stamps[0][1] != 0.0
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from snapshot import HEADER, SNAPSHOT_PATH, open_snapshot
+
+
+@pytest.fixture(scope="module")
+def data():
+    if not os.path.exists(SNAPSHOT_PATH):
+        pytest.skip("快照尚未生成（python snapshot.py）")
+    with open(SNAPSHOT_PATH, "rb") as f:
+        return f.read()
+
+
+def test_full_snapshot_opens(data):
+    assert open_snapshot() is not None
+
+
+@pytest.mark.parametrize("size", [0, 4, HEADER.size, HEADER.size + 8, -1])
+def test_truncated_snapshot_falls_back(data, tmp_path, size):
+    path = tmp_path / "corpus.snap"
+    path.write_bytes(data[:size])
+    assert open_snapshot(str(path)) is None
+
+
+def test_snapshot_with_truncated_blob_falls_back(data, tmp_path):
+    path = tmp_path / "corpus.snap"
+    path.write_bytes(data[:len(data) // 2])
+    assert open_snapshot(str(path)) is None
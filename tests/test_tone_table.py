@@ -0,0 +1,20 @@
+import pytest
+
+from pingze import ANY, parse_lines, tone_of, validate
+
+
+@pytest.mark.parametrize("ch", "长看重更胜为")
+def test_either_tone_chars_are_not_judged(ch):
+    # 平水韵平声、仄声韵都收的字，平仄随义而定
+    assert tone_of(ch) == ANY
+
+
+@pytest.mark.parametrize("text, line, ch", [
+    ("秦时明月汉时关，万里长征人未还。但使龙城飞将在，不教胡马度阴山。", 1, "长"),
+    ("日照香炉生紫烟，遥看瀑布挂前川。飞流直下三千尺，疑是银河落九天。", 1, "看"),
+])
+def test_either_tone_chars_in_regulated_line(text, line, ch):
+    report = validate(parse_lines(text))
+    assert report["errors"] == 0
+    chars = {c["char"]: c for c in report["lines"][line]["chars"]}
+    assert chars[ch]["expected"] == "平" and chars[ch]["ok"]
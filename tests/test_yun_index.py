@@ -0,0 +1,12 @@
+import json
+
+import pytest
+
+from yun_index import get_book
+
+
+@pytest.mark.parametrize("ch, yun, other", [("行", "十一庚", "十唐"), ("佛", "二波", "十四姑")])
+def test_polyphone_primary_reading_first(ch, yun, other):
+    body = json.loads(get_book("xinyun").body(ch))
+    assert body["yun"] == yun
+    assert body["yuns"][0] == yun and other in body["yuns"]
@@ -0,0 +1,268 @@
+"""
+紧凑声调表：CJK 扩展 A 区和基本区 U+3400–U+9FFF 每字 2 位，共 6912 字节
+
+    0 未知或平仄两收   1 平   2 仄   3 入声（仄声的一种，单独标出）
+
+声调按以下来源依次确定，前面的优先：
+    1. 覆盖文件 tone_overrides.txt（字<TAB>平/仄/入），用来纠正个别字
+    2. 平水韵（pingshui.txt）：平声韵为平，上声、去声为仄，入声为入；
+       平声韵和仄声韵都收的字（长、看、重、胜、为……）平仄随义而定，记为 0，校验时不判对错；
+       只在上去、入声之间两收的字都是仄，取与今音相合的一类（今读仄而兼收入声的取入声）
+    3. static/char_tones.json（3500 常用字的普通话声调，1、2 为平，3、4 为仄）
+    4. pypinyin 的单字读音（可选依赖，未安装时跳过），覆盖表内其余的字
+繁体字按转换表补上对应简体字的声调（只在前面几项都查不到时），繁体输入也能直接查。
+古入声字今天多读平声，只看普通话会把它们误判为平，所以平水韵排在普通话读音之前。
+
+服务端查字是 O(1) 的位运算；作诗页面不再下载、解析整份 JSON，
+而是取 /api/tones/packed 的二进制表（带内容哈希版本号，可长期缓存）在浏览器里同样按位查。
+
+文件布局（data/index/tones.bin）：
+    头部    magic, 来源指纹（各来源文件哈希拼接后的 SHA-1，20 字节）
+    数据    打包好的 2 位声调，每字节 4 个字，低位在前
+
+使用方法：
+    python tone_table.py              # 编译声调表
+    python tone_table.py coverage     # 统计全量语料的覆盖率，列出最常见的未知字
+"""
+import argparse
+import hashlib
+import os
+import re
+import struct
+import threading
+from collections import Counter
+
+from corpus import BASE, SHARD_COLLECTIONS, collection_files, file_digest, index_path, load_json, parallel_map
+from normalize import T2S_PATH, unambiguous_chars
+from shard_index import scan_shard
+from yun_index import PINGSHUI_PATH, read_pingshui
+
+try:
+    from pypinyin.contrib.tone_convert import to_tone3
+    from pypinyin.pinyin_dict import pinyin_dict
+except ImportError:
+    pinyin_dict = None
+
+SOURCE_PATH = os.path.join(BASE, "static", "char_tones.json")
+OVERRIDES_PATH = os.path.join(BASE, "tone_overrides.txt")
+TABLE_PATH = index_path("tones.bin")
+
+MAGIC = b"PTONE\x00\x00\x02"
+HEADER = struct.Struct("<8s20s")
+
+# 全量语料中扩展 A 区的字约 500 个，一并收录；更靠后的扩展区字次不到万分之一，不收
+CJK_START = 0x3400
+CJK_SPAN = 0xA000 - 0x3400
+PACKED_BYTES = CJK_SPAN // 4
+
+UNKNOWN, PING, ZE, RU = 0, 1, 2, 3
+# 平仄两收：与未知同样编为 0，查到也不判对错
+EITHER = UNKNOWN
+LABELS = {"平": PING, "仄": ZE, "入": RU}
+# 普通话声调 -> 平仄编号（0 为轻声 / 未知）
+MANDARIN_TONES = {1: PING, 2: PING, 3: ZE, 4: ZE}
+# 平水韵韵部的声调编号（见 yun_index.TONE_CODES）-> 平仄编号
+PINGSHUI_TONES = {1: PING, 2: ZE, 3: ZE, 4: RU}
+
+_HAN = re.compile(r"[㐀-鿿豈-﫿\U00020000-\U0003FFFF]")
+
+
+def pack(codes):
+    """字 -> 平仄编号 打包成 2 位一字的 bytes；表外的字不收"""
+    packed = bytearray(PACKED_BYTES)
+    for ch, code in codes.items():
+        cp = ord(ch) - CJK_START
+        if 0 <= cp < CJK_SPAN and code:
+            packed[cp >> 2] |= code << ((cp & 3) * 2)
+    return bytes(packed)
+
+
+# ===== 来源 =====
+def sources():
+    """参与编译的源文件（热更新时监视这些文件）"""
+    return [path for path in (OVERRIDES_PATH, PINGSHUI_PATH, SOURCE_PATH, T2S_PATH) if os.path.exists(path)]
+
+
+def sources_fingerprint():
+    """各来源文件的哈希；MAGIC 一并计入，编译规则改动（换 MAGIC）后依赖声调表的缓存随之失效"""
+    h = hashlib.sha1(MAGIC + (b"pypinyin" if pinyin_dict is not None else b""))
+    for path in sources():
+        h.update(file_digest(path))
+    return h.digest()
+
+
+def load_overrides(path=OVERRIDES_PATH):
+    """覆盖文件：字 -> 平仄编号；文件不存在时为空"""
+    codes = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                ch, _, label = line.partition("\t")
+                if len(ch) == 1 and label.strip() in LABELS:
+                    codes[ch] = LABELS[label.strip()]
+                else:
+                    print(f"声调覆盖文件格式不对，已跳过: {line}")
+    except OSError:
+        pass
+    return codes
+
+
+def modern_codes(path=SOURCE_PATH):
+    """普通话读音：char_tones.json 优先，其余用 pypinyin 的第一个非轻声读音补上"""
+    codes = {}
+    if pinyin_dict is not None:
+        for cp, readings in pinyin_dict.items():
+            if not CJK_START <= cp < CJK_START + CJK_SPAN:
+                continue
+            tones = [to_tone3(r)[-1:] for r in readings.split(",")]
+            tone = next((int(t) for t in tones if t.isdigit()), 0)
+            if tone in MANDARIN_TONES:
+                codes[chr(cp)] = MANDARIN_TONES[tone]
+    for ch, tone in load_json(path).items():
+        if tone in MANDARIN_TONES:
+            codes[ch] = MANDARIN_TONES[tone]
+    return codes
+
+
+def classical_codes(modern):
+    """平水韵：字 -> 平仄编号；平仄两收的字记为 EITHER，仄声内两收（上去与入）的按今音取一类"""
+    classes = {}
+    for _, tone, _, chars, _ in read_pingshui():
+        for ch in chars:
+            classes.setdefault(ch, set()).add(PINGSHUI_TONES[tone])
+    codes = {}
+    for ch, found in classes.items():
+        now = modern.get(ch)
+        if len(found) == 1:
+            codes[ch] = next(iter(found))
+        elif PING in found:
+            codes[ch] = EITHER
+        elif now in found:
+            codes[ch] = now
+        elif now == ZE and RU in found:
+            codes[ch] = RU
+        else:
+            codes[ch] = min(found)
+    return codes
+
+
+def source_codes(path=SOURCE_PATH):
+    """合并全部来源：字 -> 平仄编号"""
+    modern = modern_codes(path)
+    codes = dict(modern)
+    codes.update(classical_codes(modern))
+    for trad, simp in unambiguous_chars().items():
+        # 平仄两收的字已有编号（EITHER），不再按简体字补
+        if trad not in codes and codes.get(simp):
+            codes[trad] = codes[simp]
+    codes.update(load_overrides())
+    return codes
+
+
+def build_tone_table(source=SOURCE_PATH, output=TABLE_PATH):
+    """编译声调表，返回收录的字数"""
+    codes = source_codes(source)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, sources_fingerprint()))
+        f.write(pack(codes))
+    os.replace(tmp, output)
+    return sum(1 for code in codes.values() if code)
+
+
+class ToneTable:
+    """打包好的声调表；packed 即 /api/tones/packed 返回的内容，etag 为其内容哈希"""
+
+    def __init__(self, path=TABLE_PATH):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, self.source_digest = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or len(data) != HEADER.size + PACKED_BYTES:
+            raise ValueError(f"声调表格式不匹配: {path}")
+        self.packed = data[HEADER.size:]
+        self.etag = hashlib.sha1(self.packed).hexdigest()
+
+    def code(self, ch):
+        cp = ord(ch) - CJK_START
+        if not 0 <= cp < CJK_SPAN:
+            return UNKNOWN
+        return (self.packed[cp >> 2] >> ((cp & 3) * 2)) & 3
+
+    def codes(self, chars):
+        """一串字 -> {字: 平仄编号}，去重"""
+        return {ch: self.code(ch) for ch in dict.fromkeys(chars)}
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def _open_table():
+    """打开编译产物；不存在或源文件已改动时先重新编译"""
+    try:
+        table = ToneTable()
+        if table.source_digest == sources_fingerprint():
+            return table
+    except (OSError, ValueError):
+        pass
+    build_tone_table()
+    return ToneTable()
+
+
+def get_tone_table():
+    """取声调表：第一次调用时编译 / 打开，之后常驻"""
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = _open_table()
+    return _table
+
+
+def reload_tone_table(changed=None):
+    """来源文件改动后重新编译并替换"""
+    global _table
+    build_tone_table()
+    _table = ToneTable()
+
+
+# ===== 覆盖率 =====
+def count_chars(path):
+    counts = Counter()
+    for _, _, poem in scan_shard(path):
+        for para in poem.get("paragraphs") or []:
+            counts.update(para)
+    return counts
+
+
+def coverage(workers=1):
+    """全量语料中汉字的覆盖情况：(字种数, 已知字种数, 字次, 已知字次, 按出现次数排序的未知字)；平仄两收的字算已知"""
+    table = get_tone_table()
+    either = {ch for ch, code in classical_codes({}).items() if code == EITHER}
+    files = [p for patterns, _ in SHARD_COLLECTIONS.values() for p in collection_files(patterns)]
+    total = Counter()
+    for counts in parallel_map(count_chars, files, workers):
+        total.update(counts)
+    han = {ch: n for ch, n in total.items() if _HAN.fullmatch(ch)}
+    missing = Counter({ch: n for ch, n in han.items() if not table.code(ch) and ch not in either})
+    return (len(han), len(han) - len(missing), sum(han.values()), sum(han.values()) - sum(missing.values()),
+            missing.most_common())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="编译紧凑声调表")
+    parser.add_argument("command", nargs="?", choices=["build", "coverage"], default="build")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="进程数（coverage）")
+    args = parser.parse_args()
+    count = build_tone_table()
+    print(f"✅ 已生成 {TABLE_PATH}：{count} 个字，{PACKED_BYTES} 字节"
+          f"（pypinyin {'已启用' if pinyin_dict is not None else '未安装，跳过'}）")
+    if args.command == "coverage":
+        kinds, known_kinds, uses, known_uses, missing = coverage(max(args.workers, 1))
+        print(f"📊 全量语料 {kinds} 个字种，已知 {known_kinds}（{known_kinds / kinds:.2%}）；"
+              f"{uses} 字次，已知 {known_uses / uses:.4%}")
+        print("   最常见的未知字：" + " ".join(f"{ch}{n}" for ch, n in missing[:30]))
@@ -1,10 +1,51 @@
-from flask import Flask, render_template_string, jsonify, request, redirect, render_template
+from flask import Flask, render_template_string, jsonify, request, redirect, render_template, Response, make_response
 import random
 import json
 import os
+import threading
+from types import SimpleNamespace
+
+from author_index import build_author_index, open_author_index
+from cipai import CipaiIndex, compile_all as compile_cipai, identify as identify_ci, split_ci, validate as validate_ci
+from corpus import FORMS, SELECTED_COLLECTIONS, SHARD_COLLECTIONS, collection_files, unpack_doc_id
+from http_cache import (IMMUTABLE_MAX_AGE, asset_url, cached_json, conditional, response_cache, static_response,
+                        stats as cache_stats)
+from normalize import SCRIPTS, get_converter, normalize_all, script_record
+from records import load_store
+from pingze import FORMATS, TEMPLATES, parse_lines, validate
+from pingze_index import build_pingze_index, open_pingze_index
+from reloader import Reloader
+from rhyme_scheme import build_rhyme_scheme, open_rhyme_scheme
+from search_index import build_search_index, open_search_index
+from shard_index import StaleShard, build_shard_index, iter_collection, open_shard_index
+from snapshot import build_snapshot, open_snapshot
+from tone_table import get_tone_table, reload_tone_table, sources as tone_sources
+from rhyme_freq import build_rhyme_freq
+from yun_index import BOOKS, CI_BOOK, DEFAULT_BOOK, ORDERS, book_sources, get_book, reload_books, reload_rhyme_freq
 
 app = Flask(__name__)
 
+
+# ===== HTTP 缓存 =====
+@app.context_processor
+def inject_asset_url():
+    """
+    模板中用 {{ asset_url("tones.js") }} 引用带内容哈希版本号的静态文件，
+    {{ tones_url() }} 为带版本号的紧凑声调表地址
+    """
+    return {
+        "asset_url": lambda filename: asset_url(app.static_folder, filename),
+        "tones_url": lambda: f"/api/tones/packed?v={get_tone_table().etag}",
+    }
+
+
+@app.after_request
+def cache_static(response):
+    if request.endpoint == "static":
+        return static_response(response, app.static_folder, request.view_args["filename"])
+    return response
+
+
 # ===== 数据加载 =====
 def load_json(path):
     with open(path, encoding='utf-8') as f:
@@ -13,24 +54,106 @@ def load_json(path):
 BASE = os.path.dirname(__file__)
 tang_path = os.path.join(BASE, "data", "chinese-poetry-master", "水墨唐诗", "shuimotangshi.json")
 song_path = os.path.join(BASE, "data", "chinese-poetry-master", "宋词", "宋词三百首.json")
-yun_path = os.path.join(BASE, "zhonghua_xinyun.json")
+
+# 优先映射预编译快照（python snapshot.py 生成），快照缺失时回退到解析 JSON（存为紧凑记录）
+snap = open_snapshot()
 
 try:
-    tang_list = load_json(tang_path)
+    tang_list = snap.collection("shuimo") if snap else load_store([tang_path])
 except:
     tang_list = [{"title": "示例诗", "author": "佚名", "paragraphs": ["山高月小", "水落石出"]}]
 
 try:
-    song_list = load_json(song_path)
+    song_list = snap.collection("song300") if snap else load_store([song_path], "rhythmic")
 except:
     song_list = [{"title": "示例词", "author": "佚名", "paragraphs": ["春风又绿江南岸", "明月何时照我还"]}]
 
-# 加载韵部数据
-try:
-    yunbu_data = load_json(yun_path)
-except Exception as e:
-    print("韵部文件加载失败:", e)
-    yunbu_data = {}
+# 韵书（中华新韵、平水韵）在第一次查询时才编译 / 打开，见 yun_index.py
+
+# /poem/<ptype> 对应的分片集合：song 指宋词，宋诗用 songshi
+POEM_COLLECTIONS = {"tang": "tang", "song": "ci", "songshi": "song"}
+
+
+def open_full_corpus():
+    """
+    打开一代全量语料索引（分别由 shard_index.py / author_index.py / search_index.py / rhyme_scheme.py /
+    pingze_index.py 生成）：shards 为分片记录偏移索引，authors 为作者索引，search 为全文检索索引，
+    yun 为用韵标注，pingze 为格律分析列；几者的记录编号互相对应，热更新时整体替换
+    """
+    shards = {name: open_shard_index(name) for name in SHARD_COLLECTIONS}
+    return SimpleNamespace(
+        shards=shards,
+        yun={name: open_rhyme_scheme(name, index) for name, index in shards.items()},
+        pingze={name: open_pingze_index(name, index) for name, index in shards.items()},
+        authors=open_author_index(),
+        search=open_search_index(),
+    )
+
+
+full_corpus = open_full_corpus()
+
+# 等热更新换上新索引的最长秒数
+STALE_RETRY_WAIT = 30
+
+
+@app.errorhandler(StaleShard)
+def retry_stale_shard(e):
+    """
+    分片已改动而索引还没重建好（热更新窗口内旧索引读到了新分片）：等正在进行的重建结束、
+    新一代索引换上后把这个请求重做一次；仍然不行（重建还没开始或失败）时返回 503
+    """
+    if _corpus_lock.acquire(timeout=STALE_RETRY_WAIT):
+        _corpus_lock.release()
+        try:
+            return app.view_functions[request.endpoint](**request.view_args)
+        except StaleShard:
+            pass
+    message = "语料正在更新，请稍后重试"
+    response = make_response(jsonify({"error": message}) if request.path.startswith("/api/") else message, 503)
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+def request_script():
+    """?script=original|simplified，默认原文；取值不合法时返回 None"""
+    script = request.args.get("script", "original")
+    return script if script in SCRIPTS else None
+
+# ===== 作诗页面提交：整首送到 /api/validate 校验 =====
+submit_poem_html = '''
+<script>
+function submitPoem(form) {
+    const lines = [];
+    for (let i = 1; document.getElementById(`line${i}`); i++) {
+        lines.push(document.getElementById(`line${i}`).value.trim());
+    }
+    const format = document.getElementById('tone').value;
+    const payload = {lines: lines, form: form.dataset.form};
+    if (format) payload.format = format;
+    fetch('/api/validate', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(payload)
+    })
+        .then(resp => resp.json())
+        .then(data => {
+            if (data.error) {
+                alert(data.error);
+                return;
+            }
+            const rows = data.lines.map((line, i) => {
+                if (line.error) return `第${i + 1}句：${line.error}`;
+                const wrong = line.chars.filter(c => !c.ok).map(c => `${c.char}（应${c.expected}）`);
+                return wrong.length ? `第${i + 1}句：${wrong.join('、')}` : null;
+            }).filter(r => r);
+            if (!data.rhyme.ok) rows.push(`韵脚 ${data.rhyme.chars.join('')} 不同韵`);
+            alert(data.ok ? '✅ 合律' : '以下位置不合律：\n' + rows.join('\n'));
+        })
+        .catch(() => alert('校验失败，请稍后再试'));
+    return false;
+}
+</script>
+'''
 
 # ===== 悬浮搜索框组件 =====
 floating_search_html = '''
@@ -57,8 +180,13 @@ floating_search_html = '''
             font-size: 1.2em;
         ">&times;</span>
     </div>
-    <h3 style="margin: 0 0 10px 0; font-size: 1em; color: #333;">查韵部</h3>
-    <input type="text" id="yun-input" maxlength="1" placeholder="输入一个字"
+    <h3 style="margin: 0 0 10px 0; font-size: 1em; color: #333;">查韵部
+        <select id="yun-book" style="float: right; font-family: inherit;">
+            <option value="xinyun">中华新韵</option>
+            <option value="pingshui">平水韵</option>
+        </select>
+    </h3>
+    <input type="text" id="yun-input" maxlength="64" placeholder="输入一个字或整句"
         style="
             width: 100%;
             padding: 8px;
@@ -102,6 +230,8 @@ const openBtn = document.getElementById('open-floating-search');
 // 输入框逻辑
 const input = document.getElementById('yun-input');
 const result = document.getElementById('yun-result');
+const bookSelect = document.getElementById('yun-book');
+bookSelect.onchange = () => input.dispatchEvent(new Event('input'));
 
 // 关闭按钮点击事件
 closeBtn.onclick = () => {
@@ -116,12 +246,16 @@ openBtn.onclick = () => {
 // 输入框监听
 input.addEventListener('input', function() {
     const char = this.value.trim();
-    if (char.length !== 1) {
+    if (char.length === 0) {
         result.innerHTML = '';
         return;
     }
+    if (char.length > 1) {
+        searchYunBatch(char);
+        return;
+    }
 
-    fetch(`/api/search_yun?char=${encodeURIComponent(char)}`)
+    fetch(`/api/search_yun?char=${encodeURIComponent(char)}&book=${bookSelect.value}`)
         .then(r => r.json())
         .then(data => {
             if (data.error) {
@@ -138,6 +272,32 @@ input.addEventListener('input', function() {
             console.error(err);
         });
 });
+
+// 整句：一次请求查出每个字的韵部，同一韵部的字表只显示一次
+function searchYunBatch(line) {
+    fetch(`/api/search_yun/batch?q=${encodeURIComponent(line)}&book=${bookSelect.value}`)
+        .then(r => r.json())
+        .then(data => {
+            if (data.error) {
+                result.innerHTML = `<span style="color: #e63946">${data.error}</span>`;
+                return;
+            }
+            const rows = Object.entries(data.chars).map(([ch, yuns]) =>
+                `<div>${ch}：<strong style="color: #007BFF;">${yuns.join('、')}</strong></div>`);
+            if (data.missing.length) {
+                rows.push(`<div style="color: #e63946">未收录：${data.missing.join('')}</div>`);
+            }
+            const groups = Object.entries(data.groups).map(([yun, zi]) => `
+                <details><summary>${yun}</summary>
+                ${zi.map(z => `<span style="margin: 2px 4px;">${z}</span>`).join('')}
+                </details>`);
+            result.innerHTML = rows.join('') + groups.join('');
+        })
+        .catch(err => {
+            result.innerHTML = '<span style="color: #e63946;">查询失败</span>';
+            console.error(err);
+        });
+}
 </script>
 '''
 
@@ -697,7 +857,7 @@ wuyan_lvshi_html = """
 
     <input type="text" class="title-input" id="title" placeholder="请输入诗题">
 
-    <form class="poem-form" onsubmit="alert('提交功能暂未实现'); return false;">
+    <form class="poem-form" data-form="wuyan-lvshi" onsubmit="return submitPoem(this);">
         <!-- 第一联 -->
         <div class="line-group">
             <div class="couplet-vertical">
@@ -759,67 +919,23 @@ wuyan_lvshi_html = """
 
     <a href="javascript:window.history.back()" class="back-btn">← 返回</a>
 
+<script src="{{ asset_url('tones.js') }}"></script>
 <script>
-    // 声明 toneData，初始为空
-    let toneData = {};
-
-    const templates = {
-        pingqi_buru: [
-            "─ ─ ○ │ │", "│ │ │ ─ ─",
-            "│ │ ─ ─ │", "─ ─ │ │ ─",
-            "─ ─ ○ │ │", "│ │ │ ─ ─",
-            "│ │ ─ ─ │", "─ ─ │ │ ─"
-        ],
-        pingqi_ru: [
-            "─ ─ │ │ ─", "│ │ │ ─ ─",
-            "│ │ ─ ─ │", "─ ─ │ │ ─",
-            "─ ─ ○ │ │", "│ │ │ ─ ─",
-            "│ │ ─ ─ │", "─ ─ │ │ ─"
-        ],
-        zeqi_buru: [
-            "│ │ │ ─ ─", "─ ─ ○ │ │",
-            "─ ─ │ │ ─", "│ │ │ ─ ─",
-            "│ │ ○ ─ ─", "─ ─ │ │ ─",
-            "─ ─ │ │ ─", "│ │ │ ─ ─"
-        ],
-        zeqi_ru: [
-            "│ │ │ ─ ─", "─ ─ │ │ ─",
-            "─ ─ │ │ ─", "│ │ │ ─ ─",
-            "│ │ ○ ─ ─", "─ ─ │ │ ─",
-            "─ ─ │ │ ─", "│ │ │ ─ ─"
-        ]
-    };
-
-    const rhymePositions = {
-        pingqi_buru: [1, 3, 5, 7],
-        pingqi_ru:   [0, 1, 3, 5, 7],
-        zeqi_buru:   [1, 3, 5, 7],
-        zeqi_ru:     [0, 1, 3, 5, 7]
-    };
-
-    // 从 char_tones.json 加载音调数据
-    fetch('/static/char_tones.json')
-         .then(r => {
-             if (!r.ok) throw new Error('无法加载 char_tones.json');
-             return r.json();
-         })
-         .then(data => {
-             toneData = data;
-             console.log('音调数据加载成功', toneData);
-             // 数据加载后，绑定输入事件
-             setupInputListeners();
-         })
-         .catch(err => {
-             console.error('加载音调数据失败:', err);
-             alert('音调数据加载失败，请检查 char_tones.json 是否存在且格式正确。');
-         });
+    const templates = {{ templates | tojson }};
+
+    const rhymePositions = {{ rhyme_positions | tojson }};
+
+    // 加载紧凑声调表（见 static/tones.js），加载完成后绑定输入事件
+    ToneTable.load('{{ tones_url() }}')
+        .then(() => setupInputListeners())
+        .catch(err => {
+            console.error('加载声调表失败:', err);
+            alert('声调数据加载失败，平仄校验功能不可用。');
+        });
 
     // 平仄判断函数
     function getToneClass(char) {
-        const tone = toneData[char];
-        if (tone === 1 || tone === 2) return 'ping';
-        if (tone === 3 || tone === 4) return 'ze';
-        return null; // 未知字
+        return ToneTable.toneClass(char);
     }
 
     // 获取结果提示元素
@@ -958,7 +1074,7 @@ wuyan_lvshi_html = """
         for (let i = 1; i <= 8; i++) {
             const input = document.getElementById(`line${i}`);
             input.addEventListener('blur', () => {
-                if (Object.keys(toneData).length > 0) {
+                if (ToneTable.loaded()) {
                     validateLine(i);
                 }
             });
@@ -1150,7 +1266,7 @@ wuyan_jueju_html = """
 
     <input type="text" class="title-input" id="title" placeholder="请输入诗题">
 
-    <form class="poem-form" onsubmit="alert('提交功能暂未实现'); return false;">
+    <form class="poem-form" data-form="wuyan-jueju" onsubmit="return submitPoem(this);">
         <!-- 第一联 -->
         <div class="line-group">
             <div class="couplet-vertical">
@@ -1184,47 +1300,23 @@ wuyan_jueju_html = """
 
     <a href="javascript:window.history.back()" class="back-btn">← 返回</a>
 
+<script src="{{ asset_url('tones.js') }}"></script>
 <script>
-    // 声明 toneData，初始为空
-    let toneData = {};
-
-    const templates = {
-        pingqi_buru: ["─ ─ ○ │ │", "│ │ │ ─ ─", "│ │ ─ ─ │", "─ ─ │ │ ─"],
-        pingqi_ru:   ["─ ─ │ │ ─", "│ │ │ ─ ─", "│ │ ─ ─ │", "─ ─ │ │ ─"],
-        zeqi_buru:   ["│ │ │ ─ ─", "─ ─ ○ │ │", "─ ─ │ │ ─", "│ │ │ ─ ─"],
-        zeqi_ru:     ["│ │ │ ─ ─", "─ ─ │ │ ─", "─ ─ │ │ ─", "│ │ │ ─ ─"]
-    };
-
-    const rhymePositions = {
-        pingqi_buru: [1, 3],
-        pingqi_ru:   [0, 1, 3],
-        zeqi_buru:   [1, 3],
-        zeqi_ru:     [0, 1, 2, 3]
-    };
-
-    // 从 tone.json 加载音调数据
-    fetch('/static/char_tones.json')
-         .then(r => {
-             if (!r.ok) throw new Error('无法加载 char_tones.json');
-             return r.json();
-         })
-         .then(data => {
-             toneData = data;
-            console.log('音调数据加载成功', toneData);
-             // 数据加载后，重新绑定事件或恢复功能
-             setupInputListeners();
-         })
-         .catch(err => {
-             console.error('加载音调数据失败:', err);
-             alert('音调数据加载失败，请检查 char_tones.json 是否存在且格式正确。');
-         });
+    const templates = {{ templates | tojson }};
+
+    const rhymePositions = {{ rhyme_positions | tojson }};
+
+    // 加载紧凑声调表（见 static/tones.js），加载完成后绑定输入事件
+    ToneTable.load('{{ tones_url() }}')
+        .then(() => setupInputListeners())
+        .catch(err => {
+            console.error('加载声调表失败:', err);
+            alert('声调数据加载失败，平仄校验功能不可用。');
+        });
 
     // 平仄判断函数
     function getToneClass(char) {
-        const tone = toneData[char];
-        if (tone === 1 || tone === 2) return 'ping';
-        if (tone === 3 || tone === 4) return 'ze';
-        return null; // 未知字
+        return ToneTable.toneClass(char);
     }
 
     // 校验逻辑（与之前一致）
@@ -1360,7 +1452,7 @@ function validateLine(lineNum) {
         for (let i = 1; i <= 4; i++) {
             const input = document.getElementById(`line${i}`);
             input.addEventListener('blur', () => {
-                if (Object.keys(toneData).length > 0) { // 确保数据已加载
+                if (ToneTable.loaded()) { // 确保数据已加载
                     validateLine(i);
                 }
             });
@@ -1552,7 +1644,7 @@ qiyan_jueju_html = """
 
     <input type="text" class="title-input" id="title" placeholder="请输入诗题">
 
-    <form class="poem-form" onsubmit="alert('提交功能暂未实现'); return false;">
+    <form class="poem-form" data-form="qiyan-jueju" onsubmit="return submitPoem(this);">
         <!-- 第一联 -->
         <div class="line-group">
             <div class="couplet-vertical">
@@ -1586,68 +1678,25 @@ qiyan_jueju_html = """
 
     <a href="javascript:window.history.back()" class="back-btn">← 返回</a>
 
+    <script src="{{ asset_url('tones.js') }}"></script>
     <script>
-        // 声明 toneData，用于存储汉字音调
-        let toneData = {};
-
         // 七言绝句平仄模板
-        const templates = {
-    pingqi_buru: [
-        "─ ─ │ │ ─ ─ │",  // 平平仄仄平平仄
-        "│ │ ─ ─ │ │ ─",  // 仄仄平平仄仄平
-        "│ │ ─ ─ ─ │ │",  // 仄仄平平平仄仄
-        "─ ─ │ │ │ ─ ─"   // 平平仄仄仄平平
-    ],
-    pingqi_ru: [
-        "─ ─ │ │ │ ─ ─",  // 平平仄仄仄平平
-        "│ │ ─ ─ │ │ ─",  // 仄仄平平仄仄平
-        "│ │ ─ ─ ─ │ │",  // 仄仄平平平仄仄
-        "─ ─ │ │ │ ─ ─"   // 平平仄仄仄平平
-    ],
-    zeqi_buru: [
-        "│ │ ─ ─ │ │ ─",  // 仄仄平平仄仄平
-        "─ ─ │ │ ─ ─ │",  // 平平仄仄平平仄
-        "─ ─ │ │ ─ │ │",  // 平平仄仄平仄仄
-        "│ │ ─ ─ │ │ ─"   // 仄仄平平仄仄平
-    ],
-    zeqi_ru: [
-        "│ │ ─ ─ ─ │ │",  // 仄仄平平平仄仄
-        "─ ─ │ │ │ ─ ─",  // 平平仄仄仄平平
-        "─ ─ │ │ ─ │ │",  // 平平仄仄平仄仄
-        "│ │ ─ ─ │ │ ─"   // 仄仄平平仄仄平
-    ]
-};
+        const templates = {{ templates | tojson }};
 
         // 押韵位置（行号索引 + 末字位置）
-        const rhymePositions = {
-            pingqi_buru: [1, 3],
-            pingqi_ru:   [0, 1, 3],
-            zeqi_buru:   [1, 3],
-            zeqi_ru:     [0, 1, 3]
-        };
-
-        // 从 char_tones.json 加载音调数据
-        fetch('/static/char_tones.json')
-            .then(r => {
-                if (!r.ok) throw new Error('无法加载 char_tones.json');
-                return r.json();
-            })
-            .then(data => {
-                toneData = data;
-                console.log('音调数据加载成功', Object.keys(data).length + ' 个汉字');
-                setupInputListeners(); // 数据加载成功后绑定输入事件
-            })
+        const rhymePositions = {{ rhyme_positions | tojson }};
+
+        // 加载紧凑声调表（见 static/tones.js），加载完成后绑定输入事件
+        ToneTable.load('{{ tones_url() }}')
+            .then(() => setupInputListeners())
             .catch(err => {
-                console.error('加载音调数据失败:', err);
-                alert('音调数据加载失败，请检查 /static/char_tones.json 是否存在且格式正确。');
+                console.error('加载声调表失败:', err);
+                alert('声调数据加载失败，平仄校验功能不可用。');
             });
 
         // 获取单个字的平仄类型
         function getToneClass(char) {
-            const tone = toneData[char];
-            if (tone === 1 || tone === 2) return 'ping'; // 平声
-            if (tone === 3 || tone === 4) return 'ze';  // 仄声
-            return null; // 未知字
+            return ToneTable.toneClass(char);
         }
 
         // 校验某一行诗句是否符合格式
@@ -1786,7 +1835,7 @@ qiyan_jueju_html = """
             for (let i = 1; i <= 4; i++) {
                 const input = document.getElementById(`line${i}`);
                 input.addEventListener('blur', () => {
-                    if (Object.keys(toneData).length > 0) {
+                    if (ToneTable.loaded()) {
                         validateLine(i);
                     }
                 });
@@ -1978,7 +2027,7 @@ qiyan_lvshi_html = """
 
     <input type="text" class="title-input" id="title" placeholder="请输入诗题">
 
-    <form class="poem-form" onsubmit="alert('提交功能暂未实现'); return false;">
+    <form class="poem-form" data-form="qiyan-lvshi" onsubmit="return submitPoem(this);">
         <!-- 第一联 -->
         <div class="line-group">
             <div class="couplet-vertical">
@@ -2040,84 +2089,25 @@ qiyan_lvshi_html = """
 
     <a href="javascript:window.history.back()" class="back-btn">← 返回</a>
 
+    <script src="{{ asset_url('tones.js') }}"></script>
     <script>
-        // 声明 toneData，用于存储汉字音调
-        let toneData = {};
-
         // 七言律诗平仄模板（8句）
-        const templates = {
-            pingqi_buru: [
-                "─ ─ │ │ ─ ─ │",  // 1
-                "│ │ ─ ─ │ │ ─",  // 2
-                "│ │ ─ ─ ─ │ │",  // 3
-                "─ ─ │ │ │ ─ ─",  // 4
-                "─ ─ │ │ ─ ─ │",  // 5
-                "│ │ ─ ─ │ │ ─",  // 6
-                "│ │ ─ ─ ─ │ │",  // 7
-                "─ ─ │ │ │ ─ ─"   // 8
-            ],
-            pingqi_ru: [
-                "─ ─ │ │ │ ─ ─",  // 1
-                "│ │ ─ ─ │ │ ─",  // 2
-                "│ │ ─ ─ ─ │ │",  // 3
-                "─ ─ │ │ │ ─ ─",  // 4
-                "─ ─ │ │ ─ ─ │",  // 5
-                "│ │ ─ ─ │ │ ─",  // 6
-                "│ │ ─ ─ ─ │ │",  // 7
-                "─ ─ │ │ │ ─ ─"   // 8
-            ],
-            zeqi_buru: [
-                "│ │ ─ ─ │ │ ─",  // 1
-                "─ ─ │ │ ─ ─ │",  // 2
-                "─ ─ │ │ │ ─ ─",  // 3
-                "│ │ ─ ─ │ │ ─",  // 4
-                "│ │ ─ ─ ─ │ │",  // 5
-                "─ ─ │ │ │ ─ ─",  // 6
-                "─ ─ │ │ ─ ─ │",  // 7
-                "│ │ ─ ─ │ │ ─"   // 8
-            ],
-            zeqi_ru: [
-                "│ │ ─ ─ ─ │ │",  // 1
-                "─ ─ │ │ │ ─ ─",  // 2
-                "─ ─ │ │ ─ ─ │",  // 3
-                "│ │ ─ ─ │ │ ─",  // 4
-                "│ │ ─ ─ ─ │ │",  // 5
-                "─ ─ │ │ │ ─ ─",  // 6
-                "─ ─ │ │ ─ ─ │",  // 7
-                "│ │ ─ ─ │ │ ─"   // 8
-            ]
-        };
+        const templates = {{ templates | tojson }};
 
         // 押韵位置（行号索引 + 末字位置）
-        const rhymePositions = {
-            pingqi_buru: [1, 3, 5, 7],
-            pingqi_ru:   [0, 1, 3, 5, 7],
-            zeqi_buru:   [1, 3, 5, 7],
-            zeqi_ru:     [0, 1, 3, 5, 7]
-        };
-
-        // 从 char_tones.json 加载音调数据
-        fetch('/static/char_tones.json')
-            .then(r => {
-                if (!r.ok) throw new Error('无法加载 char_tones.json');
-                return r.json();
-            })
-            .then(data => {
-                toneData = data;
-                console.log('音调数据加载成功', Object.keys(data).length + ' 个汉字');
-                setupInputListeners(); // 数据加载成功后绑定输入事件
-            })
+        const rhymePositions = {{ rhyme_positions | tojson }};
+
+        // 加载紧凑声调表（见 static/tones.js），加载完成后绑定输入事件
+        ToneTable.load('{{ tones_url() }}')
+            .then(() => setupInputListeners())
             .catch(err => {
-                console.error('加载音调数据失败:', err);
-                alert('音调数据加载失败，请检查 /static/char_tones.json 是否存在且格式正确。');
+                console.error('加载声调表失败:', err);
+                alert('声调数据加载失败，平仄校验功能不可用。');
             });
 
         // 获取单个字的平仄类型
         function getToneClass(char) {
-            const tone = toneData[char];
-            if (tone === 1 || tone === 2) return 'ping'; // 平声
-            if (tone === 3 || tone === 4) return 'ze';  // 仄声
-            return null; // 未知字
+            return ToneTable.toneClass(char);
         }
 
         // 校验某一行诗句是否符合格式
@@ -2256,7 +2246,7 @@ qiyan_lvshi_html = """
             for (let i = 1; i <= 8; i++) {
                 const input = document.getElementById(`line${i}`);
                 input.addEventListener('blur', () => {
-                    if (Object.keys(toneData).length > 0) {
+                    if (ToneTable.loaded()) {
                         validateLine(i);
                     }
                 });
@@ -2285,91 +2275,516 @@ def compose(ptype):
     else:
         return "<h1>未知类型</h1><p><a href='javascript:window.history.back()' class='back-btn'>← 返回</a></p>", 400
 
+# 作诗页面的平仄提示和押韵句直接由 pingze.TEMPLATES 渲染进页面，与 /api/validate 的校验用同一份模板
+TEMPLATE_MARKS = {"平": "─", "仄": "│", "中": "○"}
+
+def render_compose(page_html, form):
+    """templates 为 格式 -> 各句提示（─ 平、│ 仄、○ 可平可仄，空格分隔），rhyme_positions 为 格式 -> 押韵句下标"""
+    templates = {fmt: [" ".join(TEMPLATE_MARKS[m] for m in line) for line in TEMPLATES[form, fmt].patterns]
+                 for fmt in FORMATS}
+    rhyme_positions = {fmt: list(TEMPLATES[form, fmt].rhymes) for fmt in FORMATS}
+    return render_template_string(page_html + submit_poem_html + floating_search_html,
+                                  templates=templates, rhyme_positions=rhyme_positions)
+
 @app.route("/compose/tang/wuyan-jueju")
 def compose_wuyan_jueju():
-    return render_template_string(wuyan_jueju_html + floating_search_html)
+    return render_compose(wuyan_jueju_html, "wuyan-jueju")
 
 @app.route("/compose/tang/wuyan-lvshi")
 def compose_wuyan_lvshi():
-    return render_template_string(wuyan_lvshi_html + floating_search_html)
+    return render_compose(wuyan_lvshi_html, "wuyan-lvshi")
 
 @app.route("/compose/tang/qiyan-jueju")
 def compose_qiyan_jueju():
-    return render_template_string(qiyan_jueju_html + floating_search_html)
+    return render_compose(qiyan_jueju_html, "qiyan-jueju")
 
 @app.route("/compose/tang/qiyan-lvshi")
 def compose_qiyan_lvshi():
-    return render_template_string(qiyan_lvshi_html + floating_search_html)
-
-# 缓存 cipai_data，避免每次请求都读文件
-_cipai_data = None
-
-def load_cipai_data():
-    global _cipai_data
-    if _cipai_data is not None:
-        return _cipai_data
+    return render_compose(qiyan_lvshi_html, "qiyan-lvshi")
+
+# 缓存 cipai_data，避免每次请求都读文件；文件改动后由热更新线程替换
+# 各词牌的 tone_pattern 同时编译成逐字的约束数组（见 cipai.py），提交时直接查表；
+# 识别词牌用的句式前缀树也在这时建好。三者打包在一个对象里整体替换，
+# 请求开始时取一次引用，不会拿到新旧混杂的词牌数据
+_cipai = None
+
+def compile_cipai_state(data):
+    """cipai.json 内容 -> data 原始数据、patterns 编译好的格律、index 识别索引"""
+    patterns = compile_cipai(data)
+    return SimpleNamespace(data=data, patterns=patterns, index=CipaiIndex(patterns))
+
+def load_cipai():
+    global _cipai
+    state = _cipai
+    if state is not None:
+        return state
     try:
         json_path = os.path.join(app.static_folder, 'cipai.json')
         with open(json_path, 'r', encoding='utf-8') as f:
-            _cipai_data = json.load(f)
+            data = json.load(f)
     except Exception as e:
         print(f"加载 cipai.json 失败: {e}")
-        _cipai_data = {}
-    return _cipai_data
+        data = {}
+    state = _cipai = compile_cipai_state(data)
+    return state
+
+def load_cipai_data():
+    return load_cipai().data
 
 @app.route('/compose/song')
 def choose_ci():
     cipai_data = load_cipai_data()
     return render_template_string(choose_ci_html, cipai_data=cipai_data)
 
+def request_book():
+    """?book= 指定韵书，默认中华新韵；未知韵书返回 None"""
+    return get_book(request.args.get("book") or DEFAULT_BOOK)
+
+
+def request_rank():
+    """?order=freq|file（默认按韵脚字频）&top=20；order 不合法时返回 None"""
+    order = request.args.get("order") or "freq"
+    top = request.args.get("top", type=int)
+    return (order if order in ORDERS else None), (top if top and top > 0 else None)
+
+
+def request_yun(scheme):
+    """
+    ?yun=八寒（&book=pingshui）-> 用韵标注上的筛选条件 (全局编号序列, 逐条检查函数)
+    未指定韵部时返回 (None, None)，出错时返回 (None, 错误信息)
+    """
+    yun = request.args.get("yun", "").strip()
+    if not yun:
+        return None, None
+    book = request_book()
+    if book is None:
+        return None, f"未知韵书，可选 {'/'.join(BOOKS)}"
+    if yun not in book.names:
+        return None, f"{book.name} 中没有韵部 '{yun}'"
+    if scheme is None:
+        return None, "用韵标注尚未生成"
+    group = book.names.index(yun)
+    return (scheme.postings(book.name, group), lambda gid: group in scheme.groups(book.name, gid)), None
+
+
+def request_sample_filters():
+    """
+    ?author=李白&form=qiyan-jueju&min_lines=8 -> (sample 的参数, 错误信息)
+    体裁写错或句数不是非负整数时返回错误，免得与“没有符合条件的诗词”混为一谈
+    """
+    form = request.args.get("form") or None
+    if form is not None and form not in FORMS[1:]:
+        return None, f"未知体裁 '{form}'，可选 {'/'.join(FORMS[1:])}"
+    min_lines = request.args.get("min_lines") or None
+    if min_lines is not None:
+        if not (min_lines.isascii() and min_lines.isdigit()):
+            return None, f"min_lines 应为非负整数，实际为 '{min_lines}'"
+        min_lines = int(min_lines)
+    return {"author": request.args.get("author") or None, "form": form, "min_lines": min_lines}, None
+
+
+def request_pingze(pingze):
+    """
+    ?strict=1（只要严格合律的近体诗）、?format=pingqi_ru 等 -> 格律分析列上的筛选条件列表
+    返回 (条件列表, 错误信息)
+    """
+    strict = request.args.get("strict") in ("1", "true")
+    fmt = request.args.get("format") or None
+    if not strict and fmt is None:
+        return [], None
+    if fmt is not None and fmt not in FORMATS:
+        return [], f"未知格式 '{fmt}'，可选 {'/'.join(FORMATS)}"
+    if pingze is None:
+        return [], "格律分析列尚未生成"
+    conditions = []
+    if strict:
+        conditions.append((pingze.strict, pingze.is_strict))
+    if fmt is not None:
+        code = FORMATS.index(fmt)
+        formats = pingze.columns["format"]
+        conditions.append((None, lambda gid: formats[gid] == code))
+    return conditions, None
+
 @app.route("/api/search_yun")
+@cached_json(max_age=3600)
 def search_yun():
+    """
+    查一个字所在的韵部：?char=行&book=xinyun|pingshui
+    韵字默认按全量语料中做韵脚的次数排序（counts 为对应次数）；?order=file 为韵书原顺序，?top=20 只取前 20 个
+    """
     char = request.args.get("char", "").strip()
     if not char:
         return jsonify({"error": "请输入一个汉字"}), 400
+    book = request_book()
+    if book is None:
+        return jsonify({"error": f"未知韵书，可选 {'/'.join(BOOKS)}"}), 400
+    order, top = request_rank()
+    if order is None:
+        return jsonify({"error": f"未知排序，可选 {'/'.join(ORDERS)}"}), 400
+
+    # 反查索引随韵书编译好，排序和响应体都已缓存
+    body = book.body(char, order, top)
+    if body is None:
+        return jsonify({"error": f"未找到汉字 '{char}' 所在的韵部", "result": []})
+    return Response(body, mimetype="application/json")
 
-    result = []
-    found_yun = None
+# 一次批量查询的字数上限（一首长律约百字，留足余量）
+YUN_BATCH_LIMIT = 2000
 
-    # 遍历所有韵部，查找该字
-    for yun_name, data in yunbu_data.items():
-        if char in data.get("zi", []):
-            result = data["zi"]
-            found_yun = yun_name
-            break
 
-    if not result:
-        return jsonify({"error": f"未找到汉字 '{char}' 所在的韵部", "result": []})
+@app.route("/api/search_yun/batch", methods=["GET", "POST"])
+@cached_json(max_age=3600)
+def search_yun_batch():
+    """
+    批量查韵部，整首诗一次请求：
+        GET  ?q=床前明月光&q=疑是地上霜      （可重复，每个 q 为一个字或一整句）
+        POST {"lines": ["床前明月光", ...]} 或 {"chars": "床前明月光"}
+    ?book=pingshui 改用平水韵；?order=、?top= 同 /api/search_yun
+    返回 chars（字 -> 韵部列表）、groups（涉及的韵部 -> zi，不重复）、missing（查不到的字）
+    """
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        texts = payload.get("lines") or payload.get("chars") or []
+        if isinstance(texts, str):
+            texts = [texts]
+    else:
+        texts = request.args.getlist("q") or request.args.getlist("chars")
+    texts = [t for t in texts if isinstance(t, str)]
+    if not texts:
+        return jsonify({"error": "请输入要查询的字或诗句"}), 400
+    if sum(len(t) for t in texts) > YUN_BATCH_LIMIT:
+        return jsonify({"error": f"一次最多查询 {YUN_BATCH_LIMIT} 个字"}), 400
+    book = request_book()
+    if book is None:
+        return jsonify({"error": f"未知韵书，可选 {'/'.join(BOOKS)}"}), 400
+    order, top = request_rank()
+    if order is None:
+        return jsonify({"error": f"未知排序，可选 {'/'.join(ORDERS)}"}), 400
+    return Response(book.batch_body(texts, order, top), mimetype="application/json")
+
+# 一次查询声调的字数上限
+TONES_LIMIT = 2000
+
+
+@app.route("/api/tones")
+@cached_json(max_age=3600)
+def api_tones():
+    """
+    只查页面上用到的字：?chars=床前明月光
+    返回 {"tones": {字: 编号}}，编号 0 未知或平仄两收、1 平、2 仄、3 入声（见 tone_table.py）
+    """
+    chars = request.args.get("chars", "")
+    if not chars:
+        return jsonify({"error": "请输入要查询的字"}), 400
+    if len(chars) > TONES_LIMIT:
+        return jsonify({"error": f"一次最多查询 {TONES_LIMIT} 个字"}), 400
+    return jsonify({"tones": get_tone_table().codes(chars)})
+
+@app.route("/api/tones/packed")
+def api_tones_packed():
+    """
+    整张紧凑声调表（U+3400–U+9FFF 每字 2 位，6912 字节），作诗页面在浏览器里按位查
+    带上当前版本号 ?v=（见 tones_url）时可长期缓存，否则每次用 ETag 重新验证
+    """
+    table = get_tone_table()
+    max_age = IMMUTABLE_MAX_AGE if request.args.get("v") == table.etag else 0
+    return conditional(Response(table.packed, mimetype="application/octet-stream"), table.etag, max_age)
+
+@app.route("/api/validate", methods=["GET", "POST"])
+@cached_json()
+def api_validate():
+    """
+    近体诗格律校验（五绝 / 五律 / 七绝 / 七律，见 pingze.py）：
+        GET  ?text=白日依山尽，黄河入海流。…
+        POST {"lines": ["白日依山尽", ...]} 或 {"text": "..."}
+    可选 form=wuyan-jueju 等（默认按句式判断）、format=pingqi_buru 等（默认取最吻合的）、book=pingshui
+    返回逐句逐字的平仄比对（tone 为实际平仄，expected 为要求，中 为可平可仄）和押韵情况
+    """
+    if request.method == "POST":
+        params = request.get_json(silent=True) or {}
+    else:
+        params = request.args
+    lines = params.get("lines")
+    if isinstance(lines, list):
+        lines = [line for line in lines if isinstance(line, str)]
+    else:
+        lines = parse_lines(params.get("text") or "")
+    if not lines:
+        return jsonify({"error": "请输入要校验的诗句"}), 400
+    try:
+        report = validate(lines, params.get("form") or None, params.get("format") or None, params.get("book") or None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report)
+
+@app.route("/api/cipai/identify", methods=["GET", "POST"])
+@cached_json()
+def api_cipai_identify():
+    """
+    识别一首未标词牌的词（见 cipai.identify）：
+        GET  ?text=无言独上西楼，月如钩。…
+        POST {"lines": [...]} 或 {"text": "..."}
+    可选 top=5（最多 20）、book=pingshui（押韵段判断用的韵书）
+    返回按可能性排序的候选：词牌名、匹配层级（exact / merged / total）、平仄错字数、押韵段不合数、得分、按该词牌切分的各句
+    """
+    if request.method == "POST":
+        params = request.get_json(silent=True) or {}
+    else:
+        params = request.args
+    lines = params.get("lines")
+    if isinstance(lines, list):
+        lines = split_ci([line for line in lines if isinstance(line, str)])
+    else:
+        lines = split_ci((params.get("text") or "").splitlines())
+    if not lines:
+        return jsonify({"error": "请输入要识别的词"}), 400
+    try:
+        top = min(max(int(params.get("top") or 5), 1), 20)
+    except (TypeError, ValueError):
+        return jsonify({"error": "top 需为整数"}), 400
+    try:
+        candidates = identify_ci(load_cipai().index, lines, top, params.get("book") or None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"chars": sum(len(line) for line in lines), "candidates": candidates})
+
+@app.route("/api/author/<name>")
+@cached_json()
+def api_author(name):
+    """作者小传 + 分页作品列表：?page=1&size=20&script=simplified"""
+    script = request_script()
+    if script is None:
+        return jsonify({"error": f"未知文字版本，可选 {'/'.join(SCRIPTS)}"}), 400
+    gen = full_corpus
+    authors = gen.authors
+    if authors is None or name not in authors:
+        return jsonify({"error": f"未找到作者 '{name}'"}), 404
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    size = min(max(request.args.get("size", 20, type=int), 1), 100)
+    poems = []
+    for collection, gid in authors.poems(name, (page - 1) * size, size):
+        index = gen.shards.get(collection)
+        if index is None or gid >= len(index):
+            continue
+        record = script_record(index, gid, script)
+        poems.append({
+            "collection": collection,
+            "id": gid,
+            "title": record.get("rhythmic") or record.get("title", ""),
+            "first_line": (record.get("paragraphs") or [""])[0],
+        })
+
+    return jsonify({
+        "name": name,
+        "bio": authors.bio(name),
+        "total": authors.poem_count(name),
+        "page": page,
+        "size": size,
+        "poems": poems
+    })
+
+@app.route("/api/search")
+@cached_json()
+def api_search():
+    """全文检索：?q=明月&page=1&size=20&script=simplified，按相关度排序"""
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "请输入检索词"}), 400
+    script = request_script()
+    if script is None:
+        return jsonify({"error": f"未知文字版本，可选 {'/'.join(SCRIPTS)}"}), 400
+    gen = full_corpus
+    if gen.search is None:
+        return jsonify({"error": "检索索引尚未生成"}), 503
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    size = min(max(request.args.get("size", 20, type=int), 1), 100)
+    total, hits = gen.search.search(q, (page - 1) * size, size)
+    convert = get_converter().convert
+    parts = convert(q).split()
+    results = []
+    for doc, score in hits:
+        collection, gid = unpack_doc_id(doc)
+        index = gen.shards.get(collection)
+        if index is None or gid >= len(index):
+            continue
+        record = index.record(gid)
+        paragraphs = record.get("paragraphs") or [""]
+        # 摘录包含查询词的那一行（繁简归一后匹配），找不到时取首行
+        line = next((i for i, p in enumerate(paragraphs) if any(part in convert(p) for part in parts)), 0)
+        if script != "original":
+            record = script_record(index, gid, script)
+            paragraphs = record.get("paragraphs") or [""]
+        snippet = paragraphs[min(line, len(paragraphs) - 1)]
+        results.append({
+            "collection": collection,
+            "id": gid,
+            "title": record.get("rhythmic") or record.get("title", ""),
+            "author": record.get("author", ""),
+            "snippet": snippet,
+            "score": round(score, 3),
+        })
 
     return jsonify({
-        "char": char,
-        "yun": found_yun,
-        "zi": result
+        "q": q,
+        "total": total,
+        "page": page,
+        "size": size,
+        "results": results
     })
 
+@app.route("/api/corpus/stream")
+def corpus_stream():
+    """
+    以 NDJSON 流式导出整个集合：?collection=tang|song|ci&fields=title,author&script=simplified
+    逐个分片读取、逐条输出，内存占用与语料规模无关
+    """
+    collection = request.args.get("collection", "")
+    if collection not in SHARD_COLLECTIONS:
+        return jsonify({"error": f"未知集合 '{collection}'，可选 {'/'.join(SHARD_COLLECTIONS)}"}), 400
+    script = request_script()
+    if script is None:
+        return jsonify({"error": f"未知文字版本，可选 {'/'.join(SCRIPTS)}"}), 400
+    fields = [f for f in request.args.get("fields", "").split(",") if f]
+    convert = get_converter().convert_poem if script == "simplified" else None
+
+    def generate():
+        for poem in iter_collection(collection):
+            if convert:
+                poem = convert(poem)
+            if fields:
+                poem = {f: poem.get(f) for f in fields}
+            yield json.dumps(poem, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route("/api/yun/poems")
+@cached_json()
+def api_yun_poems():
+    """
+    按用韵筛选作品：?collection=tang|song|ci&yun=八寒&book=xinyun&page=1&size=20&script=simplified
+    不带 yun 时返回该集合各韵部的作品数
+    """
+    collection = request.args.get("collection", "tang")
+    if collection not in SHARD_COLLECTIONS:
+        return jsonify({"error": f"未知集合 '{collection}'，可选 {'/'.join(SHARD_COLLECTIONS)}"}), 400
+    script = request_script()
+    if script is None:
+        return jsonify({"error": f"未知文字版本，可选 {'/'.join(SCRIPTS)}"}), 400
+    book = request_book()
+    if book is None:
+        return jsonify({"error": f"未知韵书，可选 {'/'.join(BOOKS)}"}), 400
+    gen = full_corpus
+    index = gen.shards.get(collection)
+    scheme = gen.yun.get(collection)
+    if index is None or scheme is None:
+        return jsonify({"error": "用韵标注尚未生成"}), 503
+
+    yun = request.args.get("yun", "").strip()
+    if not yun:
+        return jsonify({"collection": collection, "book": book.name,
+                        "counts": dict(zip(book.names, scheme.counts(book.name)))})
+    if yun not in book.names:
+        return jsonify({"error": f"{book.name} 中没有韵部 '{yun}'"}), 400
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    size = min(max(request.args.get("size", 20, type=int), 1), 100)
+    gids = scheme.postings(book.name, book.names.index(yun))
+    poems = []
+    for gid in gids[(page - 1) * size:page * size]:
+        record = script_record(index, gid, script)
+        poems.append({
+            "id": gid,
+            "title": record.get("rhythmic") or record.get("title", ""),
+            "author": record.get("author", ""),
+            "first_line": (record.get("paragraphs") or [""])[0],
+            "yun": [book.names[g] for g in scheme.groups(book.name, gid)],
+        })
+
+    return jsonify({
+        "collection": collection,
+        "book": book.name,
+        "yun": yun,
+        "total": len(gids),
+        "page": page,
+        "size": size,
+        "poems": poems
+    })
+
+@app.route("/api/pingze/stats")
+@cached_json()
+def api_pingze_stats():
+    """
+    格律统计：?collection=tang|song|ci
+    按体裁给出首数、严格合律首数、各平仄格式首数和错字数分布（见 pingze_index.py）
+    """
+    collection = request.args.get("collection", "tang")
+    if collection not in SHARD_COLLECTIONS:
+        return jsonify({"error": f"未知集合 '{collection}'，可选 {'/'.join(SHARD_COLLECTIONS)}"}), 400
+    pingze = full_corpus.pingze.get(collection)
+    if pingze is None:
+        return jsonify({"error": "格律分析列尚未生成"}), 503
+    return jsonify({"collection": collection, "forms": pingze.stats()})
+
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    """HTTP 缓存命中情况：接口 LRU 的命中 / 未命中 / 淘汰次数，以及返回 304 的次数"""
+    return jsonify(cache_stats())
+
 @app.route("/poem/<ptype>")
 def poem(ptype):
-    if ptype == "tang":
+    """
+    随机返回一首诗词
+    默认从全量分片（全唐诗 / 宋词 / 宋诗）中抽取，只解码抽中的那一条；
+    ?scope=selected 或索引尚未生成时，使用精选集合
+    可选过滤：?author=李白 &form=qiyan-jueju &min_lines=8（按句数计）；体裁、句数写错时返回 400
+    ?script=simplified 返回简体（全唐诗分片原文为繁体）
+    ?yun=八寒 只抽押该韵的作品（按用韵标注，&book=pingshui 时用平水韵韵目，如 上平十四寒）
+    ?strict=1 只抽严格合律的近体诗，?format=pingqi_ru 等按平仄格式筛选（见 pingze_index.py）
+    """
+    script = request_script()
+    if script is None:
+        return jsonify({"error": f"未知文字版本，可选 {'/'.join(SCRIPTS)}"}), 400
+    scope = request.args.get("scope", "full")
+    collection = POEM_COLLECTIONS.get(ptype)
+    gen = full_corpus
+    index = gen.shards.get(collection)
+    if scope != "selected" and index is not None and len(index):
+        filters, error = request_sample_filters()
+        if error:
+            return jsonify({"error": error}), 400
+        within, error = request_yun(gen.yun.get(collection))
+        if error:
+            return jsonify({"error": error}), 400
+        conditions, error = request_pingze(gen.pingze.get(collection))
+        if error:
+            return jsonify({"error": error}), 400
+        gid = index.sample(
+            **filters,
+            within=([within] if within else []) + conditions,
+            # 额外条件的描述，精确筛选的结果（包括“没有”）按它缓存
+            key=tuple(request.args.get(k) or "" for k in ("yun", "book", "strict", "format")),
+        )
+        if gid is None:
+            return jsonify({"title": "", "author": "", "content": "没有符合条件的诗词"}), 404
+        poem = script_record(index, gid, script)
+    elif ptype == "tang":
         poem = random.choice(tang_list)
-
-        paragraphs = poem.get("paragraphs", [])
-        content = "\n".join(paragraphs)
-        return jsonify({
-            "title": poem.get("title", ""),
-            "author": poem.get("author", ""),
-            "content": content
-        })
     elif ptype == "song":
         poem = random.choice(song_list)
-        paragraphs = poem.get("paragraphs", [])
-        content = "\n".join(paragraphs)
-        return jsonify({
-            "title": poem.get("rhythmic", ""),
-            "author": poem.get("author", ""),
-            "content": content
-        })
     else:
         return jsonify({"title": "", "author": "", "content": "未知类别"})
+    if scope == "selected" and script == "simplified":
+        poem = get_converter().convert_poem(poem)
+
+    paragraphs = poem.get("paragraphs", [])
+    content = "\n".join(paragraphs)
+    return jsonify({
+        "title": poem.get("rhythmic") or poem.get("title", ""),
+        "author": poem.get("author", ""),
+        "content": content
+    })
 
 @app.route('/ci')
 def ci_index():
@@ -2377,14 +2792,7 @@ def ci_index():
     步骤1：展示所有词牌名
     对应模板：templates/ci_index.html
     """
-    try:
-        # 从 static 目录加载 cipai.json
-        with open('static/cipai.json', 'r', encoding='utf-8') as f:
-            cipai_data = json.load(f)
-    except Exception as e:
-        print(f"加载 cipai.json 失败: {e}")
-        cipai_data = {}
-    
+    cipai_data = load_cipai_data()
     return render_template('ci_index.html', cipai_data=cipai_data)
 
 
@@ -2393,11 +2801,8 @@ def ci_form(cipai_name):
     """
     显示指定词牌的填词表单
     """
-    try:
-        with open('static/cipai.json', 'r', encoding='utf-8') as f:
-            cipai_data = json.load(f)
-    except Exception as e:
-        print(f"加载 cipai.json 失败: {e}")
+    cipai_data = load_cipai_data()
+    if not cipai_data:
         return "词牌数据加载失败", 500
 
     if cipai_name not in cipai_data:
@@ -2418,7 +2823,9 @@ def ci_form(cipai_name):
         'ci_form.html',
         cipai_name=cipai_name,
         cipai=cipai,
-        sections=sections  # 传入带序号的列表
+        sections=sections,  # 传入带序号的列表
+        books={name: title for name, (title, _, _) in BOOKS.items()},
+        default_book=CI_BOOK,
     )
 
 def load_json(path):
@@ -2435,9 +2842,7 @@ BASE = os.path.dirname(os.path.abspath(__file__))
 
 @app.route('/compose/song')
 def compose_song():
-    # 加载 cipai.json
-    cipai_path = os.path.join(BASE, "static", "cipai.json")
-    cipai_data = load_json(cipai_path)
+    cipai_data = load_cipai_data()
     if not cipai_data:
         return "词牌数据加载失败", 500
     return render_template_string(cipai_list_html, cipai_data=cipai_data)
@@ -2447,13 +2852,13 @@ def compose_song():
 @app.route('/ci/submit', methods=['POST'])
 def ci_submit():
     """
-    接收用户填词内容，暂时只做回显
+    接收用户填词内容：先查句数字数，再按编译好的词牌格律逐字校验平仄、按段校验押韵（见 cipai.py）
+    表单带 book 指定韵书（填词页有下拉框），默认词林正韵
     """
     cipai_name = request.form.get('cipai_name')
-    try:
-        with open('static/cipai.json', 'r', encoding='utf-8') as f:
-            cipai_data = json.load(f)
-    except:
+    state = load_cipai()
+    cipai_data = state.data
+    if not cipai_data:
         return "数据加载失败", 500
 
     if cipai_name not in cipai_data:
@@ -2469,17 +2874,141 @@ def ci_submit():
             return f"第{i+1}句应为 {cipai['sections'][i]['chars']} 字，你输入了 {len(line)} 字", 400
         lines.append(line)
 
-    # 暂时：回显用户填写的内容
-    result_html = """
-    <h1>你的《{}》</h1>
-    <div style="font-size: 1.4em; line-height: 2em; text-align: center; white-space: pre-line;">
-    {}
+    pattern = state.patterns.get(cipai_name)
+    report = None
+    if pattern is not None:
+        try:
+            report = validate_ci(pattern, lines, request.form.get('book') or None)
+        except ValueError as e:
+            return str(e), 400
+
+    return render_template_string(ci_result_html, cipai_name=cipai_name, lines=lines, report=report)
+
+
+ci_result_html = """
+<h1>你的《{{ cipai_name }}》</h1>
+{% if report %}
+<p style="text-align: center; color: {{ '#28a745' if report.ok else '#dc3545' }};">
+    {{ '✅ 合律' if report.ok else '不合律' }}（错 {{ report.errors }} 字{% if report.unknown %}，{{ report.unknown }} 字平仄不定（查不到或平仄两收）{% endif %}）
+</p>
+<div style="font-size: 1.4em; line-height: 2em; text-align: center;">
+    {% for line in report.lines %}
+    <div>
+        {% for c in line.chars %}<span title="应{{ c.expected }}{% if c.expected == '中' %}（宜{{ c.prefer }}）{% endif %}，实{{ c.tone or '不定' }}"
+            style="color: {{ '#dc3545' if not c.ok else ('#6c757d' if not c.tone else '#333') }};">{{ c.char }}</span>{% endfor %}
+        <span style="font-size: 0.6em; color: #999;">{{ line.pattern }}</span>
     </div>
-    <p><a href="/ci">↺ 重新填词</a></p>
-    """.format(cipai_name, "\n".join(lines))
+    {% endfor %}
+</div>
+{% for rhyme in report.rhymes %}
+<p style="text-align: center;">
+    {{ rhyme.kind }} {{ rhyme.chars | join('') }}：
+    {% if rhyme.yun %}{{ rhyme.yun | join('、') }}{% elif rhyme.yun is none %}未收录{% else %}<span style="color: #dc3545;">不同韵</span>{% endif %}
+    （{{ report.book }}）
+</p>
+{% endfor %}
+{% else %}
+<div style="font-size: 1.4em; line-height: 2em; text-align: center; white-space: pre-line;">
+{{ lines | join('\n') }}
+</div>
+<p style="text-align: center; color: #999;">此词牌暂无格律数据，未做平仄校验</p>
+{% endif %}
+<p><a href="/ci">↺ 重新填词</a></p>
+"""
+
+# ===== 热更新 =====
+# 每个重建函数先在后台构建出完整的新数据，最后一步才替换全局引用
+# 全量语料、韵书、声调表三组都会重建分片派生的索引并替换 full_corpus，各组线程互相独立，
+# 用同一把锁串行执行：否则较早开始的重建可能在较新的一代之后才替换，把新数据盖掉
+_corpus_lock = threading.Lock()
+
+def _shard_files():
+    return [p for patterns, _ in SHARD_COLLECTIONS.values() for p in collection_files(patterns)]
+
+
+def _reload_full_corpus(changed):
+    global full_corpus
+    changed = set(changed)
+    with _corpus_lock:
+        for name, (patterns, _) in SHARD_COLLECTIONS.items():
+            if changed & set(collection_files(patterns)):
+                # 只重新解析哈希变化的分片，其余分片沿用旧索引中的段
+                build_shard_index(name, previous=open_shard_index(name))
+                build_rhyme_scheme(name)
+                build_pingze_index(name)
+        # 简体缓存按分片哈希命名，只有改动过的分片需要重新转换
+        normalize_all()
+        # 作者索引由分片索引派生，不读分片；检索索引和韵脚字频的分片结果同样按分片哈希缓存，
+        # 只重新统计改动过的分片，其余直接读缓存合并
+        build_author_index()
+        build_search_index()
+        full_corpus = open_full_corpus()
+        build_rhyme_freq()
+        reload_rhyme_freq()
+        # 接口缓存里的响应来自旧数据
+        response_cache.clear()
+
+
+def _selected_files():
+    return [p for patterns, _ in SELECTED_COLLECTIONS.values() for p in collection_files(patterns)]
+
+
+def _reload_selected(changed):
+    global snap, tang_list, song_list
+    build_snapshot()
+    new_snap = open_snapshot()
+    if new_snap is None:
+        return
+    snap = new_snap
+    tang_list = new_snap.collection("shuimo")
+    song_list = new_snap.collection("song300")
+
+
+def _reload_books(changed):
+    global full_corpus
+    with _corpus_lock:
+        reload_books(changed)
+        # 用韵标注里存的是韵部编号，格律分析列的押韵判断也依赖韵书，韵书改动后一并重建
+        for name in SHARD_COLLECTIONS:
+            build_rhyme_scheme(name)
+            build_pingze_index(name)
+        full_corpus = open_full_corpus()
+        response_cache.clear()
+
+
+def _reload_tones(changed):
+    global full_corpus
+    with _corpus_lock:
+        reload_tone_table()
+        # 格律分析列按声调表计算错字数
+        for name in SHARD_COLLECTIONS:
+            build_pingze_index(name)
+        full_corpus = open_full_corpus()
+        response_cache.clear()
+
+
+def _reload_cipai(changed):
+    global _cipai
+    data = load_json(os.path.join(app.static_folder, 'cipai.json'))
+    if data:
+        _cipai = compile_cipai_state(data)
+        # 词牌识别的结果在接口缓存里
+        response_cache.clear()
+
+
+def start_reloader(interval=5.0):
+    """启动后台热更新线程；用 WSGI 服务器部署时在创建 app 后调用"""
+    reloader = Reloader(interval)
+    reloader.watch("全量语料", _shard_files, _reload_full_corpus)
+    reloader.watch("精选集合", _selected_files, _reload_selected)
+    reloader.watch("韵书", book_sources, _reload_books)
+    reloader.watch("词牌", lambda: [os.path.join(app.static_folder, 'cipai.json')], _reload_cipai)
+    reloader.watch("声调表", tone_sources, _reload_tones)
+    reloader.start()
+    return reloader
 
-    return result_html
 
 # ===== 启动 =====
 if __name__ == "__main__":
+    start_reloader()
     app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,528 @@
+"""
+韵书引擎：中华新韵、平水韵、词林正韵等韵书共用一种编译格式和反查索引
+
+每部韵书由一个源文件编译成 data/index/<韵书>.rhyme，运行时 mmap 映射：
+    头部      magic, 韵部数, 韵字数, 扩展区字数, 主读音表项数, 源文件哈希
+    韵部目录  每个韵部：声调(u8) + 韵字起点(u32) + 韵字数(u32) + 名称长度(u16) + 名称
+    韵字表    u32 码位，按韵部依次排列（即 /api/search_yun 返回的 zi）
+    读音表    u32 偏移数组（韵字数 + 1）+ UTF-8 数据区，与韵字表一一对应（没有读音时为空串）
+    扩展区    基本区以外的字：码位(u32) + 韵部编号(u16)
+    主读音表  多音字中主读音所在韵部不是第一个的：码位(u32) + 主读音韵部编号(u16)
+    位图      每个韵部一个位图，覆盖 CJK 基本区 U+4E00–U+9FFF，每字 1 位（每个韵部约 2.6 KB）
+
+查一个字只需逐个韵部测一位；多音字（见 build_xinyun.py）会返回它所在的全部韵部及对应读音，
+主读音（duoyinzi.txt 的第一个读音，其次 pypinyin 的第一个读音）所在的韵部排在最前，
+/api/search_yun 的 yun、zi 即取这个韵部，如 行 为 十一庚（xíng）而不是 十唐（háng）。
+平水韵、词林正韵没有读音信息，韵部按源文件顺序排列。
+位图和扩展区除韵字本身外还收了它们的繁体写法（只用无歧义的单字转换），繁简都能反查。
+每个韵部的 zi 列表默认按全量语料中的韵脚字频排序（见 rhyme_freq.py），排序结果和序列化好的
+JSON 片段在第一次用到时生成并常驻，每个字的完整响应体也按字缓存。
+
+韵书在第一次被请求时才编译 / 打开，之后常驻内存；源文件哈希与编译产物不一致时自动重新编译。
+
+使用方法：
+    python yun_index.py                  # 编译全部韵书
+    python yun_index.py bench            # 对比线性查找与反查索引的耗时
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from corpus import BASE, file_digest, index_path, load_json
+from normalize import unambiguous_chars
+from rhyme_freq import load_rhyme_freq
+
+try:
+    from pypinyin.pinyin_dict import pinyin_dict
+except ImportError:
+    pinyin_dict = None
+
+YUN_PATH = os.path.join(BASE, "zhonghua_xinyun.json")
+PINGSHUI_PATH = os.path.join(BASE, "pingshui.txt")
+DUOYINZI_PATH = os.path.join(BASE, "duoyinzi.txt")
+
+MAGIC = b"PRHYM\x00\x00\x03"
+HEADER = struct.Struct("<8sIIII20s")
+GROUP = struct.Struct("<BIIH")
+EXTRA = struct.Struct("<IH")
+
+# 位图覆盖的范围：CJK 统一表意文字基本区 U+4E00–U+9FFF
+CJK_START = 0x4E00
+CJK_SPAN = 0xA000 - 0x4E00
+BITMAP_BYTES = CJK_SPAN // 8
+PUNCTUATION = set("，。！？；：、,.!?;:（）()《》“”‘’\"'-—…·")
+
+# 韵字排列顺序：freq 按韵脚字频从高到低（字频表缺失时与 file 相同），file 为源文件顺序
+ORDERS = ("freq", "file")
+
+# 韵部的声调编号：0 不分声调（中华新韵、词林正韵舒声各部），1 平 2 上 3 去 4 入（平水韵）
+TONE_CODES = {"上平": 1, "下平": 1, "上声": 2, "去声": 3, "入声": 4}
+
+
+# ===== 源文件 =====
+# 每部韵书的读取函数返回韵部列表：(名称, 声调编号, 韵字列表, 反查用的字集合, 字 -> 读音)
+def read_xinyun(path=YUN_PATH):
+    groups = []
+    for name, data in load_json(path).items():
+        zi = data.get("zi", [])
+        groups.append((name, 0, zi, set(zi), data.get("duyin", {})))
+    return groups
+
+
+def read_pingshui(path=PINGSHUI_PATH):
+    """平水韵原书为繁体；韵字表给出简体写法，反查时繁简都能查到（只用无歧义的单字转换）"""
+    simplify = unambiguous_chars()
+    groups = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            tone, label, chars = line.split("\t")
+            zi = list(dict.fromkeys(simplify.get(ch, ch) for ch in chars))
+            # 韵部名称如 上平一东、下平八庚、入声一屋
+            groups.append((tone + label, TONE_CODES[tone], zi, set(chars) | set(zi), {}))
+    return groups
+
+
+# 词林正韵十九部：每部由哪些平水韵韵目合成（按韵目末字，平上去三声通押，入声独立成部）
+# 佳、灰、元、泰、卦、队等韵目词林正韵只取一半，这里不细分，整个韵目同时归入两部
+CILIN_PARTS = (
+    ("第一部", "东冬董肿送宋"),
+    ("第二部", "江阳讲养绛漾"),
+    ("第三部", "支微齐灰纸尾荠贿寘未霁泰队"),
+    ("第四部", "鱼虞语麌御遇"),
+    ("第五部", "佳灰蟹贿泰卦队"),
+    ("第六部", "真文元轸吻阮震问愿"),
+    ("第七部", "元寒删先阮旱潸铣愿翰谏霰"),
+    ("第八部", "萧肴豪筿巧皓啸效号"),
+    ("第九部", "歌哿个"),
+    ("第十部", "佳麻蟹马卦祃"),
+    ("第十一部", "庚青蒸梗迥敬径"),
+    ("第十二部", "尤有宥"),
+    ("第十三部", "侵寝沁"),
+    ("第十四部", "覃盐咸感琰豏勘艳陷"),
+    ("第十五部", "屋沃"),
+    ("第十六部", "觉药"),
+    ("第十七部", "质陌锡职缉"),
+    ("第十八部", "物月曷黠屑叶"),
+    ("第十九部", "合洽"),
+)
+
+
+def read_cilin(path=PINGSHUI_PATH):
+    """词林正韵：由平水韵韵目合并而成，词用韵宽于诗；舒声各部不分声调，入声五部声调为入"""
+    pingshui = {name: group for name, *group in read_pingshui(path)}
+    groups = []
+    for part, heads in CILIN_PARTS:
+        members = [group for name, group in pingshui.items() if name[-1] in heads]
+        zi = list(dict.fromkeys(ch for _, group_zi, _, _ in members for ch in group_zi))
+        tone = TONE_CODES["入声"] if all(t == TONE_CODES["入声"] for t, *_ in members) else 0
+        groups.append((part, tone, zi, set().union(*(chars for _, _, chars, _ in members)), {}))
+    return groups
+
+
+# 韵书名称 -> (显示名称, 源文件, 读取函数)
+BOOKS = {
+    "xinyun": ("中华新韵", YUN_PATH, read_xinyun),
+    "pingshui": ("平水韵", PINGSHUI_PATH, read_pingshui),
+    "cilin": ("词林正韵", PINGSHUI_PATH, read_cilin),
+}
+DEFAULT_BOOK = "xinyun"
+# 词默认用词林正韵：按中华新韵或平水韵检查，词牌例词常被判为不押韵
+CI_BOOK = "cilin"
+
+
+def book_path(name):
+    return index_path(f"{name}.rhyme")
+
+
+# ===== 主读音 =====
+def load_primary_readings(path=DUOYINZI_PATH):
+    """多音字补充表：字 -> 第一个读音（即主读音）；文件不存在时为空"""
+    primary = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                ch, _, readings = line.partition("\t")
+                if ch and readings.split():
+                    primary[ch] = readings.split()[0]
+    except OSError:
+        pass
+    return primary
+
+
+def primary_groups(groups):
+    """
+    多音字 -> 主读音所在的韵部编号，只收主读音韵部不是第一个的字
+    主读音取补充表的第一个读音，其次 pypinyin 的第一个读音；韵书没有读音信息时为空
+    """
+    supplement = load_primary_readings()
+    memberships = {}
+    for gid, (_, _, zi, _, duyin) in enumerate(groups):
+        for ch in zi:
+            if duyin.get(ch):
+                memberships.setdefault(ch, []).append(gid)
+    primary = {}
+    for ch, gids in memberships.items():
+        if len(gids) < 2:
+            continue
+        reading = supplement.get(ch)
+        if reading is None and pinyin_dict is not None and ord(ch) in pinyin_dict:
+            reading = pinyin_dict[ord(ch)].split(",")[0]
+        for gid in gids[1:]:
+            if reading in groups[gid][4][ch].split():
+                primary[ch] = gid
+                break
+    return primary
+
+
+# ===== 编译 =====
+def compile_book(name, output=None):
+    """读取源文件并写出编译产物，返回韵部数"""
+    _, source, reader = BOOKS[name]
+    output = output or book_path(name)
+    digest = file_digest(source)
+    groups = reader(source)
+    # 简体韵字 -> 繁体写法，加进反查用的字集合
+    traditional = {}
+    for t, simplified in unambiguous_chars().items():
+        traditional.setdefault(simplified, []).append(t)
+
+    members = []
+    readings = []
+    extras = []
+    bitmaps = []
+    directory = []
+    for gid, (group_name, tone, zi, index_chars, duyin) in enumerate(groups):
+        directory.append((tone, len(members), len(zi), group_name.encode("utf-8")))
+        members.extend(ord(ch) for ch in zi)
+        readings.extend(duyin.get(ch, "").encode("utf-8") for ch in zi)
+        bits = bytearray(BITMAP_BYTES)
+        for ch in index_chars.union(*(traditional.get(ch, ()) for ch in zi)):
+            cp = ord(ch) - CJK_START
+            if 0 <= cp < CJK_SPAN:
+                bits[cp >> 3] |= 1 << (cp & 7)
+            else:
+                extras.append((ord(ch), gid))
+        bitmaps.append(bytes(bits))
+
+    offsets = [0]
+    for data in readings:
+        offsets.append(offsets[-1] + len(data))
+    primary = sorted((ord(ch), gid) for ch, gid in primary_groups(groups).items())
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(groups), len(members), len(extras), len(primary), digest))
+        for tone, start, count, raw in directory:
+            f.write(GROUP.pack(tone, start, count, len(raw)) + raw)
+        f.write(struct.pack(f"<{len(members)}I", *members))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(readings))
+        f.write(b"".join(EXTRA.pack(*e) for e in sorted(extras)))
+        f.write(b"".join(EXTRA.pack(*p) for p in primary))
+        f.write(b"".join(bitmaps))
+    os.replace(tmp, output)
+    return len(groups)
+
+
+# ===== 读取 =====
+class RhymeBook:
+    def __init__(self, name, path, freq=None):
+        self.name = name
+        # 字 -> 做韵脚的次数
+        self.freq = freq or {}
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_groups, n_members, n_extra, n_primary, self.digest = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"韵书格式不匹配: {path}")
+        self.names = []
+        self.tones = []
+        self._ranges = []
+        pos = HEADER.size
+        for _ in range(n_groups):
+            tone, start, count, name_len = GROUP.unpack_from(self.mm, pos)
+            pos += GROUP.size
+            self.names.append(self.mm[pos:pos + name_len].decode("utf-8"))
+            pos += name_len
+            self.tones.append(tone)
+            self._ranges.append((start, count))
+        self._members_pos = pos
+        self._offsets_pos = pos + n_members * 4
+        self._blob_pos = self._offsets_pos + (n_members + 1) * 4
+        (blob_len,) = struct.unpack_from("<I", self.mm, self._offsets_pos + n_members * 4)
+        pos = self._blob_pos + blob_len
+        self._extra = {}
+        for i in range(n_extra):
+            cp, gid = EXTRA.unpack_from(self.mm, pos + i * EXTRA.size)
+            self._extra[chr(cp)] = self._extra.get(chr(cp), ()) + (gid,)
+        pos += n_extra * EXTRA.size
+        # 多音字 -> 主读音所在的韵部
+        self._primary = {chr(cp): gid for cp, gid in EXTRA.iter_unpack(self.mm[pos:pos + n_primary * EXTRA.size])}
+        self._bitmap_pos = pos + n_primary * EXTRA.size
+        self._ids = {}
+        self._ranked = {}
+        self._zi_json = {}
+        self._duyin = {}
+        self._bodies = {}
+
+    def group_ids(self, ch):
+        """
+        该字所在的全部韵部编号：主读音所在的韵部在前，其余按源文件中的顺序
+        按字缓存，批量打分时同一个字不再逐个韵部测位
+        """
+        ids = self._ids.get(ch)
+        if ids is not None:
+            return ids
+        cp = ord(ch) - CJK_START if len(ch) == 1 else -1
+        if not 0 <= cp < CJK_SPAN:
+            ids = self._extra.get(ch, ())
+        else:
+            mm, mask = self.mm, 1 << (cp & 7)
+            pos = self._bitmap_pos + (cp >> 3)
+            ids = tuple(gid for gid in range(len(self.names)) if mm[pos + gid * BITMAP_BYTES] & mask)
+        if len(ids) > 1:
+            first = self._primary.get(ch, self._primary.get(_simplify().get(ch, ch)))
+            if first in ids and first != ids[0]:
+                ids = (first,) + tuple(gid for gid in ids if gid != first)
+        if len(ch) == 1:
+            # 单字的个数是有限的，缓存不会无限增长
+            self._ids[ch] = ids
+        return ids
+
+    def __contains__(self, ch):
+        return bool(self.group_ids(ch))
+
+    def zi(self, gid):
+        start, count = self._ranges[gid]
+        return [chr(cp) for cp in struct.unpack_from(f"<{count}I", self.mm, self._members_pos + start * 4)]
+
+    def ranked(self, gid):
+        """按韵脚字频从高到低排列的韵字（同频保持源文件顺序）"""
+        zi = self._ranked.get(gid)
+        if zi is None:
+            zi = self._ranked[gid] = sorted(self.zi(gid), key=lambda ch: -self.freq.get(ch, 0))
+        return zi
+
+    def _group_json(self, gid, order="freq", top=None):
+        """韵部的 (zi, counts) JSON 片段，counts 为各韵字做韵脚的次数；取全部时缓存"""
+        parts = self._zi_json.get((gid, order)) if top is None else None
+        if parts is None:
+            zi = self.ranked(gid) if order == "freq" else self.zi(gid)
+            zi = zi[:top] if top else zi
+            parts = (json.dumps(zi, ensure_ascii=False), json.dumps([self.freq.get(ch, 0) for ch in zi]))
+            if top is None:
+                self._zi_json[(gid, order)] = parts
+        return parts
+
+    def _group_duyin(self, gid):
+        """韵部内 字 -> 读音（没有读音的字不收）"""
+        duyin = self._duyin.get(gid)
+        if duyin is None:
+            start, count = self._ranges[gid]
+            offsets = struct.unpack_from(f"<{count + 1}I", self.mm, self._offsets_pos + start * 4)
+            duyin = {}
+            for ch, a, b in zip(self.zi(gid), offsets, offsets[1:]):
+                if b > a:
+                    duyin[ch] = self.mm[self._blob_pos + a:self._blob_pos + b].decode("utf-8")
+            self._duyin[gid] = duyin
+        return duyin
+
+    def lookup(self, ch):
+        """该字所在的全部韵部名称"""
+        return [self.names[gid] for gid in self.group_ids(ch)]
+
+    def readings(self, ch, ids=None):
+        """韵部名称 -> 使该字归入此韵部的读音（韵书没有读音信息时为空）；读音按简体韵字记录"""
+        readings = {}
+        simplified = _simplify().get(ch, ch)
+        for gid in self.group_ids(ch) if ids is None else ids:
+            duyin = self._group_duyin(gid)
+            reading = duyin.get(ch) or duyin.get(simplified)
+            if reading:
+                readings[self.names[gid]] = reading
+        return readings
+
+    def body(self, ch, order="freq", top=None):
+        """
+        /api/search_yun 的响应体（UTF-8 bytes）；该字不在任何韵部时返回 None
+        order 见 ORDERS；top 为只取前若干个韵字。不带 top 的响应体按字缓存
+        """
+        key = (ch, order)
+        body = self._bodies.get(key) if top is None else None
+        if body is None:
+            ids = self.group_ids(ch)
+            if not ids:
+                return None
+            first = ids[0]
+            zi, counts = self._group_json(first, order, top)
+            # 字段顺序与 jsonify 的 sort_keys 输出一致
+            body = (
+                '{"book": ' + json.dumps(self.name)
+                + ', "char": ' + json.dumps(ch, ensure_ascii=False)
+                + ', "counts": ' + counts
+                + ', "duyin": ' + json.dumps(self.readings(ch, ids), ensure_ascii=False)
+                + ', "order": ' + json.dumps(order)
+                + ', "yun": ' + json.dumps(self.names[first], ensure_ascii=False)
+                + ', "yuns": ' + json.dumps([self.names[g] for g in ids], ensure_ascii=False)
+                + ', "zi": ' + zi + "}"
+            ).encode("utf-8")
+            if top is None:
+                # 可能出现的字是有限的（全部收录字），缓存不会无限增长
+                self._bodies[key] = body
+        return body
+
+    def batch_body(self, texts, order="freq", top=None):
+        """
+        一次查询多个字或整句：texts 为字符串列表，逐字查找（重复的字只查一次，跳过标点空白）
+        返回响应体 bytes：chars 为 字 -> 韵部名称列表，duyin 为 字 -> {韵部: 读音}，
+        groups 为涉及到的韵部 -> zi（每个韵部只出现一次），missing 为不在任何韵部中的字
+        order、top 同 body()
+        """
+        chars = {}
+        duyin = {}
+        missing = []
+        used = []
+        for text in texts:
+            for ch in text:
+                if ch in chars or ch in missing or not ch.strip() or ch in PUNCTUATION:
+                    continue
+                ids = self.group_ids(ch)
+                if not ids:
+                    missing.append(ch)
+                    continue
+                chars[ch] = [self.names[gid] for gid in ids]
+                readings = self.readings(ch, ids)
+                if readings:
+                    duyin[ch] = readings
+                used.extend(gid for gid in ids if gid not in used)
+        groups = ", ".join(json.dumps(self.names[gid], ensure_ascii=False) + ": " + self._group_json(gid, order, top)[0]
+                           for gid in sorted(used))
+        return (
+            '{"book": ' + json.dumps(self.name)
+            + ', "chars": ' + json.dumps(chars, ensure_ascii=False)
+            + ', "duyin": ' + json.dumps(duyin, ensure_ascii=False)
+            + ', "groups": {' + groups + "}"
+            + ', "missing": ' + json.dumps(missing, ensure_ascii=False) + "}"
+        ).encode("utf-8")
+
+
+# ===== 按需加载 =====
+_books = {}
+_lock = threading.Lock()
+_simplified = None
+
+
+def _simplify():
+    """无歧义的繁体字 -> 简体字，查读音时用"""
+    global _simplified
+    if _simplified is None:
+        _simplified = unambiguous_chars()
+    return _simplified
+
+
+def _open_book(name):
+    """打开编译产物；不存在或源文件已改动时先重新编译"""
+    path = book_path(name)
+    _, source, _ = BOOKS[name]
+    freq = load_rhyme_freq()
+    try:
+        book = RhymeBook(name, path, freq)
+        if book.digest == file_digest(source):
+            return book
+    except (OSError, ValueError):
+        pass
+    compile_book(name, path)
+    return RhymeBook(name, path, freq)
+
+
+def get_book(name=DEFAULT_BOOK):
+    """取一部韵书：第一次请求时编译 / 打开，之后常驻；未知韵书或加载失败时返回 None"""
+    book = _books.get(name)
+    if book is not None or name not in BOOKS:
+        return book
+    with _lock:
+        book = _books.get(name)
+        if book is None:
+            try:
+                book = _books[name] = _open_book(name)
+            except Exception as e:
+                print(f"韵书 {name} 加载失败:", e)
+    return book
+
+
+def book_sources():
+    """各韵书的源文件（去重，平水韵和词林正韵共用一个）"""
+    return list(dict.fromkeys(source for _, source, _ in BOOKS.values()))
+
+
+def reload_books(changed):
+    """源文件改动后重新编译已加载的韵书并替换；未加载的韵书下次请求时自然会重新编译"""
+    changed = set(changed)
+    for name, (_, source, _) in BOOKS.items():
+        if source in changed and name in _books:
+            compile_book(name)
+            _books[name] = RhymeBook(name, book_path(name), _books[name].freq)
+
+
+def reload_rhyme_freq():
+    """字频表重新生成后，已加载的韵书换上新字频（排序缓存随新对象一起重建）"""
+    freq = load_rhyme_freq()
+    for name in list(_books):
+        _books[name] = RhymeBook(name, book_path(name), freq)
+
+
+# ===== 基准测试 =====
+def _linear_lookup(yunbu_data, ch):
+    for name, data in yunbu_data.items():
+        if ch in data.get("zi", []):
+            return name, data["zi"]
+    return None, []
+
+
+def bench(rounds=20):
+    yunbu_data = load_json(YUN_PATH)
+    chars = [ch for data in yunbu_data.values() for ch in data.get("zi", [])]
+    queries = chars + ["𠀀"] * (len(chars) // 10)  # 混入一成查不到的字
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for ch in queries:
+            _, zi = _linear_lookup(yunbu_data, ch)
+            if zi:
+                json.dumps({"char": ch, "zi": zi}, ensure_ascii=False)
+    linear = (time.perf_counter() - started) / (rounds * len(queries))
+
+    started = time.perf_counter()
+    book = _open_book("xinyun")
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for ch in queries:
+            book.body(ch)
+    indexed = (time.perf_counter() - started) / (rounds * len(queries))
+
+    print(f"📊 {len(yunbu_data)} 个韵部，{len(chars)} 个字，{len(queries)} 次查询 × {rounds} 轮")
+    print(f"   线性查找 + 序列化  {linear * 1e6:8.2f} µs/次")
+    print(f"   反查索引 + 缓存    {indexed * 1e6:8.2f} µs/次（打开韵书 {build * 1e3:.1f} ms）")
+    print(f"   加速比            {linear / indexed:8.1f}x")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["bench"]:
+        bench()
+    else:
+        for name, (title, _, _) in BOOKS.items():
+            started = time.perf_counter()
+            n_groups = compile_book(name)
+            print(f"✅ {title}（{name}）: {n_groups} 个韵部，{os.path.getsize(book_path(name))} 字节，"
+                  f"{(time.perf_counter() - started) * 1e3:.0f} ms")